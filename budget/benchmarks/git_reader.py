@@ -0,0 +1,92 @@
+"""
+Compares reading the tracked CSV files at every commit through GitPython
+(a tree lookup and blob read per commit) against the bulk reader in
+budget.load.git_history (one 'git log' and one 'git cat-file --batch')
+
+python3 benchmarks/git_reader.py [DATA_DIR]
+
+DATA_DIR defaults to MINT_DATA. Parsed rows aren't cached here,
+this is just measuring the git walk and reading blob contents
+"""
+
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterator, Tuple
+
+import click
+from git.repo.base import Repo  # type: ignore[import]
+
+from budget import get_data_dir
+from budget.load.balances import BALANCES, MANUAL_BALANCES
+from budget.load.transactions import TRANSACTION_FILE
+from budget.load.git_history import BlobReader, iter_commit_blobs
+
+TRACKED = (BALANCES, MANUAL_BALANCES, TRANSACTION_FILE)
+
+
+def gitpython_walk(ddir: Path) -> Tuple[int, int]:
+    commits, nbytes = 0, 0
+    for commit in Repo(str(ddir)).iter_commits():
+        commits += 1
+        commit.authored_datetime
+        for filename in TRACKED:
+            try:
+                blob = commit.tree / filename
+            except KeyError:
+                continue
+            nbytes += len(blob.data_stream.read())
+    return commits, nbytes
+
+
+def bulk_walk(ddir: Path) -> Tuple[int, int]:
+    commits, nbytes = 0, 0
+    with BlobReader(ddir) as reader:
+        for commit in iter_commit_blobs(ddir, TRACKED):
+            commits += 1
+            for sha in commit.blobs.values():
+                nbytes += len(reader.read(sha))
+    return commits, nbytes
+
+
+def bulk_walk_unique(ddir: Path) -> Tuple[int, int]:
+    # what the loaders actually do, each blob is only read once
+    commits, nbytes = 0, 0
+    seen: Dict[str, int] = {}
+    with BlobReader(ddir) as reader:
+        for commit in iter_commit_blobs(ddir, TRACKED):
+            commits += 1
+            for sha in commit.blobs.values():
+                if sha not in seen:
+                    seen[sha] = len(reader.read(sha))
+                nbytes += seen[sha]
+    return commits, nbytes
+
+
+def timed(
+    runs: int, func: Callable[[Path], Tuple[int, int]], ddir: Path
+) -> Iterator[Tuple[float, int, int]]:
+    for _ in range(runs):
+        start = time.perf_counter()
+        commits, nbytes = func(ddir)
+        yield time.perf_counter() - start, commits, nbytes
+
+
+@click.command()
+@click.argument("data_dir", required=False, type=click.Path(exists=True))
+@click.option("--runs", default=3, show_default=True, help="best of N runs")
+def main(data_dir: str, runs: int) -> None:
+    ddir = Path(data_dir) if data_dir else get_data_dir()
+    for name, func in (
+        ("gitpython", gitpython_walk),
+        ("bulk", bulk_walk),
+        ("bulk (unique blobs)", bulk_walk_unique),
+    ):
+        best, commits, nbytes = min(timed(runs, func, ddir))
+        click.echo(
+            f"{name:<20} {best:8.3f}s  {commits:>6} commits  {nbytes / 1e6:8.1f}MB"
+        )
+
+
+if __name__ == "__main__":
+    sys.exit(main())
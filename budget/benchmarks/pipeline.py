@@ -0,0 +1,253 @@
+"""
+Times each stage of loading/cleaning/summarizing the data against a
+synthetic data repo (see benchmarks/synthetic.py), and writes the
+results as JSON, so runs from different commits can be compared
+
+python3 benchmarks/pipeline.py run --commits 2000 -o before.json
+python3 benchmarks/pipeline.py run --commits 2000 -o after.json
+python3 benchmarks/pipeline.py compare before.json after.json
+
+Each stage gets the same input every run, and the best of --runs is
+reported. By default the blob cache is disabled, so the loaders
+parse/dedup everything each time and the rules are applied to every
+transaction; --cache uses a fresh cache directory instead, so the first
+run is cold and the rest are warm
+"""
+
+import io
+import os
+import sys
+import copy
+import json
+import time
+import platform
+import tempfile
+import subprocess
+import contextlib
+from pathlib import Path
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sized, Tuple
+
+import click
+
+from synthetic import RepoSpec, generate
+
+STAGES = (
+    "generate_account_history",
+    "read_transactions_history",
+    "transform_all",
+    "remove_outliers",
+    "recent_spending",
+)
+
+
+def _revision() -> Optional[str]:
+    # which commit of this repo is being benchmarked
+    proc = subprocess.run(
+        ["git", "-C", str(Path(__file__).parent), "rev-parse", "HEAD"],
+        capture_output=True,
+        text=True,
+    )
+    return proc.stdout.strip() if proc.returncode == 0 else None
+
+
+def time_stage(
+    runs: int, setup: Callable[[], Any], func: Callable[[Any], Sized]
+) -> Dict[str, Any]:
+    """
+    Call func(setup()) runs times, only timing func. Returns the timings
+    and how many items func returned
+    """
+    timings: List[float] = []
+    items = 0
+    for _ in range(runs):
+        arg = setup()
+        start = time.perf_counter()
+        # consume any generators inside the timed section
+        items = len(func(arg))
+        timings.append(time.perf_counter() - start)
+    return {
+        "best": min(timings),
+        "mean": sum(timings) / len(timings),
+        "runs": timings,
+        "items": items,
+    }
+
+
+@contextlib.contextmanager
+def cache_env(use_cache: bool) -> Iterator[None]:
+    old = {k: os.environ.get(k) for k in ("BUDGET_CACHE_DIR", "BUDGET_NO_CACHE")}
+    with tempfile.TemporaryDirectory(prefix="budget-bench-cache-") as cache_dir:
+        if use_cache:
+            os.environ["BUDGET_CACHE_DIR"] = cache_dir
+            os.environ.pop("BUDGET_NO_CACHE", None)
+        else:
+            os.environ["BUDGET_NO_CACHE"] = "1"
+        try:
+            yield
+        finally:
+            for key, val in old.items():
+                if val is None:
+                    os.environ.pop(key, None)
+                else:
+                    os.environ[key] = val
+
+
+def benchmark(ddir: Path, runs: int, jobs: int) -> Dict[str, Dict[str, Any]]:
+    import warnings
+
+    # no maps_conf.py, that's fine for timing
+    warnings.simplefilter("ignore")
+
+    from budget.load.balances import generate_account_history
+    from budget.load.transactions import Transaction, read_transactions_history
+    from budget.cleandata.transactions.transform import transform_all  # type: ignore[attr-defined]
+    from budget.cleandata.transactions.meta_categories import META_CATEGORIES
+    from budget.analyze.balance_history import BalanceMatrix, remove_outliers
+    from budget.analyze.summary import recent_spending
+
+    results: Dict[str, Dict[str, Any]] = {}
+
+    results["generate_account_history"] = time_stage(
+        runs, lambda: ddir, lambda d: list(generate_account_history(d, jobs=jobs))
+    )
+    results["read_transactions_history"] = time_stage(
+        runs, lambda: ddir, lambda d: list(read_transactions_history(d, jobs=jobs))
+    )
+
+    # the inputs to the later stages, computed once
+    snapshots = sorted(generate_account_history(ddir, jobs=jobs), key=lambda s: s.at)
+    transactions = list(read_transactions_history(ddir, jobs=jobs))
+    transformed: List[Transaction] = list(transform_all(copy.deepcopy(transactions)))
+    for tr in transformed:
+        tr.meta_category = META_CATEGORIES.get(tr.category)
+
+    # transform_all edits the transactions, so each run gets a copy
+    results["transform_all"] = time_stage(
+        runs,
+        lambda: copy.deepcopy(transactions),
+        lambda trs: list(transform_all(trs)),
+    )
+    results["remove_outliers"] = time_stage(
+        runs,
+        lambda: snapshots,
+        lambda sns: remove_outliers(BalanceMatrix.from_snapshots(sns), print=False),
+    )
+
+    def summarize(trs: List[Transaction]) -> Any:
+        # dont print the summary while timing it
+        with contextlib.redirect_stdout(io.StringIO()):
+            return recent_spending(trs)
+
+    results["recent_spending"] = time_stage(runs, lambda: transformed, summarize)
+    return results
+
+
+@click.group()
+def main() -> None:
+    pass
+
+
+@main.command()
+@click.option(
+    "--data-dir",
+    type=click.Path(exists=True, file_okay=False, path_type=Path),
+    help="Benchmark an existing data repo instead of generating one",
+)
+@click.option("--commits", default=RepoSpec.commits, show_default=True)
+@click.option("--accounts", default=RepoSpec.accounts, show_default=True)
+@click.option(
+    "--per-commit",
+    default=RepoSpec.per_commit,
+    show_default=True,
+    help="average new transactions per commit",
+)
+@click.option("--window-days", default=RepoSpec.window_days, show_default=True)
+@click.option("--rename-share", default=RepoSpec.rename_share, show_default=True)
+@click.option("--shift-share", default=RepoSpec.shift_share, show_default=True)
+@click.option("--outlier-share", default=RepoSpec.outlier_share, show_default=True)
+@click.option("--seed", default=RepoSpec.seed, show_default=True)
+@click.option("--runs", default=3, show_default=True, help="best of N runs")
+@click.option(
+    "-j", "--jobs", default=1, show_default=True, help="processes to parse with"
+)
+@click.option("--cache", is_flag=True, default=False, help="use the blob cache")
+@click.option(
+    "-o",
+    "--output",
+    type=click.Path(dir_okay=False, path_type=Path),
+    help="JSON file to write results to, else prints them",
+)
+def run(
+    data_dir: Optional[Path],
+    runs: int,
+    jobs: int,
+    cache: bool,
+    output: Optional[Path],
+    **spec_args: Any,
+) -> None:
+    """
+    Time each stage of the pipeline
+    """
+    meta: Dict[str, Any] = {
+        "revision": _revision(),
+        "created": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "runs": runs,
+        "jobs": jobs,
+        "cache": cache,
+    }
+    with contextlib.ExitStack() as stack:
+        if data_dir is None:
+            tmp = stack.enter_context(
+                tempfile.TemporaryDirectory(prefix="budget-bench-data-")
+            )
+            data_dir = Path(tmp) / "data"
+            meta["repo"] = generate(data_dir, RepoSpec(**spec_args))
+        else:
+            meta["repo"] = str(data_dir)
+        stack.enter_context(cache_env(cache))
+        results = benchmark(data_dir, runs, jobs)
+
+    for stage, res in results.items():
+        click.echo(
+            f"{stage:<28} {res['best']:8.3f}s  {res['items']:>7} items", err=True
+        )
+    dumped = json.dumps({"meta": meta, "results": results}, indent=2)
+    if output is None:
+        click.echo(dumped)
+    else:
+        output.write_text(dumped)
+
+
+def _load(path: Path) -> Tuple[Dict[str, Any], Dict[str, Dict[str, Any]]]:
+    data = json.loads(path.read_text())
+    return data["meta"], data["results"]
+
+
+@main.command()
+@click.argument("before", type=click.Path(exists=True, path_type=Path))
+@click.argument("after", type=click.Path(exists=True, path_type=Path))
+def compare(before: Path, after: Path) -> None:
+    """
+    Compare the best times from two runs
+    """
+    before_meta, before_res = _load(before)
+    after_meta, after_res = _load(after)
+    # the synthetic repos end on the day they were generated, that's fine
+    before_repo, after_repo = before_meta.get("repo"), after_meta.get("repo")
+    if isinstance(before_repo, dict) and isinstance(after_repo, dict):
+        before_repo = {k: v for k, v in before_repo.items() if k != "end"}
+        after_repo = {k: v for k, v in after_repo.items() if k != "end"}
+    if before_repo != after_repo:
+        click.secho("Warning: these were run against different repos", fg="yellow")
+    for stage in STAGES:
+        if stage not in before_res or stage not in after_res:
+            continue
+        old, new = before_res[stage]["best"], after_res[stage]["best"]
+        ratio = old / new if new else float("inf")
+        click.echo(f"{stage:<28} {old:8.3f}s -> {new:8.3f}s  ({ratio:5.2f}x)")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,279 @@
+"""
+Generates throwaway data repos that look like the ones ./mint fetch creates,
+to benchmark the loaders against without needing real data
+
+python3 benchmarks/synthetic.py OUTPUT_DIR --commits 2000 --accounts 6
+
+Each commit rewrites balances.csv/transactions.csv like a fetch would:
+transactions.csv has the last --window-days of transactions, so most rows
+show up again in the next commit, and some of those come back slightly
+renamed or with their date moved (like pending transactions getting
+approved). Balances drift randomly, with the occasional spike from a
+transfer between accounts showing up in one account before the other.
+
+The commits are written with 'git fast-import', so a repo with thousands
+of commits only takes a few seconds to create
+"""
+
+import csv
+import io
+import random
+import subprocess
+import sys
+from dataclasses import dataclass, asdict
+from datetime import date, datetime, time, timedelta, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+import click
+
+BALANCE_HEADER = [
+    "institution",
+    "account",
+    "type",
+    "current",
+    "available",
+    "limit",
+    "currency",
+]
+TRANSACTION_HEADER = ["date", "amount", "name", "account", "category"]
+
+MERCHANTS = [
+    "Starbucks #123",
+    "SPOTIFY USA",
+    "Lyft *ride Sun 8pm",
+    "Uber",
+    "UBER *TRIP",
+    "AMAZON PRIME",
+    "Amzn Mktp US*2K4",
+    "Safeway 44",
+    "McDonald's",
+    "Dennys 12",
+    "DoorDash*Chipotle",
+    "Trader Joe's #55",
+    "CVS/PHARMACY",
+    "Shell Oil 5745",
+    "github.com",
+    "Transfer to savings",
+    "CREDIT",
+    "PAYPAL HOLD",
+    "Interest Payment",
+]
+CATEGORIES = [
+    "Food & Dining",
+    "Coffee Shops",
+    "Subscriptions",
+    "Travel",
+    "Groceries",
+    "Transfer",
+    "Credit Card Payment",
+    "Shopping",
+    "Interest Income",
+    "Gas & Fuel",
+]
+# which part of the synthetic history commits happen at
+COMMIT_HOURS = 8
+
+
+@dataclass
+class RepoSpec:
+    commits: int = 1000
+    accounts: int = 4
+    # average number of new transactions per commit
+    per_commit: float = 2.0
+    # how far back transactions.csv goes at each commit
+    window_days: int = 40
+    # chance a recent row is renamed/has its date moved in the next commit
+    rename_share: float = 0.05
+    shift_share: float = 0.03
+    # chance a balance snapshot has a spike in one account
+    outlier_share: float = 0.02
+    seed: int = 0
+
+
+def _csv(header: Sequence[str], rows: Sequence[Sequence[Any]]) -> bytes:
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(header)
+    writer.writerows(rows)
+    return buf.getvalue().encode()
+
+
+def _account_names(n: int) -> List[List[str]]:
+    # [account name, type]
+    accounts = [["Checking", "depository"], ["Credit Card", "credit card"]]
+    for i in range(2, n):
+        if i % 3 == 0:
+            accounts.append([f"Credit Card {i}", "credit card"])
+        else:
+            accounts.append([f"Savings {i}", "depository"])
+    return accounts[:n]
+
+
+def _rename(name: str, rnd: random.Random) -> str:
+    if name.endswith(" PENDING"):
+        return name[: -len(" PENDING")]
+    return rnd.choice([name + " PENDING", name.upper(), name.replace(" ", "  ")])
+
+
+def _amount(rnd: random.Random) -> str:
+    kind = rnd.random()
+    if kind < 0.2:
+        return str(rnd.choice([5, 7, 10, 15, 20]))
+    if kind < 0.9:
+        return f"{rnd.uniform(1, 200):.2f}"
+    return f"{rnd.uniform(200, 1500):.2f}"
+
+
+def generate(
+    path: Path, spec: RepoSpec, end: Optional[date] = None
+) -> Dict[str, Any]:
+    """
+    Create a git repo at path (which shouldn't exist yet) with spec.commits
+    commits, the last of which is on end (defaults to today, so the recent
+    spending summaries have data). Returns some stats about the repo
+    """
+    rnd = random.Random(spec.seed)
+    end = end if end is not None else date.today()
+    last_commit = datetime.combine(end, time(8), tzinfo=timezone.utc)
+    first_commit = last_commit - timedelta(hours=COMMIT_HOURS * (spec.commits - 1))
+
+    accounts = _account_names(spec.accounts)
+    balances = {name: rnd.uniform(100, 5000) for name, _ in accounts}
+
+    path.mkdir(parents=True)
+    subprocess.run(["git", "init", "-q", str(path)], check=True)
+    ref = subprocess.run(
+        ["git", "-C", str(path), "symbolic-ref", "HEAD"],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout.strip()
+
+    stream = io.BytesIO()
+
+    def data(contents: bytes) -> None:
+        stream.write(f"data {len(contents)}\n".encode())
+        stream.write(contents)
+        stream.write(b"\n")
+
+    def commit(at: datetime, message: str, files: Dict[str, bytes]) -> None:
+        stamp = f"{int(at.timestamp())} +0000"
+        stream.write(f"commit {ref}\n".encode())
+        stream.write(f"author fetch <fetch@localhost> {stamp}\n".encode())
+        stream.write(f"committer fetch <fetch@localhost> {stamp}\n".encode())
+        data(message.encode())
+        for filename, contents in files.items():
+            stream.write(f"M 100644 inline {filename}\n".encode())
+            data(contents)
+
+    # rows currently in transactions.csv: [date, amount, name, account, category]
+    live: List[List[Any]] = []
+    added = 0
+    for i in range(spec.commits):
+        at = first_commit + timedelta(hours=COMMIT_HOURS * i)
+        today = at.date()
+        # roughly spec.per_commit new transactions
+        for _ in range(rnd.randint(0, round(spec.per_commit * 2))):
+            added += 1
+            live.append(
+                [
+                    today - timedelta(days=rnd.randint(0, 2)),
+                    _amount(rnd),
+                    rnd.choice(MERCHANTS),
+                    rnd.choice(accounts)[0],
+                    rnd.choice(CATEGORIES),
+                ]
+            )
+        for row in live[-15:]:
+            if rnd.random() < spec.rename_share:
+                row[2] = _rename(row[2], rnd)
+            if rnd.random() < spec.shift_share:
+                row[0] += timedelta(days=1)
+        cutoff = today - timedelta(days=spec.window_days)
+        live = [row for row in live if row[0] > cutoff]
+
+        # balances only change about half the time, the rest of the fetches
+        # write the same balances.csv again
+        spike: Optional[str] = None
+        if rnd.random() < 0.5:
+            for name in balances:
+                balances[name] += rnd.uniform(-60, 60)
+            if rnd.random() < spec.outlier_share:
+                spike = rnd.choice(accounts)[0]
+        balance_rows = [
+            [
+                "Bank",
+                name,
+                kind,
+                f"{balances[name] + (2500 if name == spike else 0):.2f}",
+                "",
+                "",
+                "",
+            ]
+            for name, kind in accounts
+        ]
+        files = {
+            "balances.csv": _csv(BALANCE_HEADER, balance_rows),
+            "transactions.csv": _csv(TRANSACTION_HEADER, live),
+        }
+        if i == 0 or rnd.random() < 0.02:
+            cash = f"{rnd.uniform(0, 100):.2f}"
+            files["manual_balances.csv"] = _csv(
+                BALANCE_HEADER, [["cash", "Wallet", "cash", cash, "", "", ""]]
+            )
+        commit(at, f"fetch {i}", files)
+
+    # transactions which were added before the history, edited by hand
+    old = [
+        [
+            first_commit.date() - timedelta(days=rnd.randint(30, 365)),
+            _amount(rnd),
+            rnd.choice(MERCHANTS),
+            rnd.choice(accounts)[0],
+            rnd.choice(CATEGORIES),
+        ]
+        for _ in range(50)
+    ]
+    commit(
+        last_commit + timedelta(minutes=1),
+        "static files",
+        {
+            "old_transactions.csv": _csv(TRANSACTION_HEADER, old),
+            "manual_transactions.csv": _csv(TRANSACTION_HEADER, []),
+        },
+    )
+
+    subprocess.run(
+        ["git", "-C", str(path), "fast-import", "--quiet"],
+        input=stream.getvalue(),
+        check=True,
+    )
+    subprocess.run(["git", "-C", str(path), "reset", "-q", "--hard"], check=True)
+    return {**asdict(spec), "end": end.isoformat(), "transactions_added": added}
+
+
+@click.command()
+@click.argument("output_dir", type=click.Path(exists=False, path_type=Path))
+@click.option("--commits", default=RepoSpec.commits, show_default=True)
+@click.option("--accounts", default=RepoSpec.accounts, show_default=True)
+@click.option(
+    "--per-commit",
+    default=RepoSpec.per_commit,
+    show_default=True,
+    help="average new transactions per commit",
+)
+@click.option("--window-days", default=RepoSpec.window_days, show_default=True)
+@click.option("--rename-share", default=RepoSpec.rename_share, show_default=True)
+@click.option("--shift-share", default=RepoSpec.shift_share, show_default=True)
+@click.option("--outlier-share", default=RepoSpec.outlier_share, show_default=True)
+@click.option("--seed", default=RepoSpec.seed, show_default=True)
+def main(output_dir: Path, **spec: Any) -> None:
+    if output_dir.exists():
+        raise click.BadParameter(f"{output_dir} already exists")
+    stats = generate(output_dir, RepoSpec(**spec))
+    click.echo(f"Created {output_dir}: {stats}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,11 +1,15 @@
 import os
 
 from pathlib import Path
-from typing import Tuple, List, Optional, TYPE_CHECKING
+from typing import Tuple, List, Optional, Sequence, TYPE_CHECKING
 
 if TYPE_CHECKING:
     from .load.transactions import Transaction
     from .load.balances import Snapshot
+    from .load.history import Bound, History
+    from .cleandata.pipeline import Stage
+    from .analyze.cube import SpendingCube
+    from .export import Export
 
 
 def get_data_dir() -> Path:
@@ -15,44 +19,154 @@ def get_data_dir() -> Path:
         raise RuntimeError("No MINT_DATA environment variable!")
 
 
-def data(
-    ddir: Optional[Path] = None, debug: bool = False
-) -> Tuple[List["Snapshot"], List["Transaction"]]:
-    import logging
-    from .log import logger
+class Dataset:
+    """
+    Loads and cleans the balance snapshots/transactions from the git history,
+    but only when they're first accessed, so something that only needs the
+    balances never reads the transaction history
 
-    from .load.transactions import (
-        read_transactions,
-    )
-    from .load.balances import generate_account_history
+    Both share one walk of the git history. jobs is the number of processes
+    used to parse the CSV files from the history (0 to use every core). Defaults
+    to 1, which parses everything in this process
+
+    since/until (a date, YYYY-MM-DD, or a commit) only load that part of the
+    history, see budget.load.history.Window
+
+    stages are run on each transaction after the default cleaning, see
+    budget.cleandata.pipeline
+    """
+
+    def __init__(
+        self,
+        ddir: Optional[Path] = None,
+        debug: bool = False,
+        jobs: int = 1,
+        since: Optional["Bound"] = None,
+        until: Optional["Bound"] = None,
+        stages: Sequence["Stage"] = (),
+    ) -> None:
+        if debug:
+            import logging
+            from .log import setup as log_setup
+
+            log_setup(level=logging.DEBUG)
+
+        self.ddir = ddir if ddir is not None else get_data_dir()
+        self.jobs = jobs
+        self.since = since
+        self.until = until
+        self.stages = stages
+        self._history: Optional["History"] = None
+        self._snapshots: Optional[List["Snapshot"]] = None
+        self._transactions: Optional[List["Transaction"]] = None
+        self._cube: Optional["SpendingCube"] = None
+
+    @property
+    def history(self) -> "History":
+        from .load.history import History, Window
 
-    from .cleandata.accounts.fix_account_names import clean_data
-    from .cleandata.transactions.transform import transform_all as transform  # type: ignore[attr-defined]
-    from .cleandata.transactions.meta_categories import META_CATEGORIES
+        if self._history is None:
+            window = Window.resolve(self.ddir, self.since, self.until)
+            self._history = History(self.ddir, jobs=self.jobs, window=window)
+        return self._history
 
-    if debug:
-        from .log import setup as log_setup
+    @property
+    def snapshots(self) -> List["Snapshot"]:
+        if self._snapshots is None:
+            from . import timing
+            from .load.balances import generate_account_history
+            from .cleandata.accounts.fix_account_names import clean_snapshots
 
-        log_setup(level=logging.DEBUG)
+            with self.history, timing.stage("load balances") as st:
+                snapshots = list(
+                    generate_account_history(self.ddir, history=self.history)
+                )
+                st.count(snapshots=len(snapshots))
+            with timing.stage("clean balances"):
+                self._snapshots = clean_snapshots(snapshots)
+        return self._snapshots
+
+    @property
+    def transactions(self) -> List["Transaction"]:
+        if self._transactions is None:
+            from . import timing
+            from .load.transactions import read_transactions_table
+            from .cleandata.pipeline import default_stages, run_stages
+
+            # cleaning uses the account names from the balances. For part of the
+            # history, use every account, so transactions get the same account
+            # as when loading everything
+            names = None
+            if self.history.window.bounded:
+                from .load.balances import history_accounts
+                from .cleandata.accounts.fix_account_names import (
+                    cleaned_account_names,
+                )
+
+                with self.history:
+                    accounts = history_accounts(self.ddir, history=self.history)
+                names = cleaned_account_names(accounts)
+            stages = default_stages(self.snapshots, names) + list(self.stages)
+            with self.history, timing.stage("load transactions") as st:
+                table = read_transactions_table(self.ddir, history=self.history)
+                st.count(rows=len(table))
+            # fix account names, transform the description/categories and
+            # set the meta category, in one pass over the transactions
+            with timing.stage("clean transactions") as st:
+                self._transactions = list(run_stages(table, stages))
+                st.count(rows=len(self._transactions))
+        return self._transactions
+
+    @property
+    def cube(self) -> "SpendingCube":
+        """
+        The spending totals for each month/account/category, see
+        budget.analyze.cube. When the whole history is loaded, the cube is
+        saved, and the next time only the months that changed are updated
+        """
+        if self._cube is None:
+            from .analyze.cube import spending_cube
+            from .load.transactions import TransactionTable
+
+            df = TransactionTable.from_transactions(self.transactions).to_dataframe()
+            # the cube for part of the history would replace the saved one
+            bounded = self.history.window.bounded
+            self._cube = spending_cube(df, None if bounded else self.ddir)
+        return self._cube
+
+
+def data(
+    ddir: Optional[Path] = None,
+    debug: bool = False,
+    jobs: int = 1,
+    since: Optional["Bound"] = None,
+    until: Optional["Bound"] = None,
+    stages: Sequence["Stage"] = (),
+) -> Tuple[List["Snapshot"], List["Transaction"]]:
+    """
+    Load and clean all the balance snapshots/transactions from the git history
+    (or just the ones between since/until)
 
-    if ddir is None:
-        ddir = get_data_dir()
+    See Dataset to only load one or the other
+    """
+    from . import timing
 
-    # load in and clean data
-    balance_snapshots, transactions = clean_data(
-        list(generate_account_history(ddir)),
-        list(read_transactions(ddir)),
+    dataset = Dataset(
+        ddir, debug=debug, jobs=jobs, since=since, until=until, stages=stages
     )
+    pstats = timing.env_pstats()
+    if pstats is None or timing.active() is not None:
+        return dataset.snapshots, dataset.transactions
+    # profile the whole load, e.g. when this is imported by something else
+    with timing.profiling(pstats):
+        return dataset.snapshots, dataset.transactions
 
-    # transform transaction description/categories
-    transactions = list(transform(transactions))
 
-    for tr in transactions:
-        if tr.category in META_CATEGORIES:
-            tr.meta_category = META_CATEGORIES[tr.category]
-        else:
-            logger.info(
-                "Couldn't find meta_category for {}: {}".format(tr.category, tr)
-            )
+def load_export(path: Optional[Path] = None, ddir: Optional[Path] = None) -> "Export":
+    """
+    Load the cleaned transactions/balances saved by 'budget export', in
+    a few milliseconds, see budget.export
+    """
+    from .export import load_export
 
-    return balance_snapshots, transactions
+    return load_export(path, ddir)
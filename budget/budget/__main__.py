@@ -1,7 +1,74 @@
 import sys
+from pathlib import Path
+from typing import Callable, Optional, Sequence, TYPE_CHECKING
 
 import click
 
+if TYPE_CHECKING:
+    from .load.history import Bound
+
+jobs_option = click.option(
+    "-j",
+    "--jobs",
+    default=1,
+    show_default=True,
+    type=int,
+    help="Number of processes to parse the git history with, 0 to use every core",
+)
+
+
+def profile_options(func: Callable[..., None]) -> Callable[..., None]:
+    func = click.option(
+        "--profile-json",
+        default=None,
+        type=click.Path(dir_okay=False, path_type=Path),
+        help="Save the --profile stage timings to this file as JSON",
+    )(func)
+    func = click.option(
+        "--profile",
+        default=False,
+        is_flag=True,
+        help="Print how long each stage of loading/analyzing took. Set "
+        "BUDGET_PROFILE to a file to save a pstats profile of the run",
+    )(func)
+    return func
+
+
+def _bound(
+    ctx: click.Context, param: click.Parameter, value: Optional[str]
+) -> Optional["Bound"]:
+    from .load.history import parse_bound
+
+    if value is None:
+        return None
+    try:
+        return parse_bound(value)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+
+def window_options(func: Callable[..., None]) -> Callable[..., None]:
+    func = click.option(
+        "--until",
+        default=None,
+        type=str,
+        callback=_bound,
+        help="Only load data up to this date (YYYY-MM-DD) or commit",
+    )(func)
+    func = click.option(
+        "--since",
+        default=None,
+        type=str,
+        callback=_bound,
+        help="Only load data from this date (YYYY-MM-DD) or commit onwards",
+    )(func)
+    return func
+
+
+def _require_snapshots(snapshots: Sequence[object]) -> None:
+    if not snapshots:
+        raise click.ClickException("No balance snapshots in that part of the history")
+
 
 @click.group()
 def main() -> None:
@@ -31,6 +98,20 @@ def edit_manual() -> None:
 @click.option(
     "--graph", default=False, is_flag=True, help="Show the graph of balance history"
 )
+@click.option(
+    "--headless",
+    default=False,
+    is_flag=True,
+    help="Save the graph of balance history without opening a window",
+)
+@click.option(
+    "--points",
+    default=2000,
+    show_default=True,
+    type=click.IntRange(min=0),
+    help="Downsample each account to about this many points in the graph, "
+    "0 to plot all of them",
+)
 @click.option("--repl", default=False, is_flag=True, help="Drop into repl")
 @click.option("--df", default=False, is_flag=True, help="Use dataframe in REPL")
 @click.option(
@@ -39,18 +120,40 @@ def edit_manual() -> None:
     is_flag=True,
     help="Print duplicate transactions that are removed",
 )
-def accounts(graph: bool, repl: bool, df: bool, debug: bool) -> None:
+@jobs_option
+@window_options
+@profile_options
+def accounts(
+    graph: bool,
+    headless: bool,
+    points: int,
+    repl: bool,
+    df: bool,
+    debug: bool,
+    jobs: int,
+    since: Optional["Bound"],
+    until: Optional["Bound"],
+    profile: bool,
+    profile_json: Optional[Path],
+) -> None:
     """
     Show a summary/graph of the current/past accounts balances
     """
-    from . import data
+    from . import Dataset
+    from .timing import cli_profiling
     from .analyze.balance_history import graph_account_balances
 
-    if graph:
+    # only needs the balances, dont load transactions
+    dataset = Dataset(debug=debug, jobs=jobs, since=since, until=until)
+    if graph or headless:
         try:
-            account_snapshots, _ = data(debug=debug)
-            account_snapshots.sort(key=lambda s: s.at)
-            graph_account_balances(account_snapshots, graph)
+            with cli_profiling(profile, profile_json):
+                account_snapshots = dataset.snapshots
+                _require_snapshots(account_snapshots)
+                account_snapshots.sort(key=lambda s: s.at)
+                graph_account_balances(
+                    account_snapshots, not headless, points=points or None
+                )
         except ModuleNotFoundError as m:
             click.echo(str(m), err=True)
             sys.exit(1)
@@ -59,11 +162,14 @@ def accounts(graph: bool, repl: bool, df: bool, debug: bool) -> None:
         from .analyze import cleaned_snapshots, cleaned_snapshots_df
 
         click.secho("Use 'snapshots' to interact with data", fg="green")
-        if df:
-            snapshots = cleaned_snapshots_df()
-        else:
-            # TODO(sean): fix timestamp
-            snapshots = list(cleaned_snapshots())  # type: ignore[assignment,arg-type]
+        with cli_profiling(profile, profile_json):
+            sorted_snapshots = sorted(dataset.snapshots, key=lambda s: s.at)
+            _require_snapshots(sorted_snapshots)
+            if df:
+                snapshots = cleaned_snapshots_df(sorted_snapshots, debug=debug)
+            else:
+                # TODO(sean): fix timestamp
+                snapshots = list(cleaned_snapshots(sorted_snapshots))  # type: ignore[assignment,arg-type]
         IPython.embed()
         sys.exit(0)
 
@@ -87,28 +193,115 @@ def accounts(graph: bool, repl: bool, df: bool, debug: bool) -> None:
     is_flag=True,
     help="Include items classified as transfers between accounts in summary",
 )
-def summary(repl: bool, debug: bool, include_transfers: bool) -> None:
+@click.option(
+    "--window",
+    "windows",
+    multiple=True,
+    metavar="DAYS[:COUNT[:BY]]",
+    help="Summarize the spending in the last DAYS ('all' for every transaction) "
+    "instead of the default windows, printing the COUNT largest transactions "
+    "('all' for every one, default 10), with totals by BY (default category). "
+    "Can be given more than once",
+)
+@jobs_option
+@window_options
+@profile_options
+def summary(
+    repl: bool,
+    debug: bool,
+    include_transfers: bool,
+    windows: Sequence[str],
+    jobs: int,
+    since: Optional["Bound"],
+    until: Optional["Bound"],
+    profile: bool,
+    profile_json: Optional[Path],
+) -> None:
     """
     Prints a summary of current accounts/recent transactions
     """
 
-    from . import data
-    from .analyze.summary import recent_spending, account_summary
+    from . import Dataset
+    from .timing import cli_profiling
+    from .analyze.summary import (
+        DEFAULT_WINDOWS,
+        account_summary,
+        parse_window,
+        recent_spending,
+    )
+
+    try:
+        spending_windows = [parse_window(w) for w in windows] or DEFAULT_WINDOWS
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="--window")
 
-    account_snapshots, transactions = data(debug=debug)
+    with cli_profiling(profile, profile_json):
+        dataset = Dataset(debug=debug, jobs=jobs, since=since, until=until)
+        account_snapshots, transactions = dataset.snapshots, dataset.transactions
+        _require_snapshots(account_snapshots)
+        # totals for each month/account/category, updated from the last run
+        cube = dataset.cube
 
-    spend = recent_spending(transactions, include_transfers=include_transfers)
-    acc = account_summary(account_snapshots)
+        spend = recent_spending(
+            transactions,
+            include_transfers=include_transfers,
+            windows=spending_windows,
+            cube=cube,
+        )
+        acc = account_summary(account_snapshots)
 
-    # sort by date
-    spend.sort_values(["on"], inplace=True)
+        # sort by date
+        spend.sort_values(["on"], inplace=True)
 
     if repl:
-        click.secho("Use 'acc' and 'spend' to interact", fg="green")
+        click.secho(
+            "Use 'acc', 'spend' and 'cube' (e.g. cube.compare('2022-05', '2022-04')) "
+            "to interact",
+            fg="green",
+        )
         import IPython  # type: ignore
 
         IPython.embed()
 
 
+@main.command()
+@click.argument(
+    "directory",
+    required=False,
+    type=click.Path(file_okay=False, path_type=Path),
+)
+@jobs_option
+@window_options
+@profile_options
+def export(
+    directory: Optional[Path],
+    jobs: int,
+    since: Optional["Bound"],
+    until: Optional["Bound"],
+    profile: bool,
+    profile_json: Optional[Path],
+) -> None:
+    """
+    Save the cleaned transactions/balances as Arrow files, to load with
+    budget.load_export(). DIRECTORY defaults to one in the cache directory
+    """
+    from . import Dataset
+    from .timing import cli_profiling
+    from .export import default_export_dir, write_export
+
+    dataset = Dataset(jobs=jobs, since=since, until=until)
+    path = directory if directory is not None else default_export_dir(dataset.ddir)
+    try:
+        with cli_profiling(profile, profile_json):
+            meta = write_export(dataset, path)
+    except ModuleNotFoundError as m:
+        click.echo(f"{m}, install it with 'pip install budget[export]'", err=True)
+        sys.exit(1)
+    click.echo(
+        f"Exported {meta['transactions']} transactions and {meta['snapshots']} "
+        f"snapshots (at {meta['head'][:10]}) to {path}"
+    )
+
+
 if __name__ == "__main__":
     main(prog_name="budget")
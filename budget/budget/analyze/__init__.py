@@ -2,55 +2,109 @@
 Exposes this (pandas/analysis code) info importable from across the system
 """
 
-from typing import List, Optional, Set, Iterator
-from datetime import datetime
+from typing import List, Optional, Iterator, TYPE_CHECKING
 
 import pandas as pd  # type: ignore[import]
 
-from .. import data
+from .. import Dataset
 from ..load.balances import Snapshot
-from ..load.transactions import Transaction
-from .balance_history import remove_outliers, SnapshotData, _to_snapshot_data
+from ..load.transactions import Transaction, TransactionTable
+from .balance_history import (
+    BalanceMatrix,
+    SnapshotData,
+    _to_snapshot_data,
+    outlier_snapshots,
+    outliers,
+    remove_outliers,
+)
+from .cube import SpendingCube
+
+if TYPE_CHECKING:
+    from ..export import Export
+
+
+def _sorted_snapshots(
+    sorted_snapshots: Optional[List[Snapshot]], debug: bool = False, jobs: int = 1
+) -> List[Snapshot]:
+    if sorted_snapshots is not None:
+        return sorted_snapshots
+    snapshots = Dataset(debug=debug, jobs=jobs).snapshots
+    snapshots.sort(key=lambda s: s.at)
+    return snapshots
 
 
 def cleaned_snapshots(
-    sorted_snapshots: Optional[List[Snapshot]] = None,
+    sorted_snapshots: Optional[List[Snapshot]] = None, jobs: int = 1
 ) -> Iterator[Snapshot]:
-    snapshots: List[Snapshot] = []
-    if sorted_snapshots is None:
-        snapshots, _ = data()
-        snapshots.sort(key=lambda s: s.at)
-    else:
-        snapshots = sorted_snapshots
+    snapshots = _sorted_snapshots(sorted_snapshots, jobs=jobs)
     # uses code in ./balance_history.py to remove outliers
-    df: SnapshotData = cleaned_snapshots_df(sorted_snapshots=snapshots)
-    # timestamps of snapshots that werent removed by outliers
-    use_datetimes: Set[datetime] = set([dt for _, dt in df])
-    for sn in snapshots:
-        if sn.at in use_datetimes:
+    keep = ~outliers(BalanceMatrix.from_snapshots(snapshots))
+    for sn, use in zip(snapshots, keep):
+        if use:
             yield sn
 
 
 def cleaned_snapshots_df(
-    sorted_snapshots: Optional[List[Snapshot]] = None, debug: bool = False
+    sorted_snapshots: Optional[List[Snapshot]] = None,
+    debug: bool = False,
+    jobs: int = 1,
+    export: Optional["Export"] = None,
 ) -> SnapshotData:
-    snapshots: List[Snapshot] = []
-    if sorted_snapshots is None:
-        snapshots, _ = data(debug=debug)
-        snapshots.sort(key=lambda s: s.at)
+    """
+    A DataFrame of the accounts and the time for each snapshot, with the
+    outliers removed. See cleaned_balances_df for one DataFrame
+
+    Uses the snapshots from export (see budget.load_export) if given
+    """
+    if export is not None:
+        snapshots = export.snapshots()
     else:
-        snapshots = sorted_snapshots
-    cleaned_acc: SnapshotData = remove_outliers(_to_snapshot_data(snapshots), print=debug)
-    return cleaned_acc
+        snapshots = _sorted_snapshots(sorted_snapshots, debug=debug, jobs=jobs)
+    remove = outlier_snapshots(BalanceMatrix.from_snapshots(snapshots), print=debug)
+    return _to_snapshot_data([sn for sn, out in zip(snapshots, remove) if not out])
+
+
+def cleaned_balances_df(
+    sorted_snapshots: Optional[List[Snapshot]] = None,
+    debug: bool = False,
+    jobs: int = 1,
+    export: Optional["Export"] = None,
+) -> pd.DataFrame:
+    """
+    The balance of each account (columns) at each snapshot (rows), with the
+    outliers removed, see BalanceMatrix
+
+    Uses the balances from export (see budget.load_export) if given
+    """
+    if export is not None:
+        matrix = BalanceMatrix.from_frame(export.balances)
+    else:
+        snapshots = _sorted_snapshots(sorted_snapshots, debug=debug, jobs=jobs)
+        matrix = BalanceMatrix.from_snapshots(snapshots)
+    return remove_outliers(matrix, print=debug).to_dataframe()
 
 
 def transactions_df(
     sorted_transactions: Optional[List[Transaction]] = None,
+    export: Optional["Export"] = None,
 ) -> pd.DataFrame:
+    """
+    The transactions, sorted by day. With an export (see budget.load_export)
+    the DataFrame from that is returned, which also has the amounts in cents
+    """
+    if export is not None:
+        return export.transactions
     transactions: List[Transaction] = []
     if sorted_transactions is None:
-        _, transactions = data()
+        transactions = Dataset().transactions
         transactions.sort(key=lambda s: s.on)
     else:
         transactions = sorted_transactions
-    return pd.DataFrame.from_dict(transactions)
+    return TransactionTable.from_transactions(transactions).to_dataframe()
+
+
+def cube(jobs: int = 1) -> SpendingCube:
+    """
+    Spending totals for each month/account/category, see SpendingCube
+    """
+    return Dataset(jobs=jobs).cube
@@ -1,142 +1,395 @@
-from typing import Dict, Set, Tuple, List
-from datetime import datetime
-from itertools import chain
+import math
+import shutil
+import hashlib
+import warnings
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, Tuple, List, Optional
+from datetime import datetime, timedelta, tzinfo
+from functools import lru_cache
+from pathlib import Path
 
 import click
 import numpy as np  # type: ignore[import]
 from numpy.typing import NDArray
 import pandas as pd  # type: ignore[import]
-from tzlocal import get_localzone  # type: ignore[import]
 
+from .. import timing
 from ..load.balances import Snapshot
 
-tz = get_localzone()
 
-# convert to timestamp and back to remove git timestamp info
-def fix_timestamp(t: datetime) -> datetime:
-    dt = tz.localize(datetime.fromtimestamp(t.timestamp()))
-    assert isinstance(dt, datetime)
-    return dt
+@lru_cache(maxsize=None)
+def local_tz() -> tzinfo:
+    from tzlocal import get_localzone  # type: ignore[import]
 
+    return get_localzone()
 
-def invert_credit_card(df_row):  # type: ignore
-    if df_row["account_type"] == "credit card":
-        df_row["current"] = df_row["current"] * -1
-    return df_row
+
+# convert to timestamp and back to remove git timestamp info
+def fix_timestamp(t: datetime) -> datetime:
+    return datetime.fromtimestamp(t.timestamp(), tz=local_tz())
 
 
 # get all balances from one snapshot
 def assets(s: Snapshot) -> pd.DataFrame:
-
     df = pd.DataFrame.from_dict(s.accounts)
     # invert credit card balances
-    return df.apply(invert_credit_card, axis=1)  # type: ignore
+    df.loc[df["account_type"] == "credit card", "current"] *= -1
+    return df
 
 
+# a DataFrame of the accounts (see assets) and the time, for each snapshot
 SnapshotData = List[Tuple[pd.DataFrame, datetime]]
 
-
 NDFloatArr = NDArray[np.float64]
+NDBoolArr = NDArray[np.bool_]
+
+AccountKey = Tuple[str, str, str]
+
+
+class BalanceMatrix:
+    """
+    The balance of each account at each snapshot. values has a row for
+    each snapshot and a column for each account (institution, account,
+    account_type), with credit card balances inverted. Accounts that
+    aren't in a snapshot are 0 (see present)
+
+    accounts has the metadata for each column, at/seconds the time of
+    each row
+    """
+
+    def __init__(
+        self,
+        values: NDFloatArr,
+        accounts: pd.DataFrame,
+        at: List[datetime],
+        present: Optional[NDBoolArr] = None,
+    ) -> None:
+        self.values = values
+        # which accounts are in each snapshot
+        self.present: NDBoolArr = (
+            present if present is not None else np.ones(values.shape, dtype=bool)
+        )
+        self.accounts = accounts
+        self.at = at
+        self.seconds: NDFloatArr = np.array([t.timestamp() for t in at], dtype=float)
+
+    @classmethod
+    def _build(
+        cls,
+        rows: NDArray[np.intp],
+        cols: NDArray[np.intp],
+        current: Any,
+        accounts: pd.DataFrame,
+        at: List[datetime],
+    ) -> "BalanceMatrix":
+        values: NDFloatArr = np.zeros((len(at), len(accounts)))
+        # add, in case an account is in a snapshot more than once
+        np.add.at(values, (rows, cols), current)
+        present: NDBoolArr = np.zeros(values.shape, dtype=bool)
+        present[rows, cols] = True
+        values[:, (accounts["account_type"] == "credit card").to_numpy()] *= -1
+        return cls(values, accounts, at, present)
+
+    @classmethod
+    def from_snapshots(cls, snapshots: List[Snapshot]) -> "BalanceMatrix":
+        columns: Dict[AccountKey, int] = {}
+        rows: List[int] = []
+        cols: List[int] = []
+        current: List[float] = []
+        for i, sn in enumerate(snapshots):
+            for acc in sn.accounts:
+                key = (acc.institution, acc.account, acc.account_type)
+                rows.append(i)
+                cols.append(columns.setdefault(key, len(columns)))
+                current.append(acc.current)
+        accounts = pd.DataFrame(
+            list(columns), columns=["institution", "account", "account_type"]
+        )
+        return cls._build(
+            np.array(rows, dtype=np.intp),
+            np.array(cols, dtype=np.intp),
+            current,
+            accounts,
+            [sn.at for sn in snapshots],
+        )
+
+    @classmethod
+    def from_frame(cls, balances: pd.DataFrame) -> "BalanceMatrix":
+        """
+        From a row for each account in each snapshot (with snapshot/at
+        columns, in order), like budget.export.Export.balances
+        """
+        keys = ["institution", "account", "account_type"]
+        rows, _ = pd.factorize(balances["snapshot"])
+        cols, uniques = pd.factorize(pd.MultiIndex.from_frame(balances[keys]))
+        accounts = pd.DataFrame(list(uniques), columns=keys)
+        first = np.unique(rows, return_index=True)[1]
+        return cls._build(
+            rows,
+            cols,
+            balances["current"].to_numpy(),
+            accounts,
+            balances["at"].iloc[first].tolist(),
+        )
+
+    def __len__(self) -> int:
+        return len(self.at)
+
+    @property
+    def sums(self) -> NDFloatArr:
+        return self.values.sum(axis=1)  # type: ignore[no-any-return]
+
+    def take(self, rows: NDBoolArr) -> "BalanceMatrix":
+        """
+        The matrix with only some of the snapshots (a mask for the rows)
+        """
+        return BalanceMatrix(
+            self.values[rows],
+            self.accounts,
+            [t for t, keep in zip(self.at, rows) if keep],
+            self.present[rows],
+        )
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """
+        The balances with the snapshot times as the index, and the
+        (institution, account, account_type) as the columns
+        """
+        return pd.DataFrame(
+            self.values,
+            index=pd.DatetimeIndex(self.at, name="at"),
+            columns=pd.MultiIndex.from_frame(self.accounts),
+        )
+
+
+# how far back RollingOutliers looks to fit the balance at each snapshot
+OUTLIER_WINDOW = timedelta(days=30)
+# how many standard deviations above that fit is an outlier
+OUTLIER_THRESHOLD = 3.0
+# dont call anything an outlier until there's this many snapshots in the window
+OUTLIER_MIN_POINTS = 10
+
+
+class RollingOutliers:
+    """
+    Finds outliers in (time, balance) points, added oldest first. Each balance
+    is compared to a linear regression of the balances in the window before
+    it, and is an outlier if its more than threshold standard deviations (of
+    that regression's residuals) above it (or below it, if two_sided)
+
+    The sums the regression is computed from are updated as points enter and
+    leave the window, so each point is O(1). The state is kept, so new
+    snapshots can be added later without going over the old ones again
+    """
+
+    def __init__(
+        self,
+        window: timedelta = OUTLIER_WINDOW,
+        threshold: float = OUTLIER_THRESHOLD,
+        min_points: int = OUTLIER_MIN_POINTS,
+        two_sided: bool = False,
+    ) -> None:
+        self.window = window.total_seconds() / 86400
+        self.threshold = threshold
+        self.min_points = min_points
+        self.two_sided = two_sided
+        # the first point, the others are relative to it to keep the sums small
+        self.origin: Optional[Tuple[float, float]] = None
+        # (days, balance) in the window
+        self.points: Deque[Tuple[float, float]] = deque()
+        self.n = 0
+        self.st = self.sy = self.stt = self.sty = self.syy = 0.0
+
+    def _add(self, t: float, y: float, sign: int) -> None:
+        self.n += sign
+        self.st += sign * t
+        self.sy += sign * y
+        self.stt += sign * t * t
+        self.sty += sign * t * y
+        self.syy += sign * y * y
+
+    def _zscore(self, t: float, y: float) -> Optional[float]:
+        n = self.n
+        if n < self.min_points:
+            return None
+        mean_t, mean_y = self.st / n, self.sy / n
+        var_t = self.stt - self.st * mean_t
+        cov = self.sty - self.st * mean_y
+        var_y = self.syy - self.sy * mean_y
+        slope = cov / var_t if var_t > 1e-12 else 0.0
+        std = math.sqrt(max(var_y - slope * cov, 0.0) / n)
+        if std < 1e-9:
+            # the balance hasn't changed, so theres nothing to compare to
+            return None
+        return (y - (mean_y + slope * (t - mean_t))) / std
+
+    def update(self, at: float, balance: float) -> bool:
+        """
+        Add the balance at some time (a timestamp), returns if its an outlier
+        """
+        if self.origin is None:
+            self.origin = (at, balance)
+        t = (at - self.origin[0]) / 86400
+        y = balance - self.origin[1]
+        if self.points and t < self.points[-1][0]:
+            raise ValueError("Points have to be added oldest first")
+        while self.points and self.points[0][0] < t - self.window:
+            self._add(*self.points.popleft(), -1)
+        z = self._zscore(t, y)
+        self.points.append((t, y))
+        self._add(t, y, 1)
+        if z is None:
+            return False
+        return z > self.threshold or (self.two_sided and z < -self.threshold)
+
+    def extend(self, at: Iterable[float], balances: Iterable[float]) -> NDBoolArr:
+        return np.array([self.update(t, b) for t, b in zip(at, balances)], dtype=bool)
+
+
+def outliers(matrix: BalanceMatrix, **kwargs: Any) -> NDBoolArr:
+    """
+    Which snapshots are outliers (ones that might have happened while
+    transfers were happening between different accounts), based on the
+    total balance. kwargs are passed to RollingOutliers
+    """
+    return RollingOutliers(**kwargs).extend(matrix.seconds, matrix.sums)
 
 
-def remove_outliers(acc_data: SnapshotData, print: bool = True) -> SnapshotData:
+def account_outliers(matrix: BalanceMatrix, **kwargs: Any) -> NDBoolArr:
     """
-    remove outlier snapshots (ones that might have happened while
-    transfers were happening between different accounts)
+    Which balances in the matrix are outliers for that account, only
+    comparing each account to the snapshots its in
     """
+    found = np.zeros(matrix.values.shape, dtype=bool)
+    for j in range(matrix.values.shape[1]):
+        rows = np.flatnonzero(matrix.present[:, j])
+        found[rows, j] = RollingOutliers(**kwargs).extend(
+            matrix.seconds[rows], matrix.values[rows, j]
+        )
+    return found
+
 
-    try:
-        from scipy import stats  # type: ignore[import]
-    except ModuleNotFoundError as m:
-        click.echo(f"Could not import scipy {m}")
-        return acc_data
+@timing.staged("remove outliers")
+def outlier_snapshots(
+    matrix: BalanceMatrix, print: bool = True, per_account: bool = False
+) -> NDBoolArr:
+    """
+    The outlier snapshots (ones that might have happened while transfers
+    were happening between different accounts) to remove
 
+    if per_account, also removes the snapshots where any account's
+    balance is an outlier
+    """
     if print:
-        click.echo("Processing {} snapshots...".format(len(acc_data)))
-    # get data
-    df: pd.DataFrame = pd.DataFrame.from_dict(
-        [{"sum": d[0]["current"].sum(), "at": d[1]} for d in acc_data]
-    )
-
-    # make dates indexes
-    df.index = df["at"]
-    df.drop(["at"], axis=1, inplace=True)
-
-    # create sums for each snapshot
-    dates: NDFloatArr = np.array([d.timestamp() for d in df.index])
-    vals: NDFloatArr = np.array(df["sum"])
-
-    # linear regression
-    # y: money, x: dates
-    slope, intercept, _, _, _ = stats.linregress(dates, vals)
-
-    # calculate expected based on slope and intercept
-    regression_y: NDFloatArr = intercept + slope * dates
-
-    # difference between expected and actual
-    residuals: NDFloatArr = vals - regression_y
-    residual_zscores: NDFloatArr = stats.zscore(residuals)
-    # get indices of items that are further than 1.5 deviations away
-    outlier_indices: NDArray[np.int64] = next(iter(np.where(residual_zscores > 1.5)))
-
-    # remove those from dates/vals
-    # dates_cleaned = np.delete(dates, outlier_indices)
-    # vals_cleaned = np.delete(vals, outlier_indices)
-
-    # cleaned snapshot data
-    acc_clean: SnapshotData = [
-        a for i, a in enumerate(acc_data) if i not in outlier_indices
-    ]
-    # for index in outlier_indices:
-    # print("Removing outlier value ({}) :\n {}".format(residuals[index], acc_data[index]))
-    # pass
+        click.echo("Processing {} snapshots...".format(len(matrix)))
+    remove = outliers(matrix)
+    if per_account:
+        remove |= account_outliers(matrix).any(axis=1)
     if print:
-        click.echo(
-            "Removed {} outlier snapshots.".format(len(acc_data) - len(acc_clean))
-        )
-    return acc_clean
+        click.echo("Removed {} outlier snapshots.".format(int(remove.sum())))
+    return remove
+
+
+def remove_outliers(
+    matrix: BalanceMatrix, print: bool = True, per_account: bool = False
+) -> BalanceMatrix:
+    """
+    The matrix without the outlier snapshots, see outlier_snapshots
+    """
+    return matrix.take(~outlier_snapshots(matrix, print, per_account))
 
-def  _to_snapshot_data(snapshots: List[Snapshot]) -> SnapshotData:
-    return [(assets(s), s.at) for s in snapshots]
 
+def _to_snapshot_data(snapshots: List[Snapshot]) -> SnapshotData:
+    return [(assets(s), s.at) for s in snapshots]
 
 
-def graph_account_balances(account_snapshots: List[Snapshot], graph: bool) -> None:
+def downsample(x: NDFloatArr, y: NDFloatArr, points: int) -> NDArray[np.intp]:
+    """
+    Indices of at most about points of the line (x, sorted ascending, and
+    y) to plot. x is split into points/4 equal buckets (about a pixel column
+    each), and the first, last, lowest and highest point in each is kept,
+    so spikes still show up in the graph
+    """
+    n = len(x)
+    buckets = max(points // 4, 1)
+    if n <= points or n == 0 or x[0] == x[-1]:
+        return np.arange(n)
+    scaled = (x - x[0]) / (x[-1] - x[0]) * buckets
+    bucket = np.minimum(scaled.astype(int), buckets - 1)
+    # sort by bucket then y, so the first/last of each bucket is its min/max
+    by_value = np.lexsort((y, bucket))
+    bounds = np.flatnonzero(np.diff(bucket, prepend=-1))
+    ends = np.append(bounds[1:], n) - 1
+    keep = np.concatenate([bounds, ends, by_value[bounds], by_value[ends]])
+    return np.unique(keep)  # type: ignore[no-any-return]
+
+
+# where graph_account_balances saves the graph
+GRAPH_FILE = Path("/tmp/balance_history.png")
+# the default number of points to plot for each account
+GRAPH_POINTS = 2000
+# change this when the graph looks different, so older cached images aren't used
+GRAPH_VERSION = 1
+
+
+def _graph_cache_path(matrix: BalanceMatrix, points: Optional[int]) -> Path:
+    from ..load.cache import SCHEMA_VERSION, cache_dir
+
+    key = hashlib.sha256(f"{GRAPH_VERSION} {points}".encode())
+    key.update(matrix.seconds.tobytes())
+    key.update(np.ascontiguousarray(matrix.values).tobytes())
+    key.update("\n".join(matrix.accounts["account"]).encode())
+    return cache_dir() / f"v{SCHEMA_VERSION}" / "graphs" / f"{key.hexdigest()}.png"
+
+
+@timing.staged("graph balances")
+def graph_account_balances(
+    account_snapshots: List[Snapshot],
+    graph: bool,
+    points: Optional[int] = GRAPH_POINTS,
+    to_file: Path = GRAPH_FILE,
+) -> None:
     """
     plot each account across the git hitsory
+
+    Each account is downsampled to about points (None to plot everything).
+    If graph is False, this only saves the image, which is cached, so it's
+    only rendered again if the balances change
     """
+    from ..load.cache import cache_enabled
+
+    # clean data
+    matrix = remove_outliers(BalanceMatrix.from_snapshots(account_snapshots))
+
+    cached = _graph_cache_path(matrix, points) if cache_enabled() else None
+    if not graph and cached is not None and cached.exists():
+        shutil.copyfile(cached, to_file)
+        click.echo("Saved to {} (cached)".format(to_file))
+        return
+
+    import matplotlib  # type: ignore[import]
+
+    if not graph:
+        # dont need a window
+        matplotlib.use("Agg")
 
     import matplotlib.pyplot as plt  # type: ignore[import]
     import matplotlib.dates as mdate  # type: ignore[import]
     import matplotlib.ticker as tick  # type: ignore[import]
 
-    acc_data: SnapshotData = _to_snapshot_data(account_snapshots)
-    # clean data
-    acc_data = remove_outliers(acc_data)
-
     plt.style.use("dark_background")
     # graph each data point
     fig, ax = plt.subplots(figsize=(18, 10))
 
-    # get all account names
-    account_names: Set[str] = set(
-        chain(*[list(a[0]["account"].values) for a in acc_data])
-    )
-    # create empty account data arrays for each timestamp
-    account_history: Dict[str, NDFloatArr] = {
-        n: np.zeros(len(acc_data)) for n in account_names
-    }
-
-    secs: NDFloatArr = np.array([fix_timestamp(sn[1]) for sn in acc_data])
-    for i, sn in enumerate(acc_data):
-        ad: pd.DataFrame = sn[0]
-
-        # loop over rows and add to account_history, to create 'line graphs' for each item
-        for _, row in ad.iterrows():
-            account_history[row["account"]][i] = row["current"]
-
-    for acc, acc_list in account_history.items():
-        ax.plot(secs, acc_list, label=acc)
+    # a 'line graph' for each account
+    secs: NDFloatArr = np.array([fix_timestamp(t) for t in matrix.at])
+    for j, acc in enumerate(matrix.accounts["account"]):
+        line = matrix.values[:, j]
+        if points is not None:
+            keep = downsample(matrix.seconds, line, points)
+            ax.plot(secs[keep], line[keep], label=acc)
+        else:
+            ax.plot(secs, line, label=acc)
 
     ax.xaxis.set_major_formatter(mdate.DateFormatter("%Y-%m-%d %H:%M:%S"))
     ax.yaxis.set_major_formatter(tick.StrMethodFormatter("${x:,}"))
@@ -146,9 +399,14 @@ def graph_account_balances(account_snapshots: List[Snapshot], graph: bool) -> No
     plt.xlabel("Date")
     plt.ylabel("Account Balance")
 
-    to_file = "/tmp/balance_history.png"
     plt.savefig(to_file)
     click.echo("Saved to {}".format(to_file))
+    if cached is not None:
+        try:
+            cached.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(to_file, cached)
+        except OSError as e:
+            warnings.warn(f"Could not cache graph at {cached}: {e}")
 
     if graph:
         plt.show()
@@ -0,0 +1,257 @@
+"""
+Spending totals for each (month, account, category, meta_category),
+saved between runs so only the months that changed are aggregated again
+
+Each month has a digest of its transactions (a sum of the hashes of each
+row, and how many there are). When the cube is updated, only the months
+whose digest changed (new transactions from the latest fetch, or ones
+whose category was changed by the rules) are grouped again
+
+>>> cube = dataset.cube
+>>> cube.query("category", since="2022-01")
+>>> cube.compare("2022-05", "2022-04")
+>>> cube.compare(("2022-01", "2022-03"), ("2021-01", "2021-03"), by="meta_category")
+"""
+
+import warnings
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple, Union
+
+import numpy as np  # type: ignore[import]
+from numpy.typing import NDArray
+import pandas as pd  # type: ignore[import]
+
+from .. import timing
+
+# change this if what's saved changes, so older cubes aren't used
+CUBE_VERSION = 1
+
+DIMENSIONS = ["month", "account", "category", "meta_category"]
+# sum/max are in cents
+MEASURES = ["sum", "count", "max"]
+
+# a month (YYYY-MM), or a range of months (inclusive)
+Period = Union[str, Tuple[Optional[str], Optional[str]]]
+# (sum of the row hashes, number of rows)
+Digest = Tuple[int, int]
+
+
+# numpy arrays, the month of each transaction/amounts in cents
+Array = NDArray[Any]
+
+
+def months(transactions: pd.DataFrame) -> Array:
+    """
+    The month (YYYY-MM) of each transaction
+    """
+    on = pd.to_datetime(transactions["on"]).to_numpy().astype("datetime64[M]")
+    return on.astype(str)  # type: ignore[no-any-return]
+
+
+def _cents(transactions: pd.DataFrame) -> Array:
+    cents = np.rint(transactions["amount"].to_numpy() * 100)
+    return cents.astype(np.int64)  # type: ignore[no-any-return]
+
+
+def _digests(transactions: pd.DataFrame, month: Array) -> Dict[str, Digest]:
+    if len(transactions) == 0:
+        return {}
+    hashes = pd.util.hash_pandas_object(
+        transactions[["on", "amount", "name", "account", "category", "meta_category"]],
+        index=False,
+    ).to_numpy()
+    codes, names = pd.factorize(np.asarray(month))
+    order = np.argsort(codes, kind="stable")
+    starts = np.flatnonzero(np.diff(codes[order], prepend=-1))
+    # uint64 sums wrap around, which is fine for a digest
+    sums = np.add.reduceat(hashes[order], starts)
+    counts = np.diff(np.append(starts, len(order)))
+    return {
+        str(names[codes[order[s]]]): (int(h), int(c))
+        for s, h, c in zip(starts, sums, counts)
+    }
+
+
+def _aggregate(transactions: pd.DataFrame, month: Array) -> pd.DataFrame:
+    cells = (
+        transactions[DIMENSIONS[1:]]
+        .assign(month=month, cents=_cents(transactions))
+        .groupby(DIMENSIONS, dropna=False)["cents"]
+        .agg(["sum", "count", "max"])
+        .reset_index()
+    )
+    return cells[DIMENSIONS + MEASURES]
+
+
+def _period(period: Period) -> Tuple[Optional[str], Optional[str]]:
+    if isinstance(period, str):
+        return (period, period)
+    return period
+
+
+class SpendingCube:
+    """
+    The sum, count and max of the transaction amounts for each
+    (month, account, category, meta_category), in cells
+    """
+
+    def __init__(
+        self,
+        cells: Optional[pd.DataFrame] = None,
+        digests: Optional[Dict[str, Digest]] = None,
+    ) -> None:
+        self.cells: pd.DataFrame = (
+            cells if cells is not None else pd.DataFrame(columns=DIMENSIONS + MEASURES)
+        )
+        self.digests: Dict[str, Digest] = digests if digests is not None else {}
+        # the months which changed in the last update
+        self.updated: List[str] = []
+
+    def update(self, transactions: pd.DataFrame) -> "SpendingCube":
+        """
+        Update the cube to match transactions (a DataFrame like
+        TransactionTable.to_dataframe), only aggregating the months that
+        changed since the last time
+        """
+        month = months(transactions)
+        digests = _digests(transactions, month)
+        changed: Set[str] = {m for m, d in digests.items() if self.digests.get(m) != d}
+        stale = changed | (set(self.digests) - set(digests))
+        if stale:
+            kept = self.cells[~self.cells["month"].isin(stale)]
+            rows = np.isin(month, list(changed))
+            fresh = _aggregate(transactions[rows], month[rows])
+            parts = [df for df in (kept, fresh) if len(df)]
+            cells = pd.concat(parts) if parts else self.cells.iloc[0:0]
+            self.cells = cells.sort_values("month", kind="stable", ignore_index=True)
+        self.digests = digests
+        self.updated = sorted(stale)
+        timing.count(months=len(digests), months_updated=len(stale))
+        return self
+
+    @classmethod
+    def load(cls, path: Path) -> "SpendingCube":
+        from ..load.cache import read_pickle
+
+        saved = read_pickle(path)
+        if not isinstance(saved, dict) or saved.get("version") != CUBE_VERSION:
+            return cls()
+        return cls(saved["cells"], saved["digests"])
+
+    def save(self, path: Path) -> None:
+        from ..load.cache import write_pickle
+
+        try:
+            write_pickle(
+                path,
+                {"version": CUBE_VERSION, "cells": self.cells, "digests": self.digests},
+            )
+        except OSError as e:
+            warnings.warn(f"Could not save spending cube to {path}: {e}")
+
+    def _select(
+        self,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+        where: Optional[Dict[str, Any]] = None,
+    ) -> pd.DataFrame:
+        cells = self.cells
+        mask = np.ones(len(cells), dtype=bool)
+        if since is not None:
+            mask &= (cells["month"] >= since).to_numpy()
+        if until is not None:
+            mask &= (cells["month"] <= until).to_numpy()
+        for dim, value in (where or {}).items():
+            values = value if isinstance(value, (list, tuple, set)) else [value]
+            mask &= cells[dim].isin(values).to_numpy()
+        return cells[mask]
+
+    def drop(self, **where: Any) -> "SpendingCube":
+        """
+        The cube without the cells that match, e.g. drop(meta_category="Transfer"),
+        to query. This isn't meant to be updated
+        """
+        removed = self._select(where=where)
+        return SpendingCube(self.cells.drop(removed.index), self.digests)
+
+    def query(
+        self,
+        by: Union[str, Sequence[str]] = "category",
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+        **where: Any,
+    ) -> pd.DataFrame:
+        """
+        The sum, count and max amount for each value of by (a dimension, or
+        a list of them), in the months between since and until (YYYY-MM,
+        inclusive). where filters the dimensions, e.g. account="Checking"
+        """
+        cells = self._select(since, until, where)
+        keys = [by] if isinstance(by, str) else list(by)
+        grouped = (
+            cells.groupby(keys)
+            .agg({"sum": "sum", "count": "sum", "max": "max"})
+            .astype({"sum": np.int64, "count": np.int64, "max": np.int64})
+        )
+        # back to dollars
+        return grouped.assign(sum=grouped["sum"] / 100, max=grouped["max"] / 100)
+
+    def cents(
+        self, by: str, since: Optional[str] = None, **where: Any
+    ) -> "pd.Series[Any]":
+        """
+        The sum in cents for each value of by, in the months since since
+        """
+        cells = self._select(since=since, where=where)
+        return cells.groupby(by)["sum"].sum().astype(np.int64)
+
+    def compare(
+        self, current: Period, previous: Period, by: str = "category", **where: Any
+    ) -> pd.DataFrame:
+        """
+        Spending for each value of by in current compared to previous, each
+        a month (YYYY-MM) or a (since, until) range of months
+        """
+        now = self.query(by, *_period(current), **where)["sum"]
+        before = self.query(by, *_period(previous), **where)["sum"]
+        df = pd.concat([now.rename("current"), before.rename("previous")], axis=1)
+        df = df.fillna(0.0)
+        df["change"] = df["current"] - df["previous"]
+        df["percent"] = df["change"] / df["previous"].where(df["previous"] != 0) * 100
+        return df.sort_values("current", ascending=False)
+
+    def monthly(self, by: Optional[str] = None, **where: Any) -> pd.DataFrame:
+        """
+        Total spending for each month, or a column for each value of by
+        """
+        cells = self._select(where=where)
+        if by is None:
+            return (cells.groupby("month")["sum"].sum() / 100).to_frame("sum")
+        table = cells.pivot_table(
+            index="month", columns=by, values="sum", aggfunc="sum", fill_value=0
+        )
+        return table / 100
+
+
+def cube_path(ddir: Path) -> Path:
+    from ..load.cache import checkpoint_path
+
+    return checkpoint_path("cube", ddir)
+
+
+def spending_cube(
+    transactions: pd.DataFrame, ddir: Optional[Path] = None
+) -> SpendingCube:
+    """
+    The cube for transactions. If ddir is given, the cube saved for that
+    data directory is updated (and saved again, if anything changed)
+    """
+    from ..load.cache import cache_enabled
+
+    path = cube_path(ddir) if ddir is not None and cache_enabled() else None
+    with timing.stage("spending cube"):
+        cube = SpendingCube.load(path) if path is not None else SpendingCube()
+        cube.update(transactions)
+        if path is not None and cube.updated:
+            cube.save(path)
+    return cube
@@ -1,15 +1,20 @@
-from datetime import date, timedelta
-from typing import Union, List, Dict, Optional, Sequence
+from datetime import date
+from typing import Union, List, Dict, NamedTuple, Optional, Sequence, Tuple
 
 import click
+import numpy as np  # type: ignore[import]
+from numpy.typing import NDArray
 import pandas as pd  # type: ignore[import]
-from pyfiglet import figlet_format  # type: ignore[import]
 
+from .. import timing
+from .cube import DIMENSIONS, SpendingCube, spending_cube
 from ..load.balances import Snapshot
-from ..load.transactions import Transaction
+from ..load.transactions import Transaction, TransactionTable
 
 
 def banner(msg: str) -> None:
+    from pyfiglet import figlet_format  # type: ignore[import]
+
     click.echo("```")
     click.secho(figlet_format(msg, "thin"), fg="blue")
     click.echo("```")
@@ -43,6 +48,7 @@ def print_df(
     click.echo(df.rename(columns=rename_cols).to_markdown(index=index))
 
 
+@timing.staged("account summary")
 def account_summary(account_snapshots: List[Snapshot]) -> pd.DataFrame:
     hr()
     account = account_snapshots[-1].accounts
@@ -93,8 +99,209 @@ def account_summary(account_snapshots: List[Snapshot]) -> pd.DataFrame:
 today = date.today()
 
 
-def _get_timeframe(transactions: pd.DataFrame, timeframe: timedelta) -> pd.DataFrame:
-    return transactions[today - transactions["on"] < timeframe]
+class SpendingWindow(NamedTuple):
+    title: str
+    # only the transactions in the last days, None for all of them
+    days: Optional[int]
+    # how many of the largest transactions to print, True for all of them
+    print_count: Union[int, bool] = 10
+    by: str = "meta_category"
+
+
+DEFAULT_WINDOWS: List[SpendingWindow] = [
+    SpendingWindow("full transaction history", None, print_count=True),
+    SpendingWindow("last year", 365, print_count=80),
+    # use specific categories for 3 months/30 days
+    SpendingWindow("last 3 months", 90, print_count=60, by="category"),
+    # print all transactions in last 30 days
+    SpendingWindow("last 30 days", 30, print_count=True, by="category"),
+]
+
+
+GROUP_BY = ("name", "account", "category", "meta_category")
+
+
+def parse_window(spec: str) -> SpendingWindow:
+    """
+    DAYS[:COUNT[:BY]], e.g. 7, 90:20 or 365:all:meta_category. COUNT is how
+    many of the largest transactions to print (all for every one), BY
+    the column to total them by. DAYS can be 'all' for the full history
+    """
+    days, count, by, *rest = spec.split(":") + ["", ""]
+    try:
+        if rest != [""] * len(rest) or not days:
+            raise ValueError
+        window_days = None if days == "all" else int(days)
+        print_count: Union[int, bool] = True if count == "all" else int(count or 10)
+    except ValueError:
+        raise ValueError(f"Expected DAYS[:COUNT[:BY]], got {spec!r}") from None
+    if window_days is not None and window_days <= 0:
+        raise ValueError(f"Window has to be at least a day, got {spec!r}")
+    if print_count is not True and print_count <= 0:
+        raise ValueError(f"COUNT has to be at least 1, got {spec!r}")
+    if by and by not in GROUP_BY:
+        raise ValueError(f"Can't total by {by!r}, should be one of {GROUP_BY}")
+    title = "full transaction history" if window_days is None else f"last {days} days"
+    return SpendingWindow(title, window_days, print_count, by or "category")
+
+
+class Spending:
+    """
+    The transactions sorted by date once, with prefix sums of the amounts,
+    so the total for any recent window (a suffix of the sorted transactions,
+    found with searchsorted) is a subtraction, and the totals for each
+    category are a couple of searchsorted calls
+    """
+
+    def __init__(
+        self,
+        transactions: pd.DataFrame,
+        today: date = today,
+        cube: Optional[SpendingCube] = None,
+    ) -> None:
+        self.cube = cube
+        on = pd.to_datetime(transactions["on"]).to_numpy().astype("datetime64[D]")
+        order = np.argsort(on, kind="stable")
+        self.transactions = transactions.iloc[order].reset_index(drop=True)
+        self.on = on[order]
+        self.today = np.datetime64(today, "D")
+        # sum in cents, so the prefix sums are exact
+        self.cents = np.rint(self.transactions["amount"].to_numpy() * 100).astype(
+            np.int64
+        )
+        self.prefix = np.concatenate([[0], np.cumsum(self.cents)])
+        self._by: Dict[str, Tuple[pd.Index, NDArray[np.int64], NDArray[np.int64]]] = {}
+
+    def __len__(self) -> int:
+        return len(self.on)
+
+    def start(self, days: Optional[int]) -> int:
+        """
+        Index of the first transaction in the last days (or 0 for None)
+        """
+        if days is None:
+            return 0
+        # what _get_timeframe used to do, today - on < days
+        return int(np.searchsorted(self.on, self.today - days, side="right"))
+
+    def total(self, start: int = 0) -> float:
+        return float(self.prefix[-1] - self.prefix[start]) / 100
+
+    def _grouped(
+        self, by: str
+    ) -> Tuple[pd.Index, NDArray[np.int64], NDArray[np.int64]]:
+        if by not in self._by:
+            codes, names = pd.factorize(self.transactions[by], sort=True)
+            # ordered by (category, position), so each category is a run of
+            # positions with its own prefix sum
+            keys = codes.astype(np.int64) * len(self) + np.arange(len(self))
+            order = np.argsort(keys, kind="stable")
+            # missing values (code -1) sort first, and aren't a category
+            keep = order[codes[order] >= 0]
+            self._by[by] = (
+                names,
+                keys[keep],
+                np.concatenate([[0], np.cumsum(self.cents[keep])]),
+            )
+        return self._by[by]
+
+    def _totals(
+        self, by: str, start: int, end: int
+    ) -> Tuple[pd.Index, NDArray[np.int64]]:
+        # the total in cents for each value of by between start and end, for
+        # the values which have any transactions there
+        names, keys, prefix = self._grouped(by)
+        base = np.arange(len(names), dtype=np.int64) * len(self)
+        # where the window starts/ends in each category
+        lo = np.searchsorted(keys, base + start)
+        hi = np.searchsorted(keys, base + end)
+        present = hi > lo
+        return names[present], (prefix[hi] - prefix[lo])[present]
+
+    def by(self, by: str, start: int = 0) -> pd.DataFrame:
+        """
+        The total amount for each value of by (e.g. category) in the window
+
+        If there's a cube for these transactions, the totals for the whole
+        months in the window come from that, and only the transactions in
+        the first (partial) month are added up here
+        """
+        if self.cube is None or by not in DIMENSIONS or start >= len(self):
+            names, cents = self._totals(by, start, len(self))
+            totals = pd.Series(cents, index=names, dtype=np.int64)
+        else:
+            since: Optional[str] = None
+            if start > 0:
+                # every month after the first one in the window is in it
+                next_month = self.on[start].astype("datetime64[M]") + 1
+                end = int(np.searchsorted(self.on, next_month.astype("datetime64[D]")))
+                since = str(next_month)
+                names, cents = self._totals(by, start, end)
+                partial = pd.Series(cents, index=names, dtype=np.int64)
+            else:
+                partial = pd.Series([], dtype=np.int64)
+            totals = self.cube.cents(by, since=since).add(partial, fill_value=0)
+            totals = totals.sort_index().astype(np.int64)
+        return pd.DataFrame(
+            {"amount": totals.to_numpy() / 100},
+            index=pd.Index(totals.index, name=by),
+        )
+
+    def largest(self, start: int = 0, count: Union[int, bool] = True) -> pd.DataFrame:
+        """
+        The transactions in the window, largest first (or only the largest
+        count of them). Ties are ordered most recent first
+        """
+        cents = self.cents[start:]
+        if count is True or count >= len(cents):
+            candidates = np.arange(len(cents))
+        else:
+            # partial selection, only sort the ones that are printed
+            kth = np.partition(cents, len(cents) - count)[len(cents) - count]
+            above = np.flatnonzero(cents > kth)
+            ties = np.flatnonzero(cents == kth)[::-1][: count - len(above)]
+            candidates = np.concatenate([above, ties])
+        order = candidates[np.lexsort((-candidates, -cents[candidates]))]
+        return self.transactions.iloc[order + start].drop(["meta_category"], axis=1)
+
+    def describe(
+        self,
+        title: str,
+        days: Optional[int] = None,
+        by: str = "meta_category",
+        print_count: Union[int, bool] = 10,
+        display_categories: bool = True,
+    ) -> pd.DataFrame:
+        """
+        Print the largest transactions and totals for the last days,
+        returns the transactions that were printed
+        """
+        hr()
+        start = self.start(days)
+        sorted_transactions = self.largest(start, print_count)
+        if print_count is True:
+            click.echo(f"## All transactions for {title}\n")
+        else:
+            click.echo(f"## Largest transactions for {title}\n")
+        print_df(sorted_transactions)
+
+        hr()
+
+        total_spending = self.total(start)
+        if display_categories:
+            by_meta_category = self.by(by, start)
+            # add percentage
+            by_meta_category["percent"] = [
+                f"{am/total_spending * 100:.1f}%" for am in by_meta_category["amount"]
+            ]
+            # replace names of index to be more generic
+            by_meta_category.index.name = "category"
+            print(end="\n")  # print a newline
+            print_df(by_meta_category, sort_by=["amount"], index=True)
+
+        total = color(f"{total_spending:.2f}")
+        click.echo("\n{} spending: {}\n\n".format(title, total))
+        return sorted_transactions
 
 
 def describe_spending(
@@ -103,60 +310,44 @@ def describe_spending(
     by: str = "meta_category",
     print_count: Union[int, bool] = 10,
     display_categories: bool = True,
+    cube: Optional[SpendingCube] = None,
 ) -> pd.DataFrame:
-    hr()
-    sorted_transactions = transactions.sort_values(["amount"], ascending=False).drop(
-        ["meta_category"], axis=1
+    summary = Spending(transactions, cube=cube)
+    summary.describe(
+        title, by=by, print_count=print_count, display_categories=display_categories
     )
-    if print_count is True:
-        click.echo(f"## All transactions for {title}\n")
-        print_df(sorted_transactions)
-    else:
-        click.echo(f"## Largest transactions for {title}\n")
-        print_df(sorted_transactions.head(print_count))
-
-    hr()
-
-    total_spending = sorted_transactions["amount"].sum()
-    if display_categories:
-        # group by categories
-        by_meta_category = (
-            transactions.groupby([by]).sum().sort_values(["amount"], ascending=False)
-        )
-        # add percentage
-        by_meta_category["percent"] = by_meta_category["amount"].apply(
-            lambda am: f"{am/total_spending * 100:.1f}%"
-        )
-        # replace names of index to be more generic
-        by_meta_category.index.name = "category"
-        print(end="\n")  # print a newline
-        print_df(by_meta_category, sort_by=["amount"], index=True)
-
-    click.echo("\n{} spending: {}\n\n".format(title, color(f"{total_spending:.2f}")))
-    return sorted_transactions
+    # every transaction, not only the ones printed
+    return summary.largest()
 
 
+@timing.staged("recent spending")
 def recent_spending(
-    transactions: List[Transaction], include_transfers: bool = False
+    transactions: List[Transaction],
+    include_transfers: bool = False,
+    windows: Sequence[SpendingWindow] = DEFAULT_WINDOWS,
+    cube: Optional[SpendingCube] = None,
 ) -> pd.DataFrame:
-    _tr = pd.DataFrame.from_dict(transactions)
+    """
+    cube is the SpendingCube for transactions (e.g. Dataset.cube), if
+    not given its computed here
+    """
+    _tr = TransactionTable.from_transactions(transactions).to_dataframe()
+    if cube is None:
+        cube = spending_cube(_tr)
 
     spending = _tr
     # remove transfers between accounts/income, if specified
     if not include_transfers:
         spending = pd.DataFrame(_tr[_tr["meta_category"] != "Transfer"])
+        cube = cube.drop(meta_category="Transfer")
 
-    all_time = spending
-    last_year = _get_timeframe(spending, timedelta(days=365))
-    last_3_months = _get_timeframe(spending, timedelta(days=90))
-    last_30_days = _get_timeframe(spending, timedelta(days=30))
+    # sorted by date, each window is the transactions after some index
+    summary = Spending(spending, cube=cube)
 
     banner("Transactions")
 
-    describe_spending(all_time, "full transaction history", print_count=True)
-    describe_spending(last_year, "last year", print_count=80)
-    # use specific categories for 3 months/30 days
-    describe_spending(last_3_months, "last 3 months", print_count=60, by="category")
-    # print all transactions in last 30 days
-    describe_spending(last_30_days, "last 30 days", print_count=True, by="category")
-    return spending
+    for window in windows:
+        summary.describe(
+            window.title, window.days, by=window.by, print_count=window.print_count
+        )
+    return summary.transactions
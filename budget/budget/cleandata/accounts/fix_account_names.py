@@ -1,13 +1,12 @@
 import warnings
 
-from itertools import chain
-from typing import Tuple, List, Dict, Set
+from typing import Callable, Iterable, Tuple, List, Dict, Optional, Set
 
 
 from .model import CleanAccount
 from ...load.balances import Account, Snapshot
 from ...load.transactions import Transaction
-from ...log import logger
+from ... import log
 
 try:
     # private configuration
@@ -28,9 +27,10 @@ def get_configuration() -> List[CleanAccount]:
     return list(accounts_conf())
 
 
-def clean_data(
-    balances: List[Snapshot], transactions: List[Transaction]
-) -> Tuple[List[Snapshot], List[Transaction]]:
+def account_cleaner() -> Callable[[Account], Account]:
+    """
+    Replaces the metadata for an account, if it's in the configuration
+    """
     cleaners: List[CleanAccount] = get_configuration()
     # create O(1) access, use non-nullable fields
     cleaner_map: Dict[Tuple[str, str, str], CleanAccount] = {
@@ -38,53 +38,95 @@ def clean_data(
         for cl in cleaners
     }
 
+    def clean(acc: Account) -> Account:
+        # if this should be replaced
+        key = (acc.institution, acc.account, acc.account_type)
+        if key not in cleaner_map:
+            return acc
+        cl: CleanAccount = cleaner_map[key]
+        return Account(
+            institution=cl.to_institution,  # replace metadata
+            account=cl.to_account,
+            account_type=cl.to_account_type,
+            current=acc.current,
+            available=acc.available,
+            limit=acc.limit,
+            currency=acc.currency,
+        )
+
+    return clean
+
+
+def cleaned_account_names(accounts: Iterable[Account]) -> Set[str]:
+    clean = account_cleaner()
+    return {clean(acc).account for acc in accounts}
+
+
+def clean_snapshots(balances: List[Snapshot]) -> List[Snapshot]:
+    clean = account_cleaner()
+    # snapshots share most of their Accounts, so only clean each one once
+    cleaned: Dict[Account, Account] = {}
+
     cleaned_balances: List[Snapshot] = []
 
     # clean data for accounts on accounts
     for snapshot in balances:
         cleaned_accounts = []
         for acc in snapshot.accounts:
-            # if this should be replaced
-            key = (acc.institution, acc.account, acc.account_type)
-            if key in cleaner_map:
-                cl: CleanAccount = cleaner_map[key]
-                cleaned_accounts.append(
-                    Account(
-                        institution=cl.to_institution,  # replace metadata
-                        account=cl.to_account,
-                        account_type=cl.to_account_type,
-                        current=acc.current,
-                        available=acc.available,
-                        limit=acc.limit,
-                        currency=acc.currency,
-                    )
-                )
-            else:
-                cleaned_accounts.append(acc)
+            cleaned_acc = cleaned.get(acc)
+            if cleaned_acc is None:
+                cleaned_acc = cleaned[acc] = clean(acc)
+            cleaned_accounts.append(cleaned_acc)
         cleaned_balances.append(Snapshot(at=snapshot.at, accounts=cleaned_accounts))
+    return cleaned_balances
+
 
-    # replace account names on transactions
+def account_stages(
+    cleaned_balances: List[Snapshot],
+    account_names: Optional[Set[str]] = None,
+) -> List[Callable[[Transaction], Transaction]]:
+    """
+    Pipeline stages (see budget.cleandata.pipeline) which replace the account
+    names on transactions, and use the default account for any transactions
+    whose account isn't in the cleaned balances (or account_names, if given)
+    """
+    cleaners: List[CleanAccount] = get_configuration()
     replace_account: Dict[str, str] = {
         cl.from_account: cl.to_account for cl in cleaners
     }
-    for tr in transactions:
+    # get names of all the accounts, including any manual ones
+    if account_names is None:
+        account_names = {
+            acc.account for snapshot in cleaned_balances for acc in snapshot.accounts
+        }
+
+    def replace_name(tr: Transaction) -> Transaction:
         if tr.account.strip() and tr.account in replace_account:
             tr.account = replace_account[tr.account]
+        return tr
 
-    # validate data
-    # get names of all the accounts, including any manual ones
-    account_names: Set[str] = set(
-        chain(*[[acc.account for acc in cl.accounts] for cl in cleaned_balances])  # type: ignore[arg-type]
-    )
     # make sure every transaction is attached to an account
     # could just define a 'cash' institution if you wanted to keep track of money in wallet
-    for tr in transactions:
+    def use_default(tr: Transaction) -> Transaction:
         if tr.account not in account_names:
-            logger.debug("Using default account name for {}...".format(tr))
+            log.logger.debug("Using default account name for {}...".format(tr))
             tr.account = default_account
-            # warnings.warn(
-            #    "Could not find balance information for {} (in {}) in accounts!: {}".format(
-            #        tr.account, tr, account_names
-            #    )
-            # )
-    return (cleaned_balances, transactions)
+        return tr
+
+    return [replace_name, use_default]
+
+
+def clean_transactions(
+    transactions: List[Transaction], cleaned_balances: List[Snapshot]
+) -> List[Transaction]:
+    replace_name, use_default = account_stages(cleaned_balances)
+    for tr in transactions:
+        use_default(replace_name(tr))
+    return transactions
+
+
+def clean_data(
+    balances: List[Snapshot], transactions: List[Transaction]
+) -> Tuple[List[Snapshot], List[Transaction]]:
+    cleaned_balances = clean_snapshots(balances)
+    return (cleaned_balances, clean_transactions(transactions, cleaned_balances))
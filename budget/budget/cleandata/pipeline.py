@@ -0,0 +1,94 @@
+"""
+Runs each transaction through a list of stages in one pass, instead of
+building a new list of every transaction for each step of cleaning them
+
+A stage is called with each transaction, and returns it (edited or not),
+or None to drop it. If a stage has a done() method, that's called after
+the last transaction, e.g. to log a summary or save a cache
+
+To add your own, pass stages to budget.Dataset, those run after the
+default ones
+"""
+
+from collections import Counter
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+)
+
+from .. import log
+from ..load.balances import Snapshot
+from ..load.transactions import Transaction
+
+Stage = Callable[[Transaction], Optional[Transaction]]
+
+
+def run_stages(
+    transactions: Iterable[Transaction], stages: Sequence[Stage]
+) -> Iterator[Transaction]:
+    for tr in transactions:
+        result: Optional[Transaction] = tr
+        for stage in stages:
+            result = stage(result)  # type: ignore[arg-type]
+            if result is None:
+                break
+        if result is not None:
+            yield result
+    for stage in stages:
+        done = getattr(stage, "done", None)
+        if done is not None:
+            done()
+
+
+class MetaCategories:
+    """
+    Sets the meta category for each transaction from its category. Logs
+    the categories which don't have a meta category once, when done
+    """
+
+    def __init__(self, mapping: Optional[Dict[str, str]] = None) -> None:
+        if mapping is None:
+            from .transactions.meta_categories import META_CATEGORIES
+
+            mapping = META_CATEGORIES
+        self.mapping = mapping
+        self.missing: Counter[str] = Counter()
+
+    def __call__(self, tr: Transaction) -> Transaction:
+        if tr.category in self.mapping:
+            tr.meta_category = self.mapping[tr.category]
+        else:
+            self.missing[tr.category] += 1
+        return tr
+
+    def done(self) -> None:
+        for category, count in self.missing.items():
+            log.logger.info(
+                "Couldn't find meta_category for {} ({} transactions)".format(
+                    category, count
+                )
+            )
+
+
+def default_stages(
+    cleaned_snapshots: List[Snapshot], account_names: Optional[Set[str]] = None
+) -> List[Stage]:
+    """
+    What budget.data() does to each transaction: fix account names (which
+    uses the account names from the cleaned balances, or account_names),
+    transform the description/categories, then set the meta category
+    """
+    from .accounts.fix_account_names import account_stages
+    from .transactions.transform import Transform  # type: ignore[attr-defined]
+
+    return [
+        *account_stages(cleaned_snapshots, account_names),
+        Transform(),
+        MetaCategories(),
+    ]
@@ -17,6 +17,9 @@ PredicateHandler = Tuple[bool, EditTransaction]
 Matcher = Callable[[Transaction], PredicateHandler]
 
 
-@lru_cache(maxsize=None)
+# the same few hundred merchant names show up over and over
+_casefold = lru_cache(maxsize=4096)(str.casefold)
+
+
 def desc(t: Transaction) -> str:
-    return t.name.casefold()
+    return _casefold(t.name)
@@ -0,0 +1,412 @@
+"""
+Declarative rules for transforming transactions, compiled so that
+transforming a transaction doesn't mean checking every rule against it
+
+A Rule has conditions on the transaction's fields, all of which have
+to match for the rule to apply. Each condition checks whether any of its
+values is in (Contains), starts (Prefix) or is (Equals) the field, or if
+any of its patterns match (Regex). The field is casefolded first unless
+exact=True, and any characters in ignore are removed, e.g.
+Contains("carls jr", ignore="'.") matches "Carl's Jr."
+
+When a rule matches it sets the name/category, or drops the transaction.
+Like the Matcher lambdas, rules are applied in order, and matching
+continues after a rule applies, so later rules see the edited transaction
+
+A RuleSet indexes the rules by one condition each; all the Contains
+values for a field are put in one Aho-Corasick automaton, and the Equals
+and Prefix values in dicts. So only the rules whose indexed condition
+matches are checked, no matter how many rules there are
+
+Since rules only look at/edit the name, account and category, what a
+RuleSet does to a transaction only depends on those. A CachedRuleSet
+remembers that for each one it's seen, saved to disk under the hash of
+its rules, so the same merchant only goes through the rules once
+"""
+
+import re
+import hashlib
+import warnings
+from abc import ABC, abstractmethod
+from collections import deque
+from pathlib import Path
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Pattern,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
+
+from . import PredicateHandler
+from ...load.cache import (
+    SCHEMA_VERSION,
+    cache_dir,
+    cache_enabled,
+    read_pickle,
+    write_pickle,
+)
+from ...load.transactions import Transaction
+
+FIELDS = ("name", "account", "category")
+
+
+class Condition(ABC):
+    kind = ""
+
+    def __init__(
+        self, *values: str, field: str = "name", exact: bool = False, ignore: str = ""
+    ) -> None:
+        if not values:
+            raise ValueError(f"{type(self).__name__} needs at least one value")
+        if field not in FIELDS:
+            raise ValueError(f"Unknown field {field}, should be one of {FIELDS}")
+        self.field = field
+        self.exact = exact
+        self.ignore = ignore
+        self._strip = str.maketrans("", "", ignore)
+        # match the values against the text the same way
+        self.values: Tuple[str, ...] = tuple(self.normalize(v) for v in values)
+
+    @property
+    def view(self) -> Tuple[str, bool, str]:
+        # conditions with the same view look at the same text
+        return (self.field, self.exact, self.ignore)
+
+    def normalize(self, value: object) -> str:
+        text = str(value)
+        if not self.exact:
+            text = text.casefold()
+        if self.ignore:
+            text = text.translate(self._strip)
+        return text
+
+    @abstractmethod
+    def test(self, text: str) -> bool:
+        """
+        If the (normalized) text of the field matches
+        """
+
+    def matches(self, tr: Transaction) -> bool:
+        return self.test(self.normalize(getattr(tr, self.field)))
+
+    def __repr__(self) -> str:
+        args = [repr(v) for v in self.values]
+        if self.field != "name":
+            args.append(f"field={self.field!r}")
+        if self.exact:
+            args.append("exact=True")
+        if self.ignore:
+            args.append(f"ignore={self.ignore!r}")
+        return f"{type(self).__name__}({', '.join(args)})"
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, Condition) and repr(self) == repr(other)
+
+    def __hash__(self) -> int:
+        return hash(repr(self))
+
+
+class Contains(Condition):
+    kind = "contains"
+
+    def test(self, text: str) -> bool:
+        return any(v in text for v in self.values)
+
+
+class Prefix(Condition):
+    kind = "prefix"
+
+    def test(self, text: str) -> bool:
+        return text.startswith(self.values)
+
+
+class Equals(Condition):
+    kind = "equals"
+
+    def test(self, text: str) -> bool:
+        return text in self.values
+
+
+class Regex(Condition):
+    kind = "regex"
+
+    def __init__(
+        self, *patterns: str, field: str = "name", exact: bool = False, ignore: str = ""
+    ) -> None:
+        super().__init__(*patterns, field=field, exact=exact, ignore=ignore)
+        # patterns aren't casefolded, match the casefolded text with re.IGNORECASE
+        self.values = patterns
+        flags = 0 if exact else re.IGNORECASE
+        self.patterns: List[Pattern[str]] = [re.compile(p, flags) for p in patterns]
+
+    def test(self, text: str) -> bool:
+        return any(p.search(text) for p in self.patterns)
+
+
+class Rule:
+    """
+    If every condition in when matches, set the name/category, or drop the
+    transaction. A Rule can also be used as a Matcher
+    """
+
+    def __init__(
+        self,
+        when: Union[Condition, Sequence[Condition]],
+        name: Optional[str] = None,
+        category: Optional[str] = None,
+        drop: bool = False,
+    ) -> None:
+        self.when: Tuple[Condition, ...] = (
+            (when,) if isinstance(when, Condition) else tuple(when)
+        )
+        if not self.when:
+            raise ValueError("A Rule needs at least one condition")
+        self.name = name
+        self.category = category
+        self.drop = drop
+
+    def matches(self, tr: Transaction) -> bool:
+        return all(c.matches(tr) for c in self.when)
+
+    def apply(self, tr: Transaction) -> Optional[Transaction]:
+        if self.drop:
+            return None
+        if self.name is not None:
+            tr.name = self.name
+        if self.category is not None:
+            tr.category = self.category
+        return tr
+
+    def __call__(self, tr: Transaction) -> PredicateHandler:
+        return self.matches(tr), lambda: (self.apply(tr),)
+
+    def __repr__(self) -> str:
+        when = self.when[0] if len(self.when) == 1 else list(self.when)
+        args = [repr(when)]
+        for attr in ("name", "category"):
+            if getattr(self, attr) is not None:
+                args.append(f"{attr}={getattr(self, attr)!r}")
+        if self.drop:
+            args.append("drop=True")
+        return f"Rule({', '.join(args)})"
+
+
+class Automaton:
+    """
+    Aho-Corasick automaton, finds which of the words are in some text
+    in one pass over the text
+    """
+
+    def __init__(self) -> None:
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.out: List[Set[int]] = [set()]
+
+    def add(self, word: str, value: int) -> None:
+        state = 0
+        for char in word:
+            nxt = self.goto[state].get(char)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto.append({})
+                self.fail.append(0)
+                self.out.append(set())
+                self.goto[state][char] = nxt
+            state = nxt
+        self.out[state].add(value)
+
+    def build(self) -> None:
+        # breadth first, so the fail state for each state is already done
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, nxt in self.goto[state].items():
+                queue.append(nxt)
+                fail = self.fail[state]
+                while fail and char not in self.goto[fail]:
+                    fail = self.fail[fail]
+                target = self.goto[fail].get(char, 0)
+                self.fail[nxt] = target if target != nxt else 0
+                self.out[nxt] |= self.out[self.fail[nxt]]
+
+    def search(self, text: str) -> Set[int]:
+        goto, fail, out = self.goto, self.fail, self.out
+        found: Set[int] = set()
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if out[state]:
+                found |= out[state]
+        return found
+
+
+class _Index:
+    """
+    The rules indexed by a condition on one view of the transaction
+    """
+
+    def __init__(self, normalize: Callable[[object], str]) -> None:
+        self.normalize = normalize
+        self.contains = Automaton()
+        self.equals: Dict[str, Set[int]] = {}
+        self.prefixes: Dict[str, Set[int]] = {}
+        self.prefix_lengths: List[int] = []
+        self.always: Set[int] = set()
+
+    def add(self, cond: Condition, rule: int) -> None:
+        for value in cond.values:
+            if cond.kind == "equals":
+                self.equals.setdefault(value, set()).add(rule)
+            elif value == "":
+                # everything contains/starts with ""
+                self.always.add(rule)
+            elif cond.kind == "contains":
+                self.contains.add(value, rule)
+            else:
+                self.prefixes.setdefault(value, set()).add(rule)
+
+    def build(self) -> None:
+        self.contains.build()
+        self.prefix_lengths = sorted({len(p) for p in self.prefixes})
+
+    def candidates(self, value: object) -> Set[int]:
+        text = self.normalize(value)
+        found = self.contains.search(text) | self.always
+        found |= self.equals.get(text, set())
+        for length in self.prefix_lengths:
+            if length > len(text):
+                break
+            found |= self.prefixes.get(text[:length], set())
+        return found
+
+
+class RuleSet:
+    """
+    A list of rules, compiled to find the ones which could match a
+    transaction without checking each of them
+    """
+
+    def __init__(self, rules: Iterable[Rule]) -> None:
+        self.rules: List[Rule] = list(rules)
+        self._indexes: Dict[Tuple[str, bool, str], _Index] = {}
+        # rules with only regex conditions, checked against everything
+        self._unindexed: Set[int] = set()
+        for i, rule in enumerate(self.rules):
+            anchor = next((c for c in rule.when if c.kind != "regex"), None)
+            if anchor is None:
+                self._unindexed.add(i)
+                continue
+            if anchor.view not in self._indexes:
+                self._indexes[anchor.view] = _Index(anchor.normalize)
+            self._indexes[anchor.view].add(anchor, i)
+        for index in self._indexes.values():
+            index.build()
+
+    def candidates(self, tr: Transaction, after: int = -1) -> List[int]:
+        """
+        The rules (indices, in order) after 'after' which could match tr
+        """
+        found = set(self._unindexed)
+        for (field, _, _), index in self._indexes.items():
+            found |= index.candidates(getattr(tr, field))
+        return sorted(i for i in found if i > after)
+
+    def apply(self, tr: Transaction) -> Optional[Transaction]:
+        """
+        Apply each matching rule to tr in order, returns None if it was dropped
+        """
+        candidates = self.candidates(tr)
+        pos = 0
+        while pos < len(candidates):
+            i = candidates[pos]
+            pos += 1
+            rule = self.rules[i]
+            if not rule.matches(tr):
+                continue
+            before = (tr.name, tr.category)
+            if rule.apply(tr) is None:
+                return None
+            # the rules that could match the edited transaction might be different
+            if (tr.name, tr.category) != before:
+                candidates = self.candidates(tr, after=i)
+                pos = 0
+        return tr
+
+    def __len__(self) -> int:
+        return len(self.rules)
+
+
+# change this if what rules do changes, so results saved by older versions aren't used
+RULES_VERSION = 1
+
+# (name, account, category) -> (name, category), or None if it was dropped
+TransformKey = Tuple[str, str, str]
+TransformResult = Optional[Tuple[str, str]]
+
+
+class CachedRuleSet(RuleSet):
+    """
+    A RuleSet which remembers the result for each (name, account, category)
+    it applies to. The results are saved in the cache directory, keyed
+    by a hash of the rules, so they're invalidated when the rules change
+
+    persist defaults to whether the cache is enabled (see budget.load.cache)
+    """
+
+    def __init__(self, rules: Iterable[Rule], persist: Optional[bool] = None) -> None:
+        super().__init__(rules)
+        rule_text = "\n".join([str(RULES_VERSION)] + [repr(r) for r in self.rules])
+        self.version = hashlib.sha256(rule_text.encode()).hexdigest()[:32]
+        self.persist = persist if persist is not None else cache_enabled()
+        self._results: Optional[Dict[TransformKey, TransformResult]] = None
+        self._added = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def path(self) -> Path:
+        return cache_dir() / f"v{SCHEMA_VERSION}" / "transforms" / self.version
+
+    @property
+    def results(self) -> Dict[TransformKey, TransformResult]:
+        if self._results is None:
+            saved = read_pickle(self.path) if self.persist else None
+            self._results = saved if isinstance(saved, dict) else {}
+        return self._results
+
+    def apply(self, tr: Transaction) -> Optional[Transaction]:
+        key = (tr.name, tr.account, tr.category)
+        results = self.results
+        if key in results:
+            self.hits += 1
+            result = results[key]
+            if result is None:
+                return None
+            tr.name, tr.category = result
+            return tr
+        self.misses += 1
+        edited = super().apply(tr)
+        results[key] = None if edited is None else (edited.name, edited.category)
+        self._added += 1
+        return edited
+
+    def save(self) -> None:
+        """
+        Save the results to disk, if there are any new ones
+        """
+        if not self.persist or self._added == 0 or self._results is None:
+            return
+        try:
+            write_pickle(self.path, self._results)
+        except OSError as e:
+            warnings.warn(f"Could not save transform results to {self.path}: {e}")
+            self.persist = False
+        self._added = 0
@@ -1,336 +1,164 @@
 # type: ignore
 import warnings
 
-from functools import lru_cache
-from typing import Iterator, List, Optional
+from typing import Iterator, List, Optional, Union
 
-from . import Matcher, Transaction, desc
+from more_itertools import chunked
+
+from ... import timing
+from . import Matcher, Transaction
+from .rules import CachedRuleSet, Contains, Equals, Prefix, Rule, RuleSet
 
 try:
     # create a file called ./maps_conf.py
-    # which has custom_maps to convert transactions
+    # which has custom_maps to convert transactions. That can yield
+    # Rules (see ./rules.py), or Matcher lambdas
     from .maps_conf import custom_maps  # type: ignore[import]
 except ImportError:
     warnings.warn("Could not import maps_conf.py")
     custom_maps = lambda: []
 
 
-# return multiple functions
-# returns (predicate result, function that edits transaction)
-def default_maps() -> Iterator[Matcher]:
-    yield lambda t: (
-        "starbucks" in desc(t),
-        lambda: (
-            setattr(t, "name", "Starbucks"),
-            setattr(t, "category", "Coffee Shops"),
-            t,
-        ),
-    )
-    yield lambda t: (
-        "spotify" in desc(t),
-        lambda: (
-            setattr(t, "name", "Spotify"),
-            setattr(t, "category", "Subscriptions"),
-            t,
-        ),
-    )
-    yield lambda t: (
-        desc(t).startswith("lyft"),
-        lambda: (setattr(t, "name", "Lyft"), setattr(t, "category", "Travel"), t),
-    )
-    yield lambda t: (desc(t) == "uber", lambda: (setattr(t, "category", "Travel"), t))
-    yield lambda t: (
-        "amazon prime" in desc(t),
-        lambda: (
-            setattr(t, "name", "Amazon Prime"),
-            setattr(t, "category", "Subscriptions"),
-            t,
-        ),
-    )
-    yield lambda t: (
-        "ubiquiti inc." in desc(t),
-        lambda: (
-            setattr(t, "name", "Ubiquiti"),
-            setattr(t, "category", "Technology"),
-            t,
-        ),
-    )
-    yield lambda t: (
-        "dreamhost" in desc(t),
-        lambda: (setattr(t, "category", "Technology"), t),
-    )
-    yield lambda t: (
-        "fandango" in desc(t),
-        lambda: (
-            setattr(t, "name", "Fandango"),
-            setattr(t, "category", "Entertainment"),
-            t,
-        ),
-    )
-    yield lambda t: (
-        "vultr" in desc(t),
-        lambda: (setattr(t, "name", "Vultr"), setattr(t, "category", "Technology"), t),
-    )
-    yield lambda t: (
-        "scaleway" in desc(t),
-        lambda: (
-            setattr(t, "name", "Scaleway"),
-            setattr(t, "category", "Technology"),
-            t,
-        ),
-    )
-    yield lambda t: (
-        "amazon" in desc(t) or "amzn mktp" in desc(t) or "amzn digital" in desc(t),
-        lambda: (setattr(t, "name", "Amazon"), setattr(t, "category", "Shopping"), t),
-    )
-    yield lambda t: (
-        "doordash" in desc(t),
-        lambda: (
-            setattr(t, "name", "DoorDash"),
-            setattr(t, "category", "Food Dining"),
-            t,
-        ),
-    )
-    yield lambda t: (
-        "jack in the box" in desc(t),
-        lambda: (
-            setattr(t, "name", "Jack in the Box"),
-            setattr(t, "category", "Fast Food"),
-            t,
-        ),
-    )
-    yield lambda t: (
-        "carls jr" in desc(t).replace("'", "").replace(".", ""),
-        lambda: (
-            setattr(t, "name", "Carls Jr"),
-            setattr(t, "category", "Fast Food"),
-            t,
-        ),
-    )
-    yield lambda t: (
-        "mcdonalds" in desc(t).replace("'", ""),
-        lambda: (
-            setattr(t, "name", "McDonalds"),
-            setattr(t, "category", "Fast Food"),
-            t,
-        ),
-    )
-    yield lambda t: (
-        desc(t).replace("'", "").startswith("dennys"),
-        lambda: (
-            setattr(t, "name", "Denny's"),
-            setattr(t, "category", "Fast Food"),
-            t,
-        ),
-    )
-    yield lambda t: (
-        "subway" in desc(t),
-        lambda: (
-            setattr(t, "name", "Subway"),
-            setattr(t, "category", "Fast Food"),
-            t,
-        ),
-    )
-    yield lambda t: (
-        "walgreen" in desc(t),
-        lambda: (
-            setattr(t, "name", "Walgreens"),
-            setattr(t, "category", "Pharmacy"),
-            t,
-        ),
-    )
-    yield lambda t: (
-        "peets" in desc(t),
-        lambda: (
-            setattr(t, "name", "Peets Coffee"),
-            setattr(t, "category", "Coffee Shops"),
-            t,
-        ),
-    )
-    yield lambda t: (
-        "safeway" in desc(t),
-        lambda: (
-            setattr(t, "name", "Safeway"),
-            setattr(t, "category", "Groceries"),
-            t,
-        ),
-    )
-    yield lambda t: (
-        "namecheap" in desc(t) or "name-cheap" in desc(t),
-        lambda: (
-            setattr(t, "name", "NameCheap"),
-            setattr(t, "category", "Technology"),
-            t,
-        ),
-    )
-    yield lambda t: (
-        "github.com" in desc(t),
-        lambda: (
-            setattr(t, "name", "Github Pro"),
-            setattr(t, "category", "Subscriptions"),
-            t,
-        ),
-    )
+PAYPAL = Equals("PayPal", field="account", exact=True)
+
+DEFAULT_RULES: List[Rule] = [
+    Rule(Contains("starbucks"), name="Starbucks", category="Coffee Shops"),
+    Rule(Contains("spotify"), name="Spotify", category="Subscriptions"),
+    Rule(Prefix("lyft"), name="Lyft", category="Travel"),
+    Rule(Equals("uber"), category="Travel"),
+    Rule(Contains("amazon prime"), name="Amazon Prime", category="Subscriptions"),
+    Rule(Contains("ubiquiti inc."), name="Ubiquiti", category="Technology"),
+    Rule(Contains("dreamhost"), category="Technology"),
+    Rule(Contains("fandango"), name="Fandango", category="Entertainment"),
+    Rule(Contains("vultr"), name="Vultr", category="Technology"),
+    Rule(Contains("scaleway"), name="Scaleway", category="Technology"),
+    Rule(
+        Contains("amazon", "amzn mktp", "amzn digital"),
+        name="Amazon",
+        category="Shopping",
+    ),
+    Rule(Contains("doordash"), name="DoorDash", category="Food Dining"),
+    Rule(Contains("jack in the box"), name="Jack in the Box", category="Fast Food"),
+    Rule(Contains("carls jr", ignore="'."), name="Carls Jr", category="Fast Food"),
+    Rule(Contains("mcdonalds", ignore="'"), name="McDonalds", category="Fast Food"),
+    Rule(Prefix("dennys", ignore="'"), name="Denny's", category="Fast Food"),
+    Rule(Contains("subway"), name="Subway", category="Fast Food"),
+    Rule(Contains("walgreen"), name="Walgreens", category="Pharmacy"),
+    Rule(Contains("peets"), name="Peets Coffee", category="Coffee Shops"),
+    Rule(Contains("safeway"), name="Safeway", category="Groceries"),
+    Rule(
+        Contains("namecheap", "name-cheap"), name="NameCheap", category="Technology"
+    ),
+    Rule(Contains("github.com"), name="Github Pro", category="Subscriptions"),
     # conert category; 'transfer - credit' to just 'trasfer'
-    yield lambda t: (
-        str(t.category).lower().startswith("transfer - "),
-        lambda: (
-            setattr(t, "category", "Transfer"),
-            t,
-        ),
-    )
+    Rule(Prefix("transfer - ", field="category"), category="Transfer"),
     # treat investments as trasfers, resulting account balance shows up in balances anways
-    yield lambda t: (
-        str(t.category) == "service - financial - financial planning and investments",
-        lambda: (
-            setattr(t, "category", "Transfer"),
-            t,
-        ),
-    )
-    yield lambda t: (
-        # ignore payment holds (e.g. eBay) for paypal
-        str(t.category).lower()
-        in [
-            "payment hold",
-            "reversal of general account hold",
-            "account hold for open authorization",
-            "payment release",
-        ]
-        and t.account == "PayPal",
-        lambda: (None,),
-    )
+    Rule(
+        Equals(
+            "service - financial - financial planning and investments",
+            field="category",
+            exact=True,
+        ),
+        category="Transfer",
+    ),
+    # ignore payment holds (e.g. eBay) for paypal
+    Rule(
+        [
+            Equals(
+                "payment hold",
+                "reversal of general account hold",
+                "account hold for open authorization",
+                "payment release",
+                field="category",
+            ),
+            PAYPAL,
+        ],
+        drop=True,
+    ),
     # ignore currency conversions from paypal
-    yield lambda t: (
-        # ignore payment holds (e.g. eBay) for paypal
-        str(t.category).lower() == "general currency conversion"
-        and t.account == "PayPal",
-        lambda: (None,),
-    )
+    Rule([Equals("general currency conversion", field="category"), PAYPAL], drop=True),
     # mark paypal withdrawal/transfers as 'transfer'
-    yield lambda t: (
-        # ignore payment holds (e.g. eBay) for paypal
-        str(t.category).lower()
-        in [
-            "general credit card withdrawal",
-            "general credit card deposit",
-            "general withdrawal",
-        ]
-        and t.account == "PayPal",
-        lambda: (
-            setattr(t, "category", "Transfer"),
-            t,
-        ),
-    )
-    yield lambda t: ("aws" == desc(t), lambda: (setattr(t, "category", "Business"), t))
-    yield lambda t: (
-        "fee for overdraft item" in desc(t),
-        lambda: (setattr(t, "category", "Fees"), t),
-    )
-    yield lambda t: (
-        "fee for overdraft item" in desc(t),
-        lambda: (setattr(t, "category", "Fees"), t),
-    )
-    yield lambda t: (
-        "chess.com" in desc(t),
-        lambda: (
-            setattr(t, "name", "chess.com"),
-            setattr(t, "category", "Entertainment"),
-            t,
-        ),
-    )
-    yield lambda t: (
-        "steamgames" in desc(t),
-        lambda: (
-            setattr(t, "name", "Steam"),
-            setattr(t, "category", "Entertainment"),
-            t,
-        ),
-    )
-    yield lambda t: (
-        "riot*" in desc(t),
-        lambda: (
-            setattr(t, "name", "Riot Games"),
-            setattr(t, "category", "Entertainment"),
-            t,
-        ),
-    )
-    yield lambda t: (
-        "cvs" == desc(t),
-        lambda: (
-            setattr(t, "category", "Pharmacy"),
-            t,
-        ),
-    )
-    yield lambda t: (
-        "reddit" in desc(t),
-        lambda: (
-            setattr(t, "name", "Reddit"),
-            setattr(t, "category", "Entertainment"),
-            t,
-        ),
-    )
-    yield lambda t: (
-        "ebay" in desc(t),
-        lambda: (
-            setattr(t, "name", "eBay"),
-            setattr(t, "category", "Merchandise"),
-            t,
-        ),
-    )
-    yield lambda t: (
-        "motorola" in desc(t),
-        lambda: (
-            setattr(t, "name", "Motorola"),
-            setattr(t, "category", "Electronics"),
-            t,
-        ),
-    )
-    yield lambda t: (
-        "patreon" in desc(t),
-        lambda: (
-            setattr(t, "name", "Patreon"),
-            setattr(t, "category", "Subscriptions"),
-            t,
-        ),
-    )
-    yield lambda t: (
-        "trakt" in desc(t),
-        lambda: (
-            setattr(t, "name", "Trakt"),
-            setattr(t, "category", "Subscriptions"),
-            t,
-        ),
-    )
-    yield lambda t: (
-        "discord" in desc(t) and "classic" in desc(t),
-        lambda: (
-            setattr(t, "name", "Discord"),
-            setattr(t, "category", "Entertainment"),
-            t,
-        ),
-    )
+    Rule(
+        [
+            Equals(
+                "general credit card withdrawal",
+                "general credit card deposit",
+                "general withdrawal",
+                field="category",
+            ),
+            PAYPAL,
+        ],
+        category="Transfer",
+    ),
+    Rule(Equals("aws"), category="Business"),
+    Rule(Contains("fee for overdraft item"), category="Fees"),
+    Rule(Contains("chess.com"), name="chess.com", category="Entertainment"),
+    Rule(Contains("steamgames"), name="Steam", category="Entertainment"),
+    Rule(Contains("riot*"), name="Riot Games", category="Entertainment"),
+    Rule(Equals("cvs"), category="Pharmacy"),
+    Rule(Contains("reddit"), name="Reddit", category="Entertainment"),
+    Rule(Contains("ebay"), name="eBay", category="Merchandise"),
+    Rule(Contains("motorola"), name="Motorola", category="Electronics"),
+    Rule(Contains("patreon"), name="Patreon", category="Subscriptions"),
+    Rule(Contains("trakt"), name="Trakt", category="Subscriptions"),
+    Rule(
+        [Contains("discord"), Contains("classic")],
+        name="Discord",
+        category="Entertainment",
+    ),
+]
+
 
+# each step is either a compiled set of rules, or a Matcher from custom_maps
+Step = Union[RuleSet, Matcher]
 
-@lru_cache(1)
-def maps() -> List[Matcher]:
-    # get custom maps, then defaults
-    def maps_gen() -> Iterator[Matcher]:
-        yield from custom_maps()
-        yield from default_maps()
+# the rules are compiled/cached in chunks of this many, so editing one of
+# them only means re-applying the rules in that chunk
+CHUNK_SIZE = 64
 
-    return list(maps_gen())
 
+def _compile(rules: List[Rule]) -> Iterator[CachedRuleSet]:
+    for chunk in chunked(rules, CHUNK_SIZE):
+        yield CachedRuleSet(chunk)
 
-# handles a single transaction, calls every lambda against it
-# in order (custom maps first, then default maps)
-def transform_single(tr: Transaction) -> Optional[Transaction]:
-    for m in maps():
-        # try with this pattern
-        resp, tr_func = m(tr)
-        if resp is True:  # this transaction matched the predicate from the Matcher
-            # call the function so the transaction is edited, and reassign it to tr
-            # reassign so other matchers might apply to this, and continue matching
-            tr = tr_func()[-1]  # type: ignore
+
+def steps() -> List[Step]:
+    """
+    The custom maps, then the default rules. Consecutive Rules are compiled
+    into RuleSets, any Matcher lambdas are run in between them
+
+    Each Transform compiles these again, so any changes to custom_maps (and
+    BUDGET_NO_CACHE) apply to the next run
+    """
+    compiled: List[Step] = []
+    pending: List[Rule] = []
+    for m in custom_maps():
+        if isinstance(m, Rule):
+            pending.append(m)
+            continue
+        compiled.extend(_compile(pending))
+        pending = []
+        compiled.append(m)
+    compiled.extend(_compile(pending))
+    compiled.extend(_compile(DEFAULT_RULES))
+    return compiled
+
+
+# handles a single transaction, applying each step in order (custom maps
+# first, then default maps). compiled defaults to steps()
+def transform_single(
+    tr: Transaction, compiled: Optional[List[Step]] = None
+) -> Optional[Transaction]:
+    for step in compiled if compiled is not None else steps():
+        if isinstance(step, RuleSet):
+            tr = step.apply(tr)
+        else:
+            # try with this pattern
+            resp, tr_func = step(tr)
+            if resp is True:  # this transaction matched the predicate from the Matcher
+                # call the function so the transaction is edited, and reassign it to tr
+                # reassign so other matchers might apply to this, and continue matching
+                tr = tr_func()[-1]  # type: ignore
         # if the tr_func returned none, the transaction should exit early from
         # comparing against other matchers; this should be ignored
         if tr is None:
@@ -338,6 +166,32 @@ def transform_single(tr: Transaction) -> Optional[Transaction]:
     return tr  # if none matched, this returns 'transact', else the updated tr
 
 
+class Transform:
+    """
+    transform_single as a pipeline stage (see budget.cleandata.pipeline).
+    When done, counts the cache hits/misses and saves the results for
+    any new merchants
+    """
+
+    def __init__(self) -> None:
+        # the results in memory only last for this run
+        self.steps = steps()
+        self.cached = [step for step in self.steps if isinstance(step, CachedRuleSet)]
+
+    def __call__(self, tr: Transaction) -> Optional[Transaction]:
+        return transform_single(tr, self.steps)
+
+    def done(self) -> None:
+        timing.count(
+            cache_hits=sum(c.hits for c in self.cached),
+            cache_misses=sum(c.misses for c in self.cached),
+        )
+        for step in self.cached:
+            step.save()
+
+
 # handles all transactions, discards None
 def transform_all(transactions: List[Transaction]) -> Iterator[Transaction]:
-    yield from filter(lambda r: r is not None, map(transform_single, transactions))
+    from ..pipeline import run_stages
+
+    yield from run_stages(transactions, [Transform()])
@@ -0,0 +1,298 @@
+"""
+Saves the cleaned transactions/balance snapshots as Arrow (Feather v2)
+files, so other code can load them in a few milliseconds instead of
+going over the git history with budget.data()
+
+'budget export [DIR]' writes DIR/transactions.arrow and DIR/balances.arrow,
+budget.load_export(DIR) memory maps them. DIR defaults to a directory
+for the data directory in the cache directory (see budget.load.cache)
+
+Amounts are integer cents, the text columns are dictionary encoded
+(pandas categoricals), and the schema metadata has the HEAD commit of
+the data directory when it was exported, see Export.is_current
+
+Needs pyarrow, 'pip install budget[export]'
+"""
+
+import os
+import json
+from datetime import date, datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import pandas as pd  # type: ignore[import]
+    import pyarrow as pa  # type: ignore[import]
+    from . import Dataset
+    from array import array
+    from .load.balances import Snapshot
+
+# change this if the columns change, so older exports aren't loaded
+EXPORT_VERSION = 1
+
+TRANSACTIONS_FILE = "transactions.arrow"
+BALANCES_FILE = "balances.arrow"
+METADATA_KEY = b"budget"
+
+_EPOCH = date(1970, 1, 1).toordinal()
+
+
+def default_export_dir(ddir: Path) -> Path:
+    from .load.cache import cache_dir, data_key
+
+    return cache_dir() / "export" / data_key(ddir)
+
+
+def _text(codes: "array[int]", values: List[Optional[str]]) -> "pa.DictionaryArray":
+    import numpy as np  # type: ignore[import]
+    import pyarrow as pa
+
+    # only the strings used in this column. None isn't in the dictionary,
+    # those rows are nulls
+    used, indices = np.unique(np.asarray(codes), return_inverse=True)
+    strings = [values[c] for c in used]
+    mask = None
+    if None in strings:
+        null = strings.index(None)
+        del strings[null]
+        mask = indices == null
+        indices = np.where(indices > null, indices - 1, indices)
+    return pa.DictionaryArray.from_arrays(
+        pa.array(indices.astype(np.int32), mask=mask),
+        pa.array(strings, type=pa.string()),
+    )
+
+
+def transactions_table(transactions: List[Any]) -> "pa.Table":
+    """
+    The transactions (a list of Transaction) as an Arrow table, sorted by day
+    """
+    import numpy as np
+    import pyarrow as pa
+    from .load.transactions import TransactionTable
+
+    table = TransactionTable.from_transactions(transactions).sorted_by_day()
+    values = table.strings.values
+    days = np.asarray(table.days, dtype=np.int32) - _EPOCH
+    return pa.table(
+        {
+            "on": pa.array(days, type=pa.int32()).cast(pa.date32()),
+            "cents": pa.array(np.asarray(table.cents, dtype=np.int64)),
+            "name": _text(table.names, values),
+            "account": _text(table.accounts, values),
+            "category": _text(table.categories, values),
+            "meta_category": _text(table.meta_categories, values),
+        }
+    )
+
+
+def balances_table(snapshots: List["Snapshot"]) -> "pa.Table":
+    """
+    The accounts in each snapshot as an Arrow table, one row per account
+    """
+    import pyarrow as pa
+
+    rows: Dict[str, List[Any]] = {
+        "snapshot": [],
+        "at": [],
+        "institution": [],
+        "account": [],
+        "account_type": [],
+        "current": [],
+        "available": [],
+        "limit": [],
+        "currency": [],
+    }
+    for i, sn in enumerate(sorted(snapshots, key=lambda s: s.at)):
+        at = sn.at.astimezone(timezone.utc)
+        for acc in sn.accounts:
+            rows["snapshot"].append(i)
+            rows["at"].append(at)
+            for field in ("institution", "account", "account_type", "currency"):
+                rows[field].append(getattr(acc, field))
+            rows["current"].append(acc.current)
+            rows["available"].append(acc.available)
+            rows["limit"].append(acc.limit)
+    types = {
+        "snapshot": pa.int32(),
+        "at": pa.timestamp("us", tz="UTC"),
+        "current": pa.float64(),
+        "available": pa.float64(),
+        "limit": pa.float64(),
+    }
+    return pa.table(
+        {
+            col: (
+                pa.array(values, type=types[col])
+                if col in types
+                else pa.array(values, type=pa.string()).dictionary_encode()
+            )
+            for col, values in rows.items()
+        }
+    )
+
+
+def _write(table: "pa.Table", path: Path, meta: Dict[str, Any]) -> None:
+    import pyarrow.feather as feather  # type: ignore[import]
+
+    schema_meta = dict(table.schema.metadata or {})
+    schema_meta[METADATA_KEY] = json.dumps(meta).encode()
+    table = table.replace_schema_metadata(schema_meta)
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    # uncompressed, so it can be memory mapped
+    feather.write_feather(table, str(tmp), compression="uncompressed")
+    os.replace(tmp, path)
+
+
+def write_tables(
+    path: Path,
+    transactions: List[Any],
+    snapshots: List["Snapshot"],
+    meta: Dict[str, Any],
+) -> None:
+    path.mkdir(parents=True, exist_ok=True)
+    _write(transactions_table(transactions), path / TRANSACTIONS_FILE, meta)
+    _write(balances_table(snapshots), path / BALANCES_FILE, meta)
+
+
+def write_export(dataset: "Dataset", path: Path) -> Dict[str, Any]:
+    """
+    Export the cleaned transactions/balances from dataset to the directory
+    path, returns the metadata saved with them
+    """
+    from . import timing
+    from .load.git_history import resolve_commit
+
+    # fail before loading everything if it isn't installed
+    import pyarrow  # type: ignore[import] # noqa: F401
+
+    head = resolve_commit(dataset.ddir, dataset.history.window.rev)
+    snapshots = dataset.snapshots
+    transactions = dataset.transactions
+    with timing.stage("export") as st:
+        meta: Dict[str, Any] = {
+            "version": EXPORT_VERSION,
+            "data_dir": str(dataset.ddir),
+            "head": head.sha,
+            "head_at": head.at.isoformat(),
+            "exported_at": datetime.now(timezone.utc).isoformat(),
+            "since": None if dataset.since is None else str(dataset.since),
+            "until": None if dataset.until is None else str(dataset.until),
+            "transactions": len(transactions),
+            "snapshots": len(snapshots),
+        }
+        write_tables(path, transactions, snapshots, meta)
+        st.count(transactions=len(transactions), snapshots=len(snapshots))
+    return meta
+
+
+class Export:
+    """
+    The tables saved by 'budget export', memory mapped. The pandas
+    DataFrames are created the first time they're used
+    """
+
+    def __init__(
+        self, transactions: "pa.Table", balances: "pa.Table", meta: Dict[str, Any]
+    ) -> None:
+        self.transactions_table = transactions
+        self.balances_table = balances
+        self.meta = meta
+        self._transactions: Optional["pd.DataFrame"] = None
+        self._balances: Optional["pd.DataFrame"] = None
+
+    @property
+    def head(self) -> str:
+        return str(self.meta["head"])
+
+    @property
+    def head_at(self) -> datetime:
+        return datetime.fromisoformat(self.meta["head_at"])
+
+    def is_current(self, ddir: Optional[Path] = None) -> bool:
+        """
+        If the HEAD of the data directory is still the commit this was
+        exported from
+        """
+        from . import get_data_dir
+        from .load.git_history import resolve_commit
+
+        ddir = ddir if ddir is not None else Path(self.meta["data_dir"])
+        if not ddir.exists():
+            ddir = get_data_dir()
+        return resolve_commit(ddir, "HEAD").sha == self.head
+
+    @property
+    def transactions(self) -> "pd.DataFrame":
+        """
+        Like analyze.transactions_df, but on is a datetime64, the text
+        columns are categoricals, and there's a cents column too
+        """
+        if self._transactions is None:
+            df = self.transactions_table.to_pandas(date_as_object=False)
+            df.insert(1, "amount", df.pop("cents") / 100)
+            df["cents"] = self.transactions_table.column("cents").to_numpy()
+            self._transactions = df
+        return self._transactions
+
+    @property
+    def balances(self) -> "pd.DataFrame":
+        """
+        One row for each account in each snapshot (numbered in the snapshot
+        column), in the order of the snapshots
+        """
+        if self._balances is None:
+            self._balances = self.balances_table.to_pandas()
+        return self._balances
+
+    def snapshots(self) -> List["Snapshot"]:
+        """
+        The exported snapshots as Snapshot objects
+        """
+        from .load.balances import Account, Snapshot
+
+        cols = ["institution", "account", "account_type", "current"]
+        cols += ["available", "limit", "currency"]
+        data = self.balances_table.to_pydict()
+        snapshots: List[Snapshot] = []
+        shared: Dict[Tuple[Any, ...], Account] = {}
+        last = -1
+        for i, snapshot in enumerate(data["snapshot"]):
+            row = tuple(data[c][i] for c in cols)
+            acc = shared.get(row)
+            if acc is None:
+                acc = shared[row] = Account(*row)
+            if snapshot != last:
+                snapshots.append(Snapshot(accounts=[], at=data["at"][i]))
+                last = snapshot
+            snapshots[-1].accounts.append(acc)
+        return snapshots
+
+
+def _read(path: Path) -> "pa.Table":
+    import pyarrow as pa
+
+    with pa.memory_map(str(path)) as source:
+        return pa.ipc.open_file(source).read_all()
+
+
+def load_export(path: Optional[Path] = None, ddir: Optional[Path] = None) -> Export:
+    """
+    Load the files written by 'budget export' from path (or the default
+    export directory for ddir/MINT_DATA). Raises a FileNotFoundError if
+    nothing was exported there, or a ValueError if it was exported by an
+    incompatible version
+    """
+    from . import get_data_dir
+
+    if path is None:
+        path = default_export_dir(ddir if ddir is not None else get_data_dir())
+    transactions = _read(path / TRANSACTIONS_FILE)
+    balances = _read(path / BALANCES_FILE)
+    raw = (transactions.schema.metadata or {}).get(METADATA_KEY)
+    meta = json.loads(raw) if raw is not None else {}
+    if meta.get("version") != EXPORT_VERSION:
+        raise ValueError(
+            f"{path} was exported by a different version, run 'budget export' again"
+        )
+    return Export(transactions, balances, meta)
@@ -8,14 +8,27 @@ from pathlib import Path
 from datetime import datetime
 
 from dataclasses import dataclass
-from typing import Optional, List, Iterator, Set, Iterable, Tuple
+from typing import (
+    ClassVar,
+    Dict,
+    Optional,
+    List,
+    Iterator,
+    Set,
+    Iterable,
+    Tuple,
+)
 
-from git.objects.commit import Commit  # type: ignore[import]
-from git.repo.base import Repo  # type: ignore[import]
 from more_itertools import strip
 
+from .. import timing
+from .cache import BlobCache
+from .git_history import CommitBlobs
+from .history import BALANCES, MANUAL_BALANCES, Bound, History, use_history
 
-@dataclass
+# accounts don't change once they're loaded, so snapshots which have the same
+# account data can share the same Account (see generate_account_history)
+@dataclass(frozen=True)
 class Account:
     institution: str  # company
     account: str  # sub-account with company, if applicable
@@ -25,8 +38,35 @@ class Account:
     limit: Optional[float]  # possibly, how much limit is on card
     currency: str  # probably USD
 
+    # not a field, so it isn't in the DataFrames created from accounts
+    _fingerprint: ClassVar[int]
+
+    def __post_init__(self) -> None:
+        # computed once, since every snapshot with this account hashes it
+        object.__setattr__(self, "_fingerprint", hash(self.row))
+
+    @property
+    def row(self) -> "AccountRow":
+        return (
+            self.institution,
+            self.account,
+            self.account_type,
+            self.current,
+            self.available,
+            self.limit,
+            self.currency,
+        )
+
+    @property
+    def fingerprint(self) -> int:
+        return self._fingerprint
+
     def __hash__(self) -> int:
-        return hash(self.institution + self.account_type + str(self.current))
+        return self._fingerprint
+
+    def __reduce__(self) -> Tuple[type, "AccountRow"]:
+        # str hashes are different in each process, so compute it again
+        return (Account, self.row)
 
 
 @dataclass
@@ -42,42 +82,54 @@ def parse_float_or_zero(s: str) -> float:
         return 0
 
 
-BALANCES = "balances.csv"
-# manually logged accounts/cash on hand, using budget.manual
-MANUAL_BALANCES = "manual_balances.csv"
+# the fields of an Account, in order; this is what gets saved to the cache
+AccountRow = Tuple[str, str, str, float, Optional[float], Optional[float], str]
 
 
-def get_accounts_at_commit(commit: Commit, filename: str) -> Iterator[Account]:
-    try:
-        blob = commit.tree / filename
-    except KeyError:
-        return
-    with io.BytesIO(blob.data_stream.read()) as f:
-        balances_str: str = f.read().decode("utf-8")
-    bcsv = csv.reader(io.StringIO(balances_str))
+def parse_balances(data: bytes) -> List[AccountRow]:
+    bcsv = csv.reader(io.StringIO(data.decode("utf-8")))
     next(bcsv)  # ignore header row
+    rows: List[AccountRow] = []
     for r in bcsv:
         assert r[6] is not None
-        yield Account(
-            institution=r[0],
-            account=r[1].strip(),
-            account_type=r[2],
-            current=float(r[3]),
-            available=parse_float_or_zero(r[4]),
-            limit=parse_float_or_zero(r[5]),
-            currency="USD" if not bool(r[6].strip()) else r[6],
+        rows.append(
+            (
+                r[0],
+                r[1].strip(),
+                r[2],
+                float(r[3]),
+                parse_float_or_zero(r[4]),
+                parse_float_or_zero(r[5]),
+                "USD" if not bool(r[6].strip()) else r[6],
+            )
         )
-
-
-def get_contents_at_commit(commit: Commit) -> Optional[Snapshot]:
+    return rows
+
+
+def snapshot_at(
+    commit: CommitBlobs,
+    history: History,
+    cache: BlobCache[AccountRow],
+    shared: Optional[Dict[AccountRow, Account]] = None,
+) -> Optional[Snapshot]:
+    """
+    shared maps the rows already loaded to their Account, so snapshots
+    which have the same data for an account reuse the same Account
+    """
+    if shared is None:
+        shared = {}
     account_data: List[Account] = []
-    # read the balance/manual balance files for this snapshot
     for bfile in (BALANCES, MANUAL_BALANCES):
-        for acc in get_accounts_at_commit(commit, bfile):
+        if bfile not in commit.blobs:
+            continue
+        for r in history.rows(commit.blobs[bfile], parse_balances, cache):
+            acc = shared.get(r)
+            if acc is None:
+                acc = shared[r] = Account(*r)
             account_data.append(acc)
     if len(account_data) == 0:
         return None
-    return Snapshot(accounts=account_data, at=commit.authored_datetime)
+    return Snapshot(accounts=account_data, at=commit.at)
 
 
 def unique_snapshots(snapshots: Iterable[Snapshot]) -> Iterator[Snapshot]:
@@ -93,8 +145,82 @@ def unique_snapshots(snapshots: Iterable[Snapshot]) -> Iterator[Snapshot]:
             # print("ignoring {}".format(snap))
 
 
-def generate_account_history(ddir: Path) -> Iterator[Snapshot]:
-    repo = Repo(str(ddir))
-    yield from unique_snapshots(
-        strip(map(get_contents_at_commit, repo.iter_commits()), lambda s: s is None)  # type: ignore
+def iter_snapshot_commits(commits: Iterable[CommitBlobs]) -> Iterator[CommitBlobs]:
+    """
+    Filter the (oldest first) commits to the first time each pair of
+    (balances, manual balances) blobs shows up. Any later ones would parse to
+    the exact same accounts, so this means each bit of balance data only gets
+    read/parsed once
+    """
+    seen: Set[Tuple[Optional[str], Optional[str]]] = set()
+    for commit in commits:
+        key = (commit.blobs.get(BALANCES), commit.blobs.get(MANUAL_BALANCES))
+        if key in seen:
+            continue
+        seen.add(key)
+        yield commit
+
+
+def generate_account_history(
+    ddir: Path,
+    jobs: int = 1,
+    history: Optional[History] = None,
+    since: Optional[Bound] = None,
+    until: Optional[Bound] = None,
+) -> Iterator[Snapshot]:
+    """
+    jobs is the number of processes to parse balance files with, 0 to use every core
+
+    history can be passed to share one walk of the git history with other loaders
+
+    since/until (dates or commits) only load the snapshots in that part of the
+    history, see budget.load.history.Window
+    """
+    cache: BlobCache[AccountRow] = BlobCache("balances")
+    with use_history(ddir, jobs, history, since, until) as hist:
+        # deduplicate over the whole log first, so a snapshot is still only
+        # emitted the first time its data shows up
+        snapshot_commits = list(iter_snapshot_commits(hist.commits))
+        window = hist.window
+        commits = [c for c in snapshot_commits if window.contains(c.at.date())]
+        # the balances at the start of the window are from the last snapshot
+        # before it, so a window without new balance data still has them
+        if window.since is not None:
+            before = [c for c in snapshot_commits if c.at.date() < window.since]
+            if before and window.contains(window.since):
+                commits.insert(0, before[-1])
+        shas = (
+            c.blobs[bfile]
+            for c in commits
+            for bfile in (BALANCES, MANUAL_BALANCES)
+            if bfile in c.blobs
+        )
+        hist.prefetch(shas, parse_balances, cache)
+        # most accounts stay the same for lots of snapshots in a row
+        shared: Dict[AccountRow, Account] = {}
+        snapshots = (snapshot_at(c, hist, cache, shared) for c in commits)
+        yield from unique_snapshots(strip(snapshots, lambda s: s is None))  # type: ignore
+    timing.count(
+        commits=len(commits),
+        accounts=len(shared),
+        cache_hits=cache.hits,
+        cache_misses=cache.misses,
     )
+    cache.prune()
+
+
+def history_accounts(
+    ddir: Path, jobs: int = 1, history: Optional[History] = None
+) -> List[Account]:
+    """
+    Every account in the balance files anywhere in the history (one for
+    each distinct row), ignoring the window of the history
+    """
+    cache: BlobCache[AccountRow] = BlobCache("balances")
+    with use_history(ddir, jobs, history) as hist:
+        shas = [
+            sha for bfile in (BALANCES, MANUAL_BALANCES) for sha in hist.blobs(bfile)
+        ]
+        hist.prefetch(shas, parse_balances, cache)
+        rows = {r for sha in shas for r in hist.rows(sha, parse_balances, cache)}
+    return [Account(*r) for r in rows]
@@ -0,0 +1,215 @@
+"""
+On-disk cache for parsed CSV blobs from the data directory's git history
+
+Every blob in git is immutable, so the rows parsed out of it can be
+saved keyed by the blob SHA, and re-used on any later run that comes
+across the same blob (which is almost all of them, since ./mint fetch
+only ever adds a few new commits)
+"""
+
+import os
+import pickle
+import shutil
+import hashlib
+import warnings
+from pathlib import Path
+from typing import Any, Callable, Dict, Generic, List, Optional, Tuple, TypeVar
+from typing import Iterator
+from itertools import chain
+
+from .. import log
+
+# bump this whenever the shape of anything saved in the cache changes,
+# old versions are removed the next time the cache is pruned
+SCHEMA_VERSION = 1
+
+# max size of the parsed blobs in bytes, can be overwritten with BUDGET_CACHE_SIZE
+DEFAULT_CACHE_SIZE = 256 * 1024 * 1024
+
+# the BlobCache kinds, only these are evicted when pruning. Everything else
+# (checkpoints, transform results, graphs) is small and costly to rebuild
+BLOB_KINDS = ("balances", "transactions")
+
+
+def cache_dir() -> Path:
+    """
+    Where budget saves any cached data. Uses BUDGET_CACHE_DIR if set,
+    else defaults to budget in the XDG cache directory
+    """
+    if "BUDGET_CACHE_DIR" in os.environ:
+        return Path(os.environ["BUDGET_CACHE_DIR"])
+    xdg = os.environ.get("XDG_CACHE_HOME", "").strip()
+    base = Path(xdg) if xdg else Path.home() / ".cache"
+    return base / "budget"
+
+
+def cache_enabled() -> bool:
+    # set BUDGET_NO_CACHE=1 to always re-parse everything
+    return os.environ.get("BUDGET_NO_CACHE", "").strip() in ("", "0")
+
+
+def cache_size() -> int:
+    try:
+        return int(os.environ.get("BUDGET_CACHE_SIZE", DEFAULT_CACHE_SIZE))
+    except ValueError:
+        return DEFAULT_CACHE_SIZE
+
+
+def data_key(ddir: Path) -> str:
+    # to keep separate caches for each data directory
+    return hashlib.sha1(str(ddir.resolve()).encode()).hexdigest()
+
+
+def read_pickle(path: Path) -> Any:
+    """
+    Returns None if the file doesn't exist or can't be unpickled
+    """
+    try:
+        with path.open("rb") as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        # truncated write or some other corrupt file
+        log.logger.debug(f"Could not read cached data {path}: {e}")
+        return None
+
+
+def write_pickle(path: Path, obj: Any) -> None:
+    """
+    Atomically write obj to path, raises an OSError if it can't be written
+    """
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with tmp.open("wb") as f:
+        pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
+
+
+def checkpoint_path(name: str, ddir: Path) -> Path:
+    """
+    Where to save some state computed from the history of ddir
+    """
+    filename = f"{name}-{data_key(ddir)}"
+    return cache_dir() / f"v{SCHEMA_VERSION}" / "checkpoints" / filename
+
+
+Row = TypeVar("Row")
+
+
+class BlobCache(Generic[Row]):
+    """
+    Maps git blob SHAs to the list of rows parsed from that blob
+
+    Keeps an in-memory copy of anything that was read/written in this
+    process, so the same blob being at lots of different commits only
+    gets unpickled once. Files on disk are stored at:
+
+    <cache_dir>/v<SCHEMA_VERSION>/<kind>/<sha[:2]>/<sha>
+
+    The modification time of each file is used as its last access time,
+    prune removes the least recently used blobs till the blobs are under
+    its max size
+    """
+
+    def __init__(
+        self,
+        kind: str,
+        root: Optional[Path] = None,
+        max_size: Optional[int] = None,
+        persist: Optional[bool] = None,
+    ) -> None:
+        self.kind = kind
+        self.root = root if root is not None else cache_dir()
+        self.max_size = max_size if max_size is not None else cache_size()
+        self.persist = persist if persist is not None else cache_enabled()
+        self.directory = self.root / f"v{SCHEMA_VERSION}" / kind
+        self._memory: Dict[str, List[Row]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, sha: str) -> Path:
+        return self.directory / sha[:2] / sha
+
+    def get(self, sha: str) -> Optional[List[Row]]:
+        if sha in self._memory:
+            self.hits += 1
+            return self._memory[sha]
+        if self.persist:
+            path = self._path(sha)
+            rows: Optional[List[Row]] = read_pickle(path)
+            if rows is not None:
+                try:
+                    os.utime(path)
+                except OSError:
+                    pass
+                self._memory[sha] = rows
+                self.hits += 1
+                return rows
+        self.misses += 1
+        return None
+
+    def put(self, sha: str, rows: List[Row]) -> None:
+        self._memory[sha] = rows
+        if not self.persist:
+            return
+        try:
+            write_pickle(self._path(sha), rows)
+        except OSError as e:
+            warnings.warn(f"Could not write to cache at {self.root}, disabling: {e}")
+            self.persist = False
+
+    def load(
+        self,
+        sha: str,
+        read: Callable[[str], bytes],
+        parse: Callable[[bytes], List[Row]],
+    ) -> List[Row]:
+        """
+        Get the rows for this blob from the cache, else read and parse them
+        """
+        rows = self.get(sha)
+        if rows is None:
+            rows = parse(read(sha))
+            self.put(sha, rows)
+        return rows
+
+    def prune(self) -> None:
+        """
+        Remove caches from older schema versions, and evict the least
+        recently used blobs until the blobs are under max_size
+        """
+        if not self.persist or not self.root.exists():
+            return
+        prune_cache(self.root, self.max_size)
+
+
+def _cached_files(root: Path) -> Iterator[Tuple[float, int, Path]]:
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            p = Path(dirpath) / name
+            try:
+                st = p.stat()
+            except OSError:
+                continue
+            yield st.st_mtime, st.st_size, p
+
+
+def prune_cache(root: Path, max_size: int) -> None:
+    current = f"v{SCHEMA_VERSION}"
+    for old in root.glob("v*"):
+        if old.is_dir() and old.name != current:
+            log.logger.debug(f"Removing old cache schema {old}")
+            shutil.rmtree(old, ignore_errors=True)
+    files = sorted(
+        chain.from_iterable(_cached_files(root / current / kind) for kind in BLOB_KINDS)
+    )
+    total = sum(size for _, size, _ in files)
+    for _, size, p in files:
+        if total <= max_size:
+            break
+        try:
+            p.unlink()
+        except OSError:
+            continue
+        total -= size
@@ -0,0 +1,150 @@
+"""
+Reads the data directory's git history in bulk, by piping from git itself
+
+Instead of looking up each file in each commit's tree through GitPython,
+a single 'git log --raw' gives the commit SHAs, author timestamps and
+any blob changes to the tracked files, and blob contents are then read
+from one long-running 'git cat-file --batch' process
+"""
+
+import subprocess
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterator, List, NamedTuple, Optional, IO, Sequence, Tuple
+
+# what git uses as the 'new' blob SHA when a file is deleted
+NULL_SHA = "0" * 40
+
+
+class CommitBlobs(NamedTuple):
+    sha: str
+    at: datetime  # authored datetime, with the original timezone offset
+    blobs: Dict[str, str]  # filename -> blob SHA, for tracked files at this commit
+
+
+def _git(ddir: Path, *args: str) -> List[str]:
+    return ["git", "-C", str(ddir), *args]
+
+
+def iter_commit_blobs(
+    ddir: Path, paths: Sequence[str], rev: str = "HEAD"
+) -> Iterator[CommitBlobs]:
+    """
+    Yields (oldest first) each commit which changed one of paths, along with the
+    blob SHAs for all of paths at that commit. Follows the first parent at merges,
+    the data directory history is linear anyways
+    """
+    cmd = _git(
+        ddir,
+        "log",
+        "--reverse",
+        "--first-parent",
+        "-m",
+        "--root",
+        "--raw",
+        "--no-abbrev",
+        "--no-renames",
+        "--format=%H %aI",
+        rev,
+        "--",
+        *paths,
+    )
+    proc = subprocess.Popen(
+        cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+    )
+    assert proc.stdout is not None
+    blobs: Dict[str, str] = {}
+    current: Optional[CommitBlobs] = None
+    try:
+        for line in proc.stdout:
+            line = line.rstrip("\n")
+            if not line:
+                continue
+            if line.startswith(":"):
+                # :<old mode> <new mode> <old sha> <new sha> <status>\t<path>
+                info, _, path = line.partition("\t")
+                new_sha = info.split()[3]
+                if new_sha == NULL_SHA:
+                    blobs.pop(path, None)
+                else:
+                    blobs[path] = new_sha
+                continue
+            # a new commit header, so all changes for the previous one have been read
+            if current is not None:
+                yield current._replace(blobs=dict(blobs))
+            sha, _, authored = line.partition(" ")
+            at = datetime.fromisoformat(authored)
+            current = CommitBlobs(sha=sha, at=at, blobs={})
+        if current is not None:
+            yield current._replace(blobs=dict(blobs))
+    finally:
+        proc.stdout.close()
+        assert proc.stderr is not None
+        err = proc.stderr.read()
+        proc.stderr.close()
+        code = proc.wait()
+    if code != 0:
+        raise subprocess.CalledProcessError(code, cmd, stderr=err)
+
+
+def resolve_commit(ddir: Path, rev: str) -> CommitBlobs:
+    """
+    Get the full SHA/authored datetime for some revision (SHA, branch, HEAD~10, ...)
+    """
+    proc = subprocess.run(
+        _git(ddir, "log", "-1", "--format=%H %aI", rev, "--"),
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0 or not proc.stdout.strip():
+        err = proc.stderr.strip()
+        raise ValueError(f"Could not find commit '{rev}' in {ddir}: {err}")
+    sha, _, authored = proc.stdout.strip().partition(" ")
+    return CommitBlobs(sha=sha, at=datetime.fromisoformat(authored), blobs={})
+
+
+class BlobReader:
+    """
+    Reads blob contents from a single 'git cat-file --batch' process,
+    use as a context manager so the process is cleaned up afterwards
+    """
+
+    def __init__(self, ddir: Path) -> None:
+        self.ddir = ddir
+        self._proc: Optional["subprocess.Popen[bytes]"] = None
+
+    def _pipes(self) -> Tuple[IO[bytes], IO[bytes]]:
+        if self._proc is None:
+            self._proc = subprocess.Popen(
+                _git(self.ddir, "cat-file", "--batch"),
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+            )
+        assert self._proc.stdin is not None and self._proc.stdout is not None
+        return self._proc.stdin, self._proc.stdout
+
+    def read(self, sha: str) -> bytes:
+        stdin, stdout = self._pipes()
+        stdin.write(sha.encode() + b"\n")
+        stdin.flush()
+        # <sha> <type> <size>, or '<sha> missing'
+        header = stdout.readline().decode().split()
+        if len(header) != 3:
+            raise KeyError(f"Could not read blob {sha} from {self.ddir}")
+        data = stdout.read(int(header[2]))
+        stdout.read(1)  # trailing newline
+        return data
+
+    def close(self) -> None:
+        if self._proc is not None:
+            assert self._proc.stdin is not None and self._proc.stdout is not None
+            self._proc.stdin.close()
+            self._proc.stdout.close()
+            self._proc.wait()
+            self._proc = None
+
+    def __enter__(self) -> "BlobReader":
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.close()
@@ -0,0 +1,192 @@
+"""
+A single walk of the data directory's git history, shared by the balance
+and transaction loaders, so budget.data() only asks git for the history once
+"""
+
+import re
+from contextlib import contextmanager
+from datetime import date
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, List, NamedTuple, Optional, Union
+
+from .. import timing
+from .cache import BlobCache, Row
+from .git_history import BlobReader, CommitBlobs, iter_commit_blobs, resolve_commit
+
+BALANCES = "balances.csv"
+# manually logged accounts/cash on hand, using budget.manual
+MANUAL_BALANCES = "manual_balances.csv"
+TRANSACTION_FILE = "transactions.csv"
+
+# files in the history that the loaders read
+TRACKED_FILES = (BALANCES, MANUAL_BALANCES, TRANSACTION_FILE)
+
+
+# a date, or a git revision (commit SHA, tag, HEAD~5...)
+Bound = Union[date, str]
+
+
+class Window(NamedTuple):
+    """
+    Which part of the history to load. Snapshots/transactions outside
+    since/until (inclusive) are dropped, and rev is the commit to walk
+    the history back from
+    """
+
+    since: Optional[date] = None
+    until: Optional[date] = None
+    rev: str = "HEAD"
+
+    @property
+    def bounded(self) -> bool:
+        return self != Window()
+
+    def contains(self, day: date) -> bool:
+        if self.since is not None and day < self.since:
+            return False
+        if self.until is not None and day > self.until:
+            return False
+        return True
+
+    @classmethod
+    def resolve(
+        cls, ddir: Path, since: Optional[Bound] = None, until: Optional[Bound] = None
+    ) -> "Window":
+        """
+        since is the first date to include, or a commit to start from. until is the
+        last date to include, or a commit to load the history up to
+        """
+        window = cls()
+        if since is not None:
+            since_day = _as_date(since)
+            if since_day is None:
+                since_day = resolve_commit(ddir, str(since)).at.date()
+            window = window._replace(since=since_day)
+        if until is not None:
+            until_day = _as_date(until)
+            if until_day is None:
+                window = window._replace(rev=resolve_commit(ddir, str(until)).sha)
+            else:
+                window = window._replace(until=until_day)
+        return window
+
+
+_DATE = re.compile(r"\d{4}-\d{1,2}-\d{1,2}")
+
+
+def parse_bound(value: str) -> Bound:
+    """
+    A date (YYYY-MM-DD), else a git revision. Raises a ValueError for
+    something which looks like a date but isn't one, e.g. 2022-13-01
+    """
+    day = _as_date(value)
+    if day is not None:
+        return day
+    if _DATE.fullmatch(value):
+        raise ValueError(f"{value} is not a valid date (YYYY-MM-DD)")
+    return value
+
+
+def _as_date(bound: Bound) -> Optional[date]:
+    if isinstance(bound, date):
+        # datetime is a subclass of date, drop the time if this is one
+        if type(bound) is not date:
+            return date(bound.year, bound.month, bound.day)
+        return bound
+    try:
+        return date.fromisoformat(bound)
+    except ValueError:
+        return None
+
+
+class History:
+    """
+    The commits (oldest first) which changed any of the tracked files, and
+    the blob SHAs for each of those files at that commit. The commit list is
+    computed the first time it's used, and blobs are read from one shared
+    'git cat-file' process
+
+    jobs is the number of processes to parse blobs with, 0 to use every core.
+    The loaders only keep snapshots/transactions inside window
+    """
+
+    def __init__(
+        self, ddir: Path, jobs: int = 1, window: Optional[Window] = None
+    ) -> None:
+        self.ddir = ddir
+        self.jobs = jobs
+        self.window = window if window is not None else Window()
+        self.reader = BlobReader(ddir)
+        self._commits: Optional[List[CommitBlobs]] = None
+
+    @property
+    def commits(self) -> List[CommitBlobs]:
+        if self._commits is None:
+            with timing.stage("git log") as st:
+                self._commits = list(
+                    iter_commit_blobs(self.ddir, TRACKED_FILES, rev=self.window.rev)
+                )
+                st.count(commits=len(self._commits))
+        return self._commits
+
+    def blobs(self, filename: str) -> Iterator[str]:
+        """
+        Each unique blob for filename, in the order they first show up
+        """
+        yield from dict.fromkeys(
+            c.blobs[filename] for c in self.commits if filename in c.blobs
+        )
+
+    def prefetch(
+        self,
+        shas: Iterable[str],
+        parse: Callable[[bytes], List[Row]],
+        cache: BlobCache[Row],
+    ) -> None:
+        """
+        If using multiple processes, parse any of these blobs that aren't
+        already in the cache up front
+        """
+        if self.jobs != 1:
+            # the process pool is slow to import, and only needed here
+            from .parallel import parse_blobs
+
+            with timing.stage(f"parse {cache.kind} in parallel"):
+                parse_blobs(shas, self.reader.read, parse, cache, self.jobs)
+
+    def rows(
+        self,
+        sha: str,
+        parse: Callable[[bytes], List[Row]],
+        cache: BlobCache[Row],
+    ) -> List[Row]:
+        return cache.load(sha, self.reader.read, parse)
+
+    def close(self) -> None:
+        self.reader.close()
+
+    def __enter__(self) -> "History":
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.close()
+
+
+@contextmanager
+def use_history(
+    ddir: Path,
+    jobs: int = 1,
+    history: Optional[History] = None,
+    since: Optional[Bound] = None,
+    until: Optional[Bound] = None,
+) -> Iterator[History]:
+    """
+    Use the history passed (e.g. shared from budget.data), else walk the
+    history for ddir (between since/until) and clean it up afterwards
+    """
+    if history is not None:
+        yield history
+        return
+    window = Window.resolve(ddir, since, until)
+    with History(ddir, jobs=jobs, window=window) as hist:
+        yield hist
@@ -0,0 +1,49 @@
+"""
+Parses blobs from the git history across a process pool
+
+Each blob is independent of the others, so the CSV decoding can happen
+in other processes. The results are put in the BlobCache, and the loaders
+then walk the commits in order like usual, so the order transactions are
+matched in stays the same
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterable, List
+
+from more_itertools import chunked
+
+from .cache import BlobCache, Row
+
+
+def resolve_jobs(jobs: int) -> int:
+    # 0 (or less) means use every core
+    if jobs < 1:
+        return os.cpu_count() or 1
+    return jobs
+
+
+def parse_blobs(
+    shas: Iterable[str],
+    read: Callable[[str], bytes],
+    parse: Callable[[bytes], List[Row]],
+    cache: BlobCache[Row],
+    jobs: int,
+) -> None:
+    """
+    Make sure the rows for each blob are in the cache, parsing any that
+    are missing across jobs processes. parse has to be a module-level
+    function so it can be pickled and sent to the workers
+    """
+    jobs = resolve_jobs(jobs)
+    missing = [sha for sha in dict.fromkeys(shas) if cache.get(sha) is None]
+    # not worth starting up processes, the loaders parse these as they go
+    if jobs == 1 or len(missing) < 2:
+        return
+    with ProcessPoolExecutor(max_workers=min(jobs, len(missing))) as pool:
+        # read a bounded number of blobs at a time, instead of every blob in the history
+        for batch in chunked(missing, jobs * 16):
+            blobs = [read(sha) for sha in batch]
+            chunksize = max(1, len(batch) // (jobs * 4))
+            for sha, rows in zip(batch, pool.map(parse, blobs, chunksize=chunksize)):
+                cache.put(sha, rows)
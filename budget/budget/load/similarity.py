@@ -0,0 +1,78 @@
+"""
+Decides whether two transaction names are similar enough to be the same
+transaction, used by Transaction.fuzz_text
+
+This makes the same decisions as using textdistance's overlap/lcsseq,
+but only computes what's needed (whether the overlap is complete, and
+the length of the longest common subsequence), and caches the results,
+since the same pairs of merchant names get compared over and over
+"""
+
+from collections import Counter
+from functools import lru_cache
+from typing import Dict
+
+# how many (name, name) pairs to remember the result for
+CACHE_SIZE = 2 ** 16
+
+
+def full_overlap(left: str, right: str) -> bool:
+    """
+    Whether the overlap coefficient (on characters) is 1, i.e. the
+    characters in the shorter string are a sub-multiset of the longer one
+    """
+    if left == right:
+        return True
+    if not left or not right:
+        return False
+    if len(left) > len(right):
+        left, right = right, left
+    have = Counter(right)
+    return all(have[char] >= count for char, count in Counter(left).items())
+
+
+def lcs_length(left: str, right: str) -> int:
+    """
+    Length of the longest common subsequence, computed bit-parallel
+    (one big integer operation per character of right)
+    """
+    if not left or not right:
+        return 0
+    masks: Dict[str, int] = {}
+    for i, char in enumerate(left):
+        masks[char] = masks.get(char, 0) | (1 << i)
+    full = (1 << len(left)) - 1
+    v = full
+    for char in right:
+        u = v & masks.get(char, 0)
+        v = ((v + u) | (v - u)) & full
+    # each zero bit left in v is a matched character
+    return len(left) - bin(v).count("1")
+
+
+def _similar(left: str, right: str) -> bool:
+    # if matched more than 80% of text or its over 8 chars
+    n = lcs_length(left, right)
+    return n > 0.8 * min(len(left), len(right)) or n > 8
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _names_match(t: str, o: str) -> bool:
+    for left, right in ((t, o), (t.replace(" ", ""), o.replace(" ", ""))):
+        # if pure overlap
+        if full_overlap(left, right):
+            return True
+        if _similar(left, right):
+            return True
+    return False
+
+
+def names_match(one: str, two: str) -> bool:
+    """
+    Whether two transaction names are probably the same, ignoring case
+    """
+    t, o = one.casefold(), two.casefold()
+    # the comparison is symmetric, so the order in the cache doesn't matter
+    if o < t:
+        t, o = o, t
+    return _names_match(t, o)
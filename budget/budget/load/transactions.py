@@ -1,19 +1,35 @@
 import os
 import csv
 import io
-from itertools import chain
+import hashlib
+import warnings
+from array import array
 from math import modf
-from datetime import date, timedelta
+from datetime import date
 from pathlib import Path
-from typing import List, Iterator, Optional, Dict, TextIO
-from collections import defaultdict
-from dataclasses import dataclass
+from typing import (
+    List,
+    Iterator,
+    Optional,
+    Dict,
+    TextIO,
+    Tuple,
+    Set,
+    Iterable,
+    Sequence,
+    Any,
+    TYPE_CHECKING,
+)
+from dataclasses import dataclass, field
 
-import textdistance  # type: ignore[import]
-from more_itertools import always_reversible
-import git  # type: ignore[import]
+from .. import log, timing
+from .cache import BlobCache, cache_enabled, checkpoint_path, read_pickle, write_pickle
+from .git_history import CommitBlobs
+from .history import TRANSACTION_FILE, Bound, History, use_history
+from .similarity import names_match
 
-from ..log import logger
+if TYPE_CHECKING:
+    import pandas as pd  # type: ignore[import]
 
 
 # if anything is above this and it fuzzy matches the basics, should mark it as a duplicate
@@ -47,32 +63,28 @@ class Transaction:
 
     @classmethod
     def from_csv_row(cls, td: List[str]) -> "Transaction":
-        return cls(
-            on=date(**dict(zip(("year", "month", "day"), map(int, td[0].split("-"))))),
-            amount=float(td[1]),
-            name=td[2],
-            account=td[3],
-            category=td[4],
-        )
+        return cls(*parse_transaction_row(td))
 
     def fuzz_text(self, other: "Transaction") -> bool:
-        t = self.name.casefold()
-        o = other.name.casefold()
-        for left, right in ((t, o), (t.replace(" ", ""), o.replace(" ", ""))):
-            # if pure overlap
-            if textdistance.algorithms.overlap(left, right) == 1.0:
-                return True
-            # if matched more than 80% of text or its over 10  chars
-            overlap_str = textdistance.algorithms.lcsseq(left, right)
-            if (
-                len(overlap_str) > 0.8 * min(len(left), len(right))
-                or len(overlap_str) > 8
-            ):
-                return True
-        return False
-
-
-TRANSACTION_FILE = "transactions.csv"
+        # if the names (or the names without spaces) completely overlap, or
+        # the longest common subsequence is more than 80% of the text/8 chars
+        return names_match(self.name, other.name)
+
+
+# the (on, amount, name, account, category) fields of a Transaction,
+# this is what gets saved to the cache
+TransactionRow = Tuple[date, float, str, str, str]
+
+
+def parse_transaction_row(td: List[str]) -> TransactionRow:
+    return (
+        date(**dict(zip(("year", "month", "day"), map(int, td[0].split("-"))))),
+        float(td[1]),
+        td[2],
+        td[3],
+        td[4],
+    )
+
 
 STATIC_TRANSACTION_FILES = [
     "old_transactions.csv",
@@ -81,6 +93,8 @@ STATIC_TRANSACTION_FILES = [
 
 
 def _debug_textdistance(one: Transaction, two: Transaction) -> None:
+    import textdistance  # type: ignore[import]
+
     o = one.name.casefold()
     t = two.name.casefold()
     print("hamming", textdistance.algorithms.hamming(o, t))
@@ -98,17 +112,11 @@ def read_transaction_obj(file_obj: TextIO) -> Iterator[List[str]]:
     yield from cr
 
 
-def read_transactions_at_commit(commit: git.objects.Commit) -> Iterator[Transaction]:
-    try:
-        blob = commit.tree / TRANSACTION_FILE
-    except KeyError:
-        return
-    with io.BytesIO(blob.data_stream.read()) as f:
-        transactions_str: str = f.read().decode("utf-8")
-    # add each line from this commit to the set
-    # convert to tuple so its hashable
-    for line in read_transaction_obj(io.StringIO(transactions_str)):  # type: ignore[arg-type]
-        yield Transaction.from_csv_row(line)
+def parse_transactions(data: bytes) -> List[TransactionRow]:
+    return [
+        parse_transaction_row(line)
+        for line in read_transaction_obj(io.StringIO(data.decode("utf-8")))
+    ]
 
 
 TEMP_TRANSACTION_NAMES = {"credit", "debit"}
@@ -122,68 +130,452 @@ FORCE_EXACT = set([
 ])
 
 
-def _match_duplicate(
-    all_transactions: Dict[date, List[Transaction]], new_transaction: Transaction
-) -> Optional[Transaction]:
+def cents(amount: float) -> int:
+    return round(amount * 100)
+
+
+class StringPool:
+    """
+    Interns strings, so columns can store an integer code for each one
+    """
+
+    def __init__(self) -> None:
+        self.values: List[Optional[str]] = []
+        self._codes: Dict[Optional[str], int] = {}
+
+    def code(self, value: Optional[str]) -> int:
+        try:
+            return self._codes[value]
+        except KeyError:
+            self._codes[value] = len(self.values)
+            self.values.append(value)
+            return self._codes[value]
+
+    def __getitem__(self, code: int) -> Optional[str]:
+        return self.values[code]
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+
+class TransactionTable:
+    """
+    Transactions stored as columns; days as date ordinals, amounts as integer
+    cents, and the text fields as codes into a shared StringPool
+
+    Indexing/iterating creates Transaction objects from the columns. Those
+    are copies, so editing them doesn't change the table
+    """
+
+    def __init__(self, strings: Optional[StringPool] = None) -> None:
+        self.strings = strings if strings is not None else StringPool()
+        self.days = array("i")
+        self.cents = array("q")
+        self.names = array("i")
+        self.accounts = array("i")
+        self.categories = array("i")
+        self.meta_categories = array("i")
+
+    def append(
+        self,
+        on: date,
+        amount_cents: int,
+        name: str,
+        account: str,
+        category: str,
+        meta_category: Optional[str] = None,
+    ) -> int:
+        """
+        Add a row, returns its index
+        """
+        code = self.strings.code
+        self.days.append(on.toordinal())
+        self.cents.append(amount_cents)
+        self.names.append(code(name))
+        self.accounts.append(code(account))
+        self.categories.append(code(category))
+        self.meta_categories.append(code(meta_category))
+        return len(self.days) - 1
+
+    def append_row(self, row: TransactionRow) -> int:
+        on, amount, name, account, category = row
+        return self.append(on, cents(amount), name, account, category)
+
+    def append_transaction(self, tr: Transaction) -> int:
+        return self.append(
+            tr.on, cents(tr.amount), tr.name, tr.account, tr.category, tr.meta_category
+        )
+
+    @classmethod
+    def from_transactions(
+        cls, transactions: Iterable[Transaction]
+    ) -> "TransactionTable":
+        table = cls()
+        for tr in transactions:
+            table.append_transaction(tr)
+        return table
+
+    def extend(self, other: "TransactionTable") -> None:
+        if other.strings is self.strings:
+            remap: Sequence[int] = range(len(self.strings))
+        else:
+            remap = [self.strings.code(v) for v in other.strings.values]
+        self.days.extend(other.days)
+        self.cents.extend(other.cents)
+        self.names.extend(remap[c] for c in other.names)
+        self.accounts.extend(remap[c] for c in other.accounts)
+        self.categories.extend(remap[c] for c in other.categories)
+        self.meta_categories.extend(remap[c] for c in other.meta_categories)
+
+    def take(self, rows: Iterable[int]) -> "TransactionTable":
+        """
+        A new table (sharing the same strings) with just these rows, in this order
+        """
+        rows = list(rows)
+        table = TransactionTable(self.strings)
+        for col in (
+            "days",
+            "cents",
+            "names",
+            "accounts",
+            "categories",
+            "meta_categories",
+        ):
+            src: array = getattr(self, col)  # type: ignore[type-arg]
+            getattr(table, col).extend(src[i] for i in rows)
+        return table
+
+    def sorted_by_day(self) -> "TransactionTable":
+        # stable, so transactions on the same day keep their order
+        return self.take(sorted(range(len(self)), key=self.days.__getitem__))
+
+    def __len__(self) -> int:
+        return len(self.days)
+
+    def __getitem__(self, i: int) -> Transaction:
+        s = self.strings.values
+        return Transaction(
+            on=date.fromordinal(self.days[i]),
+            amount=self.cents[i] / 100,
+            name=s[self.names[i]],  # type: ignore[arg-type]
+            account=s[self.accounts[i]],  # type: ignore[arg-type]
+            category=s[self.categories[i]],  # type: ignore[arg-type]
+            meta_category=s[self.meta_categories[i]],
+        )
+
+    def __iter__(self) -> Iterator[Transaction]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def to_dataframe(self, categorical: bool = False) -> "pd.DataFrame":
+        """
+        Same columns as pd.DataFrame.from_dict(list of Transaction), but built
+        directly from the columns. If categorical is True, the text columns
+        use the pandas category dtype
+        """
+        import numpy as np  # type: ignore[import]
+        import pandas as pd  # type: ignore[import]
+
+        days = np.asarray(self.days)
+        unique_days, inverse = np.unique(days, return_inverse=True)
+        on = np.array([date.fromordinal(int(d)) for d in unique_days], dtype=object)
+        strings = np.array(self.strings.values + [None], dtype=object)
+
+        def text(codes: array) -> Any:  # type: ignore[type-arg]
+            col = pd.Series(strings[np.asarray(codes)])
+            return col.astype("category") if categorical else col
+
+        return pd.DataFrame(
+            {
+                "on": on[inverse],
+                "amount": np.asarray(self.cents) / 100,
+                "name": text(self.names),
+                "account": text(self.accounts),
+                "category": text(self.categories),
+                "meta_category": text(self.meta_categories),
+            },
+        )
+
+
+# (day ordinal, amount in cents, casefolded account)
+IndexKey = Tuple[int, int, str]
+
+
+class TransactionIndex:
+    """
+    The unique transactions from the history, in the order they were added
+
+    Anything that could match as a duplicate has to have the same amount and
+    account, so rows are also indexed by (day, amount in cents, casefolded account).
+    Checking the days around some transaction is then a few dict lookups which
+    only return rows that already match on the basics
+    """
+
+    def __init__(self) -> None:
+        self.table = TransactionTable()
+        self._index: Dict[IndexKey, List[int]] = {}
+
+    def add(self, row: TransactionRow) -> None:
+        i = self.table.append_row(row)
+        key = (row[0].toordinal(), cents(row[1]), row[3].casefold())
+        if key in self._index:
+            self._index[key].append(i)
+        else:
+            self._index[key] = [i]
+
+    def candidates(
+        self, day: int, amount_cents: int, account: str, day_range: List[int]
+    ) -> Iterator[int]:
+        """
+        Rows with the same amount/casefolded account on any of the days in
+        day_range (offsets from day). In the order of day_range, then the
+        order they were added
+        """
+        for offset in day_range:
+            yield from self._index.get((day + offset, amount_cents, account), ())
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+    def __iter__(self) -> Iterator[Transaction]:
+        return iter(self.table)
+
+
+# try days close to a transaction to remove duplicate transactions
+DAY_RANGE = list(range(-3, 3))
+
+
+def _match_duplicate(index: TransactionIndex, new_row: TransactionRow) -> Optional[int]:
     """
-    Returns a transaction if it matched by using a couple strategies
+    Returns the index of a transaction if it matched by using a couple strategies
     """
-    # try days close to this to remove duplicate transactions
-    day_range = list(range(-3, 3))
-    if new_transaction.name.casefold().strip() in FORCE_EXACT:
+    on, amount, name, account, category = new_row
+    day = on.toordinal()
+    amount_cents = cents(amount)
+    name_cf = name.casefold()
+    day_range = DAY_RANGE
+    if name_cf.strip() in FORCE_EXACT:
         day_range = [0]
-    for k in [new_transaction.on + timedelta(days=r) for r in day_range]:
-        for tr in all_transactions.get(k, []):
-            # exact match
-            # this still removes duplcate transactions on the same day from
-            # which have the same name/cost/card -- is annoying to solve
-            # probably need to move it up to read_transactions_history and
-            # keep track of how many seemingly unique transactions exist
-            # in a single snapshot, and then make sure those also exist in the result
-            if tr == new_transaction:
-                return tr
-            # base fuzz matches, then try more specific matches
-            if tr.fuzz_equals(new_transaction):
-                # if this is 'CREDIT' or 'DEBIT'
-                names = {n.casefold() for n in (tr.name, new_transaction.name)}
-                if any((n in names for n in TEMP_TRANSACTION_NAMES)):
-                    return tr
-                if tr.fuzz_text(new_transaction):
-                    return tr
-                # probably a duplicate transaction if its that much?
-                if tr.amount > TRANSACTION_DUPLICATE_LIMIT:
-                    return tr
+    new_is_temp = name_cf in TEMP_TRANSACTION_NAMES
+    table = index.table
+    s = table.strings.values
+    for i in index.candidates(day, amount_cents, account.casefold(), day_range):
+        tr_name: str = s[table.names[i]]  # type: ignore[assignment]
+        # exact match (the index already matched the amount)
+        # this still removes duplcate transactions on the same day from
+        # which have the same name/cost/card -- is annoying to solve
+        # probably need to move it up to read_transactions_history and
+        # keep track of how many seemingly unique transactions exist
+        # in a single snapshot, and then make sure those also exist in the result
+        if (
+            table.days[i] == day
+            and tr_name == name
+            and s[table.accounts[i]] == account
+            and s[table.categories[i]] == category
+        ):
+            return i
+        # base fuzz matches, then try more specific matches. the index already
+        # matched the amount/account, which is what Transaction.fuzz_equals checks
+        #
+        # if this is 'CREDIT' or 'DEBIT'
+        if new_is_temp or tr_name.casefold() in TEMP_TRANSACTION_NAMES:
+            return i
+        if names_match(tr_name, name):
+            return i
+        # probably a duplicate transaction if its that much?
+        if table.cents[i] > TRANSACTION_DUPLICATE_LIMIT * 100:
+            return i
     return None
 
 
-# read the transactions.csv history and return unique transactions
-def read_transactions_history(repo: git.Repo) -> Iterator[Transaction]:
-    all_transactions: Dict[date, List[Transaction]] = defaultdict(list)
-    for commit in always_reversible(repo.iter_commits()):
-        comm_transactions = list(read_transactions_at_commit(commit))
-        for tr in comm_transactions:
-            matched = _match_duplicate(all_transactions, tr)
-            if matched is None:
-                all_transactions[tr.on].append(tr)
-            else:
-                pass
-                # ~170,000 logs, so not worth logging here
-                # logger.debug(f"Matched duplicate:\n{tr}\n{matched}")
-
-    # destructure defaultdict
-    sorted_transactions = list(chain(*(v for v in all_transactions.values())))
-    yield from sorted(sorted_transactions, key=lambda t: t.on)
-
-
-def read_transactions(ddir: Path) -> Iterator[Transaction]:
-    # should just read from the current static files, I edit these manually
-    for tfile in STATIC_TRANSACTION_FILES:
-        full_tfile = ddir / tfile
-        if full_tfile.exists():
-            with full_tfile.open(newline="") as tr:
-                yield from map(Transaction.from_csv_row, read_transaction_obj(tr))
-        else:
-            logger.warning(
-                "File at {} doesn't exist, ignoring...".format(str(full_tfile))
+# bump this if the way duplicates are matched changes, so any saved
+# DedupState is thrown away
+DEDUP_VERSION = 3
+
+
+def dedup_params() -> str:
+    """
+    A hash of everything that changes which transactions match as duplicates
+    """
+    params = (
+        DEDUP_VERSION,
+        TRANSACTION_DUPLICATE_LIMIT,
+        sorted(FORCE_EXACT),
+        sorted(TEMP_TRANSACTION_NAMES),
+    )
+    return hashlib.sha1(repr(params).encode()).hexdigest()
+
+
+@dataclass
+class DedupState:
+    """
+    Everything read_transactions_history needs to keep matching duplicates
+    after some commit. Saved to the cache, so a later run only has to process
+    the commits which were added since then
+    """
+
+    params: str  # dedup_params() when this was created
+    commit: Optional[str] = None  # last commit that was processed
+    # unique transactions
+    index: TransactionIndex = field(default_factory=TransactionIndex)
+    # transactions.csv blobs/rows which have already been processed
+    blobs: Set[str] = field(default_factory=set)
+    ingested: Set[TransactionRow] = field(default_factory=set)
+
+
+def load_dedup_state(ddir: Path, commits: List[CommitBlobs]) -> Tuple[DedupState, int]:
+    """
+    Returns the saved state and the index of the first commit which still has
+    to be processed. Starts over if the matching parameters have changed or the
+    saved commit isn't in the history anymore (e.g. if it was rewritten)
+    """
+    params = dedup_params()
+    if cache_enabled():
+        state = read_pickle(checkpoint_path("dedup", ddir))
+        if isinstance(state, DedupState) and state.params == params:
+            for i, commit in enumerate(commits):
+                if commit.sha == state.commit:
+                    return state, i + 1
+            log.logger.debug(f"{state.commit} is not in the history, starting over")
+    return DedupState(params=params), 0
+
+
+def save_dedup_state(ddir: Path, state: DedupState) -> None:
+    if not cache_enabled():
+        return
+    try:
+        write_pickle(checkpoint_path("dedup", ddir), state)
+    except OSError as e:
+        warnings.warn(f"Could not save duplicate matching state: {e}")
+
+
+def transactions_history_table(
+    ddir: Path,
+    jobs: int = 1,
+    history: Optional[History] = None,
+    since: Optional[Bound] = None,
+    until: Optional[Bound] = None,
+) -> TransactionTable:
+    """
+    The unique transactions from the transactions.csv history, sorted by day
+
+    since/until (dates or commits) only return the transactions in that part of
+    the history, see budget.load.history.Window
+    """
+    cache: BlobCache[TransactionRow] = BlobCache("transactions")
+    with use_history(ddir, jobs, history, since, until) as hist:
+        window = hist.window
+        # duplicates chain (a row can match one that only matched because of
+        # an earlier one), so the whole history is always matched and the
+        # window is only applied to the result. The checkpoint is valid for any
+        # history it's part of, e.g. an older rev
+        state, start = load_dedup_state(ddir, hist.commits)
+        new_commits = hist.commits[start:]
+        # each unique transactions.csv blob, oldest first. A blob that was already
+        # processed can't add anything new, everything in it was either added or
+        # matched a duplicate the first time around
+        shas: List[str] = [
+            sha
+            for sha in dict.fromkeys(
+                c.blobs[TRANSACTION_FILE]
+                for c in new_commits
+                if TRANSACTION_FILE in c.blobs
+            )
+            if sha not in state.blobs
+        ]
+        with timing.stage("parse transactions") as st:
+            hist.prefetch(shas, parse_transactions, cache)
+            blob_rows = [hist.rows(sha, parse_transactions, cache) for sha in shas]
+            st.count(
+                commits=len(new_commits),
+                blobs=len(shas),
+                rows=sum(map(len, blob_rows)),
+                cache_hits=cache.hits,
+                cache_misses=cache.misses,
+            )
+        # the same goes for each row; a row from an earlier version of the file
+        # can't match differently now, since the index only grows. So
+        # only rows which were added/changed since then are checked for duplicates
+        with timing.stage("match duplicates") as st:
+            ingested, indexed = len(state.ingested), len(state.index)
+            for sha, rows in zip(shas, blob_rows):
+                state.blobs.add(sha)
+                for row in rows:
+                    if row in state.ingested:
+                        continue
+                    state.ingested.add(row)
+                    matched = _match_duplicate(state.index, row)
+                    if matched is None:
+                        state.index.add(row)
+                    else:
+                        pass
+                        # ~170,000 logs, so not worth logging here
+                        # logger.debug(f"Matched duplicate:\n{row}\n{matched}")
+            st.count(
+                new_rows=len(state.ingested) - ingested,
+                unique=len(state.index) - indexed,
             )
-    yield from read_transactions_history(git.Repo(str(ddir)))
+        # the state for an older rev would replace a newer checkpoint
+        if new_commits and window.rev == "HEAD":
+            state.commit = new_commits[-1].sha
+            save_dedup_state(ddir, state)
+    cache.prune()
+
+    table = state.index.table.sorted_by_day()
+    if window.since is not None or window.until is not None:
+        days = (date.fromordinal(day) for day in table.days)
+        table = table.take([i for i, day in enumerate(days) if window.contains(day)])
+    return table
+
+
+# read the transactions.csv history and return unique transactions
+def read_transactions_history(
+    ddir: Path,
+    jobs: int = 1,
+    history: Optional[History] = None,
+    since: Optional[Bound] = None,
+    until: Optional[Bound] = None,
+) -> Iterator[Transaction]:
+    yield from transactions_history_table(
+        ddir, jobs=jobs, history=history, since=since, until=until
+    )
+
+
+def read_transactions_table(
+    ddir: Path,
+    jobs: int = 1,
+    history: Optional[History] = None,
+    since: Optional[Bound] = None,
+    until: Optional[Bound] = None,
+) -> TransactionTable:
+    table = TransactionTable()
+    with use_history(ddir, jobs, history, since, until) as hist:
+        # should just read from the current static files, I edit these manually
+        with timing.stage("static transactions") as st:
+            for tfile in STATIC_TRANSACTION_FILES:
+                full_tfile = ddir / tfile
+                if full_tfile.exists():
+                    with full_tfile.open(newline="") as tr:
+                        for line in read_transaction_obj(tr):
+                            row = parse_transaction_row(line)
+                            if hist.window.contains(row[0]):
+                                table.append_row(row)
+                else:
+                    log.logger.warning(
+                        "File at {} doesn't exist, ignoring...".format(str(full_tfile))
+                    )
+            st.count(rows=len(table))
+        table.extend(transactions_history_table(ddir, history=hist))
+    return table
+
+
+def read_transactions(
+    ddir: Path,
+    jobs: int = 1,
+    history: Optional[History] = None,
+    since: Optional[Bound] = None,
+    until: Optional[Bound] = None,
+) -> Iterator[Transaction]:
+    yield from read_transactions_table(
+        ddir, jobs=jobs, history=history, since=since, until=until
+    )
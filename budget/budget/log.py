@@ -3,19 +3,25 @@ import logging
 
 from typing import Optional
 
-from logzero import setup_logger  # type: ignore[import]
-
 DEFAULT_LEVEL = logging.WARNING
 
-# global access to the logger
+# global access to the logger, set up the first time its accessed
 logger: logging.Logger
 
 
 def setup(level: Optional[int] = None) -> logging.Logger:
+    from logzero import setup_logger  # type: ignore[import]
+
     chosen_level = level or int(os.environ.get("MINT_LOGS", DEFAULT_LEVEL))
     lgr: logging.Logger = setup_logger(name=__package__, level=chosen_level)
+    # so __getattr__ doesn't set it up again at the default level
+    globals()["logger"] = lgr
     return lgr
 
 
-# runs the first time this file is run, setup can be imported/run multiple times in other places
-logger = setup()
+def __getattr__(name: str) -> logging.Logger:
+    # importing logzero takes a while, so this waits until something logs
+    # (log.logger, or 'from .log import logger'), instead of on import
+    if name == "logger":
+        return setup()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,209 @@
+"""
+Optional timing for the named stages of loading/cleaning/analyzing the data
+
+The loaders/analyze functions wrap their work in stage("name"), and
+record counts (rows, commits, cache hits) with count(). Unless something
+is profiling (the --profile flag, or BUDGET_PROFILE), those don't
+record anything, so this costs next to nothing when its disabled
+
+Set BUDGET_PROFILE to a file to also save a cProfile/pstats file of the
+whole run there, and the stage timings as JSON next to it
+"""
+
+import os
+import time
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from pathlib import Path
+from typing import (
+    Any,
+    Callable,
+    ContextManager,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    TypeVar,
+)
+
+PROFILE_ENV = "BUDGET_PROFILE"
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+
+class Stage:
+    __slots__ = ("name", "depth", "seconds", "counts")
+
+    def __init__(self, name: str, depth: int = 0) -> None:
+        self.name = name
+        self.depth = depth
+        self.seconds = 0.0
+        self.counts: Dict[str, int] = {}
+
+    def count(self, **counts: int) -> None:
+        for key, val in counts.items():
+            self.counts[key] = self.counts.get(key, 0) + val
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "depth": self.depth,
+            "seconds": self.seconds,
+            "counts": self.counts,
+        }
+
+
+class _NullStage(Stage):
+    def count(self, **counts: int) -> None:
+        pass
+
+
+_NULL_STAGE = _NullStage("disabled")
+
+
+class Profiler:
+    """
+    The stages run while this was active, in the order they started
+    """
+
+    def __init__(self) -> None:
+        self.stages: List[Stage] = []
+        self._running: List[Stage] = []
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[Stage]:
+        st = Stage(name, depth=len(self._running))
+        self.stages.append(st)
+        self._running.append(st)
+        start = time.perf_counter()
+        try:
+            yield st
+        finally:
+            st.seconds += time.perf_counter() - start
+            self._running.pop()
+
+    def count(self, **counts: int) -> None:
+        # add to whichever stage is running
+        if self._running:
+            self._running[-1].count(**counts)
+
+    def table(self) -> str:
+        rows = [
+            (
+                "  " * st.depth + st.name,
+                f"{st.seconds:.3f}s",
+                ", ".join(f"{k}={v}" for k, v in st.counts.items()),
+            )
+            for st in self.stages
+        ]
+        name_width = max([len("stage")] + [len(r[0]) for r in rows])
+        time_width = max([len("time")] + [len(r[1]) for r in rows])
+        lines = [f"{'stage':<{name_width}}  {'time':>{time_width}}  counts"]
+        for name, seconds, counts in rows:
+            lines.append(f"{name:<{name_width}}  {seconds:>{time_width}}  {counts}")
+        return "\n".join(lines)
+
+    def to_json(self) -> List[Dict[str, Any]]:
+        return [st.to_json() for st in self.stages]
+
+
+_profiler: Optional[Profiler] = None
+
+
+def active() -> Optional[Profiler]:
+    return _profiler
+
+
+def stage(name: str) -> ContextManager[Stage]:
+    """
+    Time the block as name, if profiling. The stage is yielded, so
+    counts can be added to it
+    """
+    if _profiler is None:
+        return nullcontext(_NULL_STAGE)
+    return _profiler.stage(name)
+
+
+def count(**counts: int) -> None:
+    """
+    Add counts to the stage that's currently running, if profiling
+    """
+    if _profiler is not None:
+        _profiler.count(**counts)
+
+
+def staged(name: str) -> Callable[[F], F]:
+    """
+    Time each call to the decorated function as a stage
+    """
+
+    def decorator(func: F) -> F:
+        @wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if _profiler is None:
+                return func(*args, **kwargs)
+            with _profiler.stage(name):
+                return func(*args, **kwargs)
+
+        return wrapper  # type: ignore[return-value]
+
+    return decorator
+
+
+def env_pstats() -> Optional[Path]:
+    path = os.environ.get(PROFILE_ENV, "").strip()
+    return Path(path) if path else None
+
+
+@contextmanager
+def profiling(pstats: Optional[Path] = None) -> Iterator[Profiler]:
+    """
+    Record stages while this is active. If pstats is given, the entire
+    block is run under cProfile, and saved to that file along with the
+    stages as JSON (pstats with a .json suffix)
+
+    If something is already profiling, this shares that profiler
+    """
+    global _profiler
+    outer = _profiler
+    prof = outer if outer is not None else Profiler()
+    _profiler = prof
+    cprof = None
+    if pstats is not None:
+        import cProfile
+
+        cprof = cProfile.Profile()
+        cprof.enable()
+    try:
+        yield prof
+    finally:
+        _profiler = outer
+        if cprof is not None and pstats is not None:
+            cprof.disable()
+            cprof.dump_stats(str(pstats))
+            write_json(prof, pstats.with_suffix(".json"))
+
+
+def write_json(prof: Profiler, path: Path) -> None:
+    import json
+
+    path.write_text(json.dumps({"stages": prof.to_json()}, indent=2))
+
+
+@contextmanager
+def cli_profiling(show: bool, json_path: Optional[Path]) -> Iterator[None]:
+    """
+    Profile a CLI command if --profile/--profile-json or BUDGET_PROFILE were
+    given, printing the stages to stderr afterwards
+    """
+    import click
+
+    pstats = env_pstats()
+    if not show and json_path is None and pstats is None:
+        yield
+        return
+    with profiling(pstats) as prof:
+        yield
+    click.echo(prof.table(), err=True)
+    if json_path is not None:
+        write_json(prof, json_path)
@@ -17,9 +17,11 @@ setup(
     keywords="money finances data",
     extras_require={
         "graphs": [
-            "scipy",
             "matplotlib",
         ],
+        "export": [
+            "pyarrow",
+        ],
     },
     classifiers=[
         "License :: OSI Approved :: MIT License",
@@ -0,0 +1,27 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# so the tests can create data repos with benchmarks/synthetic.py
+sys.path.insert(0, str(Path(__file__).parent.parent / "benchmarks"))
+
+from synthetic import RepoSpec, generate  # type: ignore[import] # noqa: E402
+
+
+@pytest.fixture
+def cache(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    path = tmp_path / "cache"
+    monkeypatch.setenv("BUDGET_CACHE_DIR", str(path))
+    monkeypatch.delenv("BUDGET_NO_CACHE", raising=False)
+    return path
+
+
+@pytest.fixture(scope="session")
+def data_repo(tmp_path_factory: pytest.TempPathFactory) -> Path:
+    """
+    A small synthetic data repo, shared by the tests which only read it
+    """
+    path = tmp_path_factory.mktemp("synthetic") / "data"
+    generate(path, RepoSpec(commits=150, accounts=3))
+    return path
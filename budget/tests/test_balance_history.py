@@ -0,0 +1,72 @@
+from datetime import datetime, timezone
+
+import numpy as np
+
+from budget.load.balances import Account, Snapshot
+from budget.analyze.balance_history import (
+    BalanceMatrix,
+    RollingOutliers,
+    assets,
+    downsample,
+)
+
+
+def _acc(name: str, kind: str, current: float) -> Account:
+    return Account("Bank", name, kind, current, 0.0, 0.0, "USD")
+
+
+def test_balance_matrix() -> None:
+    snapshots = [
+        Snapshot(
+            accounts=[
+                _acc("Checking", "depository", 10.0),
+                _acc("Card", "credit card", 5.0),
+            ],
+            at=datetime(2021, 1, 1, tzinfo=timezone.utc),
+        ),
+        Snapshot(
+            accounts=[_acc("Checking", "depository", 12.0)],
+            at=datetime(2021, 1, 2, tzinfo=timezone.utc),
+        ),
+    ]
+    matrix = BalanceMatrix.from_snapshots(snapshots)
+    assert list(matrix.accounts["account"]) == ["Checking", "Card"]
+    # credit cards are inverted, and missing accounts are 0
+    assert matrix.values.tolist() == [[10.0, -5.0], [12.0, 0.0]]
+    assert matrix.sums.tolist() == [assets(s)["current"].sum() for s in snapshots]
+
+    later = matrix.take(matrix.sums > 6)
+    assert later.at == [snapshots[1].at]
+    assert later.to_dataframe().shape == (1, 2)
+
+
+def test_downsample() -> None:
+    rand = np.random.default_rng(0)
+    x = np.sort(rand.uniform(0, 1000, 20000))
+    y = rand.normal(0, 1, len(x))
+    y[1234] = 50.0
+    y[5678] = -50.0
+    keep = downsample(x, y, 400)
+    assert len(keep) <= 400
+    # the extremes and the ends of the line are kept
+    assert {0, 1234, 5678, len(x) - 1} <= set(keep.tolist())
+    assert (np.diff(keep) > 0).all()
+    assert len(downsample(x[:100], y[:100], 400)) == 100
+
+
+def test_rolling_outliers() -> None:
+    rand = np.random.default_rng(1)
+    # every 8 hours, a random walk with a couple spikes
+    at = np.arange(2000) * 8 * 3600.0
+    balances = np.cumsum(rand.normal(0, 30, len(at))) + 5000
+    spikes = [300, 1200, 1750]
+    balances[spikes] += 2500
+    found = RollingOutliers().extend(at, balances)
+    assert set(spikes) <= set(np.flatnonzero(found).tolist())
+    assert found.sum() < len(at) // 50
+
+    # adding the snapshots later gives the same result
+    detector = RollingOutliers()
+    first = detector.extend(at[:1000], balances[:1000])
+    rest = detector.extend(at[1000:], balances[1000:])
+    assert (np.concatenate([first, rest]) == found).all()
@@ -1,5 +1,11 @@
 # just import stuff to make sure nothing is broken
 
+import logging
+from datetime import timedelta
+from pathlib import Path
+
+from click.testing import CliRunner
+
 
 def test_budget() -> None:
     import budget.load.balances
@@ -7,3 +13,36 @@ def test_budget() -> None:
     import budget.analyze
 
     assert True
+
+
+def test_data_debug(data_repo: Path, cache: Path) -> None:
+    import budget
+    from budget import log
+
+    try:
+        budget.data(data_repo, debug=True)
+        assert log.logger.level == logging.DEBUG
+    finally:
+        log.setup()
+
+
+def test_window(data_repo: Path, cache: Path) -> None:
+    import budget
+    from budget.__main__ import main
+
+    everything = budget.Dataset(data_repo)
+    last = max(s.at for s in everything.snapshots)
+    since = last.date() + timedelta(days=1)
+    # nothing new after the last fetch, but the balances are still there
+    after = budget.Dataset(data_repo, since=since)
+    assert [s.accounts for s in after.snapshots] == [everything.snapshots[-1].accounts]
+
+    window = budget.Dataset(data_repo, since=last.date() - timedelta(days=10))
+    expected = [
+        t for t in everything.transactions if window.history.window.contains(t.on)
+    ]
+    key = lambda t: (t.on, t.amount, t.name)  # noqa: E731
+    assert sorted(window.transactions, key=key) == sorted(expected, key=key)
+
+    result = CliRunner().invoke(main, ["summary", "--since", "2022-13-01"])
+    assert result.exit_code == 2 and "not a valid date" in result.output
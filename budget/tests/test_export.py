@@ -0,0 +1,57 @@
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from budget.load.balances import Account, Snapshot
+from budget.load.transactions import Transaction, TransactionTable
+from budget.analyze import cleaned_balances_df, cleaned_snapshots_df, transactions_df
+from budget.analyze.balance_history import BalanceMatrix
+
+pytest.importorskip("pyarrow")
+
+from budget.export import EXPORT_VERSION, load_export, write_tables  # noqa: E402
+
+
+def test_export(tmp_path: Path) -> None:
+    transactions = [
+        Transaction(date(2021, 1, 3), 5.25, "Cafe", "Card", "Food", "Food"),
+        Transaction(date(2021, 1, 1), -100.0, "Pay", "Checking", "Paycheck", None),
+        Transaction(date(2021, 1, 2), 12.1, "Store", "Card", "Food", "Food"),
+    ]
+    start = datetime(2021, 1, 1, tzinfo=timezone(timedelta(hours=-7)))
+    snapshots = [
+        Snapshot(
+            accounts=[
+                Account("Bank", "Checking", "depository", 10.0 + i, None, None, "USD"),
+                Account("Bank", "Card", "credit card", 5.0, 2.0, 7.0, "USD"),
+            ][: 2 - i % 2],
+            at=start + timedelta(days=i),
+        )
+        for i in range(5)
+    ]
+    write_tables(tmp_path, transactions, snapshots, {"version": EXPORT_VERSION})
+    export = load_export(tmp_path)
+
+    df = transactions_df(export=export)
+    expected = transactions_df(sorted(transactions, key=lambda t: t.on))
+    assert df["cents"].tolist() == [-10000, 1210, 525]
+    assert df["amount"].tolist() == expected["amount"].tolist()
+    assert [d.date() for d in df["on"]] == expected["on"].tolist()
+    for col in ("name", "account", "category"):
+        assert str(df[col].dtype) == "category"
+        assert df[col].tolist() == expected[col].tolist()
+    assert df["meta_category"].isna().tolist() == [True, False, False]
+    assert list(df["meta_category"].cat.categories) == ["Food"]
+
+    assert export.snapshots() == snapshots
+    matrix = BalanceMatrix.from_frame(export.balances)
+    original = BalanceMatrix.from_snapshots(snapshots)
+    assert np.array_equal(matrix.values, original.values)
+    assert np.array_equal(matrix.present, original.present)
+    assert np.array_equal(matrix.seconds, original.seconds)
+    assert cleaned_balances_df(export=export).shape == (5, 2)
+    assert [at for _, at in cleaned_snapshots_df(export=export)] == [
+        at for _, at in cleaned_snapshots_df(snapshots)
+    ]
@@ -0,0 +1,74 @@
+# make sure the CLI/loaders stay quick to import, the mint job
+# and HPI import this often. Heavy libraries should only be
+# imported on the code paths which use them
+
+import os
+import sys
+import subprocess
+from typing import Dict, List, Tuple
+
+# milliseconds, the best of RUNS is compared against these.
+# set BUDGET_IMPORT_TIME_SCALE to loosen these on slow machines
+HELP_BUDGET = 100
+LOAD_BUDGET = 70
+RUNS = 3
+
+SCALE = float(os.environ.get("BUDGET_IMPORT_TIME_SCALE", 1))
+
+HEAVY = {"pandas", "numpy", "git", "textdistance", "logzero", "tzlocal", "pyfiglet"}
+
+
+def importtime(*args: str) -> List[Tuple[str, int]]:
+    """
+    Run python -X importtime, returning each module imported and
+    its cumulative import time (microseconds). Nested imports are indented
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", *args],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        check=True,
+        text=True,
+    )
+    times = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        # skip the header
+        if cumulative.strip().isdigit():
+            times.append((name[1:].rstrip(), int(cumulative)))
+    return times
+
+
+def top_level(times: List[Tuple[str, int]]) -> Dict[str, int]:
+    return {name: t for name, t in times if not name.startswith(" ")}
+
+
+def best_ms(args: List[str]) -> float:
+    # anything python imports on startup isn't the package's fault
+    startup = set(top_level(importtime("-c", "pass")))
+    totals = []
+    for _ in range(RUNS):
+        times = top_level(importtime(*args))
+        totals.append(sum(t for name, t in times.items() if name not in startup))
+    return min(totals) / 1000
+
+
+def test_heavy_imports_are_lazy() -> None:
+    for args in (
+        ["-m", "budget", "--help"],
+        ["-c", "import budget.load.balances, budget.load.transactions"],
+    ):
+        top = {name.strip().split(".")[0] for name, _ in importtime(*args)}
+        assert not (top & HEAVY), (args, top & HEAVY)
+
+
+def test_cli_help_import_time() -> None:
+    ms = best_ms(["-m", "budget", "--help"])
+    assert ms < HELP_BUDGET * SCALE, f"budget --help imports took {ms:.1f}ms"
+
+
+def test_load_import_time() -> None:
+    ms = best_ms(["-c", "import budget.load.balances, budget.load.transactions"])
+    assert ms < LOAD_BUDGET * SCALE, f"importing budget.load took {ms:.1f}ms"
@@ -0,0 +1,203 @@
+import io
+import os
+import subprocess
+from collections import defaultdict
+from datetime import date, timedelta
+from itertools import chain
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import pytest
+
+from budget.load import transactions
+from budget.load.cache import SCHEMA_VERSION, BlobCache, checkpoint_path, write_pickle
+from budget.load.git_history import iter_commit_blobs
+from budget.load.history import History, TRANSACTION_FILE
+from budget.load.transactions import (
+    Transaction,
+    load_dedup_state,
+    read_transaction_obj,
+    read_transactions_history,
+)
+
+from synthetic import RepoSpec, generate  # type: ignore[import]
+
+
+def _git(ddir: Path, *args: str) -> str:
+    return subprocess.run(
+        ["git", "-C", str(ddir), *args], check=True, capture_output=True, text=True
+    ).stdout
+
+
+def _reference_match(
+    seen: Dict[date, List[Transaction]], new: Transaction
+) -> Optional[Transaction]:
+    # how duplicates were matched before the index, one Transaction at a time
+    day_range = transactions.DAY_RANGE
+    if new.name.casefold().strip() in transactions.FORCE_EXACT:
+        day_range = [0]
+    for day in [new.on + timedelta(days=r) for r in day_range]:
+        for tr in seen.get(day, []):
+            if tr == new:
+                return tr
+            if tr.fuzz_equals(new):
+                names = {n.casefold() for n in (tr.name, new.name)}
+                if names & transactions.TEMP_TRANSACTION_NAMES:
+                    return tr
+                if tr.fuzz_text(new):
+                    return tr
+                if tr.amount > transactions.TRANSACTION_DUPLICATE_LIMIT:
+                    return tr
+    return None
+
+
+def _reference(ddir: Path) -> List[Transaction]:
+    """
+    The unique transactions, reading transactions.csv at every commit
+    """
+    seen: Dict[date, List[Transaction]] = defaultdict(list)
+    for sha in _git(ddir, "rev-list", "--reverse", "--first-parent", "HEAD").split():
+        proc = subprocess.run(
+            ["git", "-C", str(ddir), "show", f"{sha}:{TRANSACTION_FILE}"],
+            capture_output=True,
+            text=True,
+        )
+        if proc.returncode != 0:
+            continue
+        for line in read_transaction_obj(io.StringIO(proc.stdout)):
+            tr = Transaction.from_csv_row(line)
+            if _reference_match(seen, tr) is None:
+                seen[tr.on].append(tr)
+    return sorted(chain(*seen.values()), key=lambda t: t.on)
+
+
+def _start(ddir: Path) -> int:
+    # the first commit read_transactions_history would process
+    with History(ddir) as hist:
+        return load_dedup_state(ddir, hist.commits)[1]
+
+
+@pytest.fixture
+def repo(tmp_path: Path) -> Path:
+    path = tmp_path / "data"
+    generate(path, RepoSpec(commits=150, accounts=3, rename_share=0.2, shift_share=0.1))
+    _git(path, "config", "user.email", "test@localhost")
+    _git(path, "config", "user.name", "test")
+    return path
+
+
+def test_transactions_history(repo: Path, cache: Path) -> None:
+    expected = _reference(repo)
+    # cold, then from the blob cache/checkpoint, then parsing in processes
+    assert list(read_transactions_history(repo)) == expected
+    assert list(read_transactions_history(repo)) == expected
+    assert list(read_transactions_history(repo, jobs=2)) == expected
+
+
+def test_checkpoint(repo: Path, cache: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    head = _git(repo, "rev-parse", "HEAD").strip()
+    _git(repo, "reset", "-q", "--hard", "HEAD~40")
+    assert list(read_transactions_history(repo)) == _reference(repo)
+
+    # new commits, only those are processed
+    _git(repo, "reset", "-q", "--hard", head)
+    assert _start(repo) > 0
+    assert list(read_transactions_history(repo)) == _reference(repo)
+
+    # the checkpoint's commit was rewritten
+    _git(repo, "reset", "-q", "--hard", "HEAD~2")
+    _git(repo, "commit", "-q", "--amend", "-m", "rewritten")
+    assert _start(repo) == 0
+    assert list(read_transactions_history(repo)) == _reference(repo)
+    assert _start(repo) > 0
+
+    # changing BUDGET_FORCE_EXACT_DAY changes which rows match
+    monkeypatch.setattr(transactions, "FORCE_EXACT", {"uber", "starbucks #123"})
+    assert _start(repo) == 0
+    assert list(read_transactions_history(repo)) == _reference(repo)
+
+
+def test_window(repo: Path, cache: Path) -> None:
+    expected = _reference(repo)
+    end = expected[-1].on
+    windows = [
+        (end - timedelta(days=20), None),
+        (None, end - timedelta(days=20)),
+        (end - timedelta(days=30), end - timedelta(days=10)),
+    ]
+    for since, until in windows:
+        got = list(read_transactions_history(repo, since=since, until=until))
+        assert got == [
+            t
+            for t in expected
+            if (since is None or t.on >= since) and (until is None or t.on <= until)
+        ]
+
+
+def test_window_chain(tmp_path: Path, cache: Path) -> None:
+    ddir = tmp_path / "data"
+    ddir.mkdir()
+    _git(ddir, "init", "-q")
+    _git(ddir, "config", "user.email", "test@localhost")
+    _git(ddir, "config", "user.name", "test")
+    # the 4th matches the 1st, so the 7th doesn't match anything
+    rows = [f"2022-01-0{d},12.34,Cafe,Checking,Food" for d in (1, 4, 7)]
+    (ddir / TRANSACTION_FILE).write_text(
+        "\n".join(["date,amount,name,account,category", *rows, ""])
+    )
+    _git(ddir, "add", TRANSACTION_FILE)
+    _git(ddir, "commit", "-q", "-m", "transactions")
+
+    def days(since: Optional[date] = None, until: Optional[date] = None) -> List[str]:
+        got = read_transactions_history(ddir, since=since, until=until)
+        return [str(t.on) for t in got]
+
+    assert days() == ["2022-01-01", "2022-01-07"]
+    assert days(since=date(2022, 1, 7)) == ["2022-01-07"]
+    assert days(since=date(2022, 1, 2), until=date(2022, 1, 6)) == []
+
+
+def test_commit_blobs(tmp_path: Path) -> None:
+    ddir = tmp_path / "data"
+    ddir.mkdir()
+    _git(ddir, "init", "-q")
+    _git(ddir, "config", "user.email", "test@localhost")
+    _git(ddir, "config", "user.name", "test")
+
+    def commit(message: str, **files: Optional[str]) -> None:
+        for name, contents in files.items():
+            if contents is None:
+                _git(ddir, "rm", "-q", name)
+            else:
+                (ddir / name).write_text(contents)
+                _git(ddir, "add", name)
+        _git(ddir, "commit", "-q", "-m", message)
+
+    commit("both", **{"a.csv": "1", "b.csv": "1"})
+    commit("untracked", **{"other.txt": "1"})
+    commit("delete b", **{"b.csv": None})
+    commit("change a", **{"a.csv": "2"})
+    commit("add b back", **{"b.csv": "2"})
+
+    commits = list(iter_commit_blobs(ddir, ["a.csv", "b.csv"]))
+    messages = [_git(ddir, "log", "-1", "--format=%s", c.sha).strip() for c in commits]
+    assert messages == ["both", "delete b", "change a", "add b back"]
+    files = [sorted(c.blobs) for c in commits]
+    assert files == [["a.csv", "b.csv"], ["a.csv"], ["a.csv"], ["a.csv", "b.csv"]]
+    assert commits[0].blobs["a.csv"] == commits[1].blobs["a.csv"]
+    assert commits[2].blobs["a.csv"] != commits[1].blobs["a.csv"]
+    assert commits[3].blobs["b.csv"] == _git(ddir, "rev-parse", "HEAD:b.csv").strip()
+
+
+def test_prune_cache(cache: Path) -> None:
+    blobs: BlobCache[int] = BlobCache("transactions", max_size=1000)
+    for i in range(50):
+        blobs.put(f"{i:040x}", list(range(20)))
+    checkpoint = checkpoint_path("dedup", cache)
+    write_pickle(checkpoint, list(range(1000)))
+    # older than every blob, but it's not evicted
+    os.utime(checkpoint, (0, 0))
+    blobs.prune()
+    assert checkpoint.exists()
+    left = list((cache / f"v{SCHEMA_VERSION}" / "transactions").rglob("*"))
+    assert 0 < sum(p.stat().st_size for p in left if p.is_file()) <= 1000
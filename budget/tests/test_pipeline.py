@@ -0,0 +1,36 @@
+from datetime import date
+from typing import List, Optional
+
+from budget.load.transactions import Transaction
+from budget.cleandata.pipeline import MetaCategories, run_stages
+
+
+def _tr(name: str, category: str) -> Transaction:
+    return Transaction(
+        on=date(2021, 1, 1), amount=1.0, name=name, account="", category=category
+    )
+
+
+def test_run_stages() -> None:
+    seen: List[str] = []
+
+    def drop_fees(tr: Transaction) -> Optional[Transaction]:
+        return None if tr.name == "fee" else tr
+
+    def record(tr: Transaction) -> Transaction:
+        seen.append(tr.name)
+        return tr
+
+    meta = MetaCategories({"Coffee Shops": "food"})
+    transactions = [
+        _tr("coffee", "Coffee Shops"),
+        _tr("fee", "Fees"),
+        _tr("other", "Unknown"),
+        _tr("other", "Unknown"),
+    ]
+    result = list(run_stages(transactions, [drop_fees, meta, record]))
+    assert [tr.name for tr in result] == ["coffee", "other", "other"]
+    # stages after the one which dropped a transaction don't see it
+    assert seen == ["coffee", "other", "other"]
+    assert result[0].meta_category == "food"
+    assert meta.missing == {"Unknown": 2}
@@ -0,0 +1,167 @@
+import copy
+import random
+from datetime import date
+from pathlib import Path
+from typing import List, Optional, Type
+
+import pytest
+from pytest import MonkeyPatch
+
+from budget.load.transactions import Transaction
+from budget.cleandata.transactions.rules import (
+    Automaton,
+    CachedRuleSet,
+    Condition,
+    Contains,
+    Equals,
+    Prefix,
+    Regex,
+    Rule,
+    RuleSet,
+)
+
+ALPHABET = "abcAB .'*"
+
+
+def _word(rand: random.Random, longest: int = 4) -> str:
+    return "".join(rand.choices(ALPHABET, k=rand.randint(0, longest)))
+
+
+def _random_rules(rand: random.Random, n: int) -> List[Rule]:
+    rules = []
+    for _ in range(n):
+        conds: List[Condition] = []
+        for _ in range(rand.randint(1, 2)):
+            kinds: List[Type[Condition]] = [Contains, Prefix, Equals, Regex]
+            kind = rand.choice(kinds)
+            field = rand.choice(["name", "name", "category", "account"])
+            values = [_word(rand) for _ in range(rand.randint(1, 3))]
+            if kind is Regex:
+                values = [v.replace("*", ".").replace(".", "a.") + "$" for v in values]
+            conds.append(
+                kind(
+                    *values,
+                    field=field,
+                    exact=rand.random() < 0.2,
+                    ignore=rand.choice(["", "'", "'."]),
+                )
+            )
+        # some rules rename to something which other rules match
+        rules.append(
+            Rule(
+                conds,
+                name=rand.choice([None, _word(rand, 6)]),
+                category=rand.choice([None, _word(rand, 3)]),
+                drop=rand.random() < 0.05,
+            )
+        )
+    return rules
+
+
+def _apply_each(rules: List[Rule], tr: Transaction) -> Optional[Transaction]:
+    # what transform_single does with Matchers, one at a time
+    result: Optional[Transaction] = tr
+    for rule in rules:
+        assert result is not None
+        resp, edit = rule(result)
+        if resp is True:
+            result = list(edit())[-1]
+        if result is None:
+            return None
+    return result
+
+
+def test_condition_needs_test() -> None:
+    class NoTest(Condition):
+        kind = "none"
+
+    with pytest.raises(TypeError):
+        NoTest("a")  # type: ignore[abstract]
+
+
+def test_automaton() -> None:
+    rand = random.Random(0)
+    words = list({_word(rand, 5) for _ in range(200)} - {""})
+    auto = Automaton()
+    for i, word in enumerate(words):
+        auto.add(word, i)
+    auto.build()
+    for _ in range(500):
+        text = _word(rand, 30)
+        expected = {i for i, word in enumerate(words) if word in text}
+        assert auto.search(text) == expected, text
+
+
+def test_ruleset_matches_applying_each_rule() -> None:
+    rand = random.Random(1)
+    for _ in range(20):
+        rules = _random_rules(rand, rand.randint(1, 60))
+        compiled = RuleSet(rules)
+        for _ in range(200):
+            tr = Transaction(
+                on=date(2021, 1, 1),
+                amount=1.0,
+                name=_word(rand, 12),
+                account=_word(rand, 3),
+                category=_word(rand, 3),
+            )
+            expected = _apply_each(rules, copy.copy(tr))
+            assert compiled.apply(copy.copy(tr)) == expected, (tr, rules)
+
+
+def test_cached_ruleset(tmp_path: Path, monkeypatch: MonkeyPatch) -> None:
+    monkeypatch.setenv("BUDGET_CACHE_DIR", str(tmp_path))
+    monkeypatch.delenv("BUDGET_NO_CACHE", raising=False)
+    rand = random.Random(2)
+    rules = _random_rules(rand, 40)
+    transactions = [
+        Transaction(
+            on=date(2021, 1, 1),
+            amount=1.0,
+            name=_word(rand, 6),
+            account=_word(rand, 2),
+            category=_word(rand, 2),
+        )
+        for _ in range(300)
+    ]
+    expected = [RuleSet(rules).apply(copy.copy(tr)) for tr in transactions]
+
+    cached = CachedRuleSet(rules)
+    assert [cached.apply(copy.copy(tr)) for tr in transactions] == expected
+    assert [cached.apply(copy.copy(tr)) for tr in transactions] == expected
+    assert cached.hits >= len(transactions)
+    cached.save()
+
+    # loads the saved results, and doesn't have to apply any rules
+    reloaded = CachedRuleSet(rules)
+    assert [reloaded.apply(copy.copy(tr)) for tr in transactions] == expected
+    assert reloaded.misses == 0
+
+    # different rules, so those results aren't used
+    changed = CachedRuleSet(rules[1:])
+    assert changed.version != cached.version
+    changed.apply(copy.copy(transactions[0]))
+    assert changed.misses == 1
+
+
+def test_transform_run(cache: Path, monkeypatch: MonkeyPatch) -> None:
+    from budget.cleandata.transactions import transform
+    from budget.cleandata.transactions.transform import (  # type: ignore[attr-defined]
+        Transform,
+        transform_all,
+    )
+
+    tr = Transaction(date(2021, 1, 1), 1.0, "some shop", "Card", "Misc")
+
+    def renamed(name: str) -> Optional[str]:
+        monkeypatch.setattr(
+            transform, "custom_maps", lambda: [Rule(Equals("some shop"), name=name)]
+        )
+        got = list(transform_all([copy.copy(tr)]))
+        return got[0].name if got else None
+
+    assert renamed("Shop") == "Shop"
+    # each run compiles the rules again, so edits apply straight away
+    assert renamed("Other") == "Other"
+    monkeypatch.setenv("BUDGET_NO_CACHE", "1")
+    assert not any(step.persist for step in Transform().cached)
@@ -0,0 +1,76 @@
+import random
+from typing import List
+
+import textdistance  # type: ignore[import]
+
+from budget.load.similarity import full_overlap, lcs_length, names_match
+
+NAMES = [
+    "",
+    "a",
+    "CREDIT",
+    "debit",
+    "Starbucks",
+    "STARBUCKS STORE 12345",
+    "Starbucks #123",
+    "SPOTIFY USA",
+    "Spotify",
+    "Lyft *ride Sun 8pm",
+    "LYFT   *RIDE",
+    "Uber",
+    "UBER *TRIP",
+    "AMAZON PRIME",
+    "Amzn Mktp US*2K4",
+    "McDonald's",
+    "MCDONALDS F1234",
+    "Dennys 12",
+    "DoorDash*Chipotle",
+    "Chipotle 0123",
+    "github.com",
+    "GITHUB.COM/SPONSORS",
+    "Trader Joes",
+    "Trader Joe's #55",
+    "transfer to savings",
+    "Transfer",
+    "cab",
+    "abc",
+    "aab",
+]
+
+
+def _textdistance_fuzz_text(one: str, two: str) -> bool:
+    # Transaction.fuzz_text, before it used budget.load.similarity
+    t = one.casefold()
+    o = two.casefold()
+    for left, right in ((t, o), (t.replace(" ", ""), o.replace(" ", ""))):
+        if textdistance.algorithms.overlap(left, right) == 1.0:
+            return True
+        overlap_str = textdistance.algorithms.lcsseq(left, right)
+        if (
+            len(overlap_str) > 0.8 * min(len(left), len(right))
+            or len(overlap_str) > 8
+        ):
+            return True
+    return False
+
+
+def _random_names(n: int) -> List[str]:
+    rand = random.Random(0)
+    alphabet = "abcdeSTAR *#'.0123"
+    return ["".join(rand.choices(alphabet, k=rand.randint(0, 24))) for _ in range(n)]
+
+
+def test_kernel_matches_textdistance() -> None:
+    names = NAMES + _random_names(60)
+    for left in names:
+        for right in names:
+            assert lcs_length(left, right) == len(
+                textdistance.algorithms.lcsseq(left, right)
+            ), (left, right)
+            assert full_overlap(left, right) == (
+                textdistance.algorithms.overlap(left, right) == 1.0
+            ), (left, right)
+            assert names_match(left, right) == _textdistance_fuzz_text(left, right), (
+                left,
+                right,
+            )
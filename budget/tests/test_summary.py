@@ -0,0 +1,90 @@
+import random
+from datetime import date, timedelta
+
+import pandas as pd  # type: ignore[import]
+import pytest
+
+from budget.analyze.cube import SpendingCube
+from budget.analyze.summary import Spending, describe_spending, parse_window
+
+TODAY = date(2022, 6, 1)
+
+
+def _transactions(n: int) -> pd.DataFrame:
+    rand = random.Random(0)
+    return pd.DataFrame(
+        {
+            "on": [TODAY - timedelta(days=rand.randint(-2, 500)) for _ in range(n)],
+            "amount": [
+                rand.choice([5.0, 10.0, round(rand.uniform(1, 300), 2)])
+                for _ in range(n)
+            ],
+            "name": [rand.choice("abcd") for _ in range(n)],
+            "account": [rand.choice("xy") for _ in range(n)],
+            "category": [rand.choice(["Food", "Travel", None]) for _ in range(n)],
+            "meta_category": [rand.choice(["Food", "Misc"]) for _ in range(n)],
+        }
+    )
+
+
+def test_spending_windows() -> None:
+    df = _transactions(2000)
+    spending = Spending(df, today=TODAY)
+    for days in (None, 1, 30, 90, 365, 1000):
+        window = df if days is None else df[TODAY - df["on"] < timedelta(days=days)]
+        start = spending.start(days)
+        assert len(spending) - start == len(window)
+        assert spending.total(start) == pytest.approx(window["amount"].sum())
+        for by in ("category", "meta_category"):
+            expected = window.groupby([by])["amount"].sum()
+            totals = spending.by(by, start)["amount"]
+            assert totals.to_dict() == pytest.approx(expected.to_dict())
+        largest = spending.largest(start, 25)
+        assert list(largest["amount"]) == sorted(window["amount"], reverse=True)[:25]
+        assert len(spending.largest(start)) == len(window)
+
+
+def test_describe_spending(capsys: pytest.CaptureFixture[str]) -> None:
+    df = _transactions(200)
+    described = describe_spending(df, "everything", print_count=5)
+    assert "everything spending" in capsys.readouterr().out
+    assert list(described["amount"]) == sorted(df["amount"], reverse=True)
+
+
+def test_parse_window() -> None:
+    assert parse_window("30").days == 30
+    window = parse_window("all:all:meta_category")
+    assert (window.days, window.print_count, window.by) == (None, True, "meta_category")
+    for bad in ("", "x", "0", "7:0", "7:5:nope", "7:5:category:extra"):
+        with pytest.raises(ValueError):
+            parse_window(bad)
+
+
+def test_spending_cube() -> None:
+    df = _transactions(2000)
+    cube = SpendingCube().update(df)
+    assert cube.query("meta_category")["count"].sum() == len(df)
+    assert cube.query("month")["sum"].sum() == pytest.approx(df["amount"].sum())
+
+    # adding a transaction only updates its month
+    added = pd.concat([df, df.iloc[:1].assign(amount=123.45)], ignore_index=True)
+    cube.update(added)
+    assert len(cube.updated) == 1
+    fresh = SpendingCube().update(added)
+    pd.testing.assert_frame_equal(
+        cube.query(["month", "category"]), fresh.query(["month", "category"])
+    )
+
+    # totals for the whole months come from the cube
+    with_cube = Spending(added, today=TODAY, cube=cube)
+    without = Spending(added, today=TODAY)
+    for days in (None, 1, 30, 45, 365):
+        start = without.start(days)
+        for by in ("category", "meta_category"):
+            pd.testing.assert_frame_equal(
+                with_cube.by(by, start), without.by(by, start)
+            )
+
+    compared = cube.compare("2022-05", "2022-04", by="meta_category")
+    may = added[pd.to_datetime(added["on"]).dt.strftime("%Y-%m") == "2022-05"]
+    assert compared["current"].sum() == pytest.approx(may["amount"].sum())